@@ -1,31 +1,13 @@
 import json
 import zmq
 from tabulate import tabulate
+from tag_codec import TAG_NAMES, decode_segments
+import wire
 
 def pretty_ack(ack_msg):
-    field_names = {
-        '35': 'Message Type',
-        '49': 'Sender Comp ID',
-        '37': 'Order ID',
-        '38': 'Order Quantity',
-        '40': 'Order Type',
-        '44': 'Price',
-        '52': 'Sending Time',
-        '54': 'Side',
-        '6404': 'POV Target Percentage',
-        '55': 'Trading Pair'
-    }
-
     def parse_ack_segment(segment):
-        # Split the acknowledgment segment by semicolon
-        segments = segment.split(';')
-        # Create a dictionary to hold the parsed segments
-        ack_data = {}
-        for seg in segments:
-            key, sep, value = seg.partition('=')
-            # Use the human-readable field name if available, otherwise use the field tag
-            field_name = field_names.get(key, key)
-            ack_data[field_name] = value
+        # Use the human-readable field name if available, otherwise use the field tag
+        ack_data = {TAG_NAMES.get(key, key): value for key, value in decode_segments(segment).items()}
 
         # Use string formatting to create a structured output
         formatted_ack = '\n'.join([f"{key}: {value}" for key, value in ack_data.items()])
@@ -74,6 +56,59 @@ def print_order_book(order_book_data):
     
     print(f"Bids:\n{bids_table}\nAsks:\n{asks_table}")
 
+def print_order_book_l2(order_book_data):
+    # Aggregated levels, [price, total qty, order count], bids and asks side by side
+    bids = order_book_data.get('bids', [])
+    asks = order_book_data.get('asks', [])
+    rows = []
+    for i in range(max(len(bids), len(asks))):
+        bid = bids[i] if i < len(bids) else ['', '', '']
+        ask = asks[i] if i < len(asks) else ['', '', '']
+        rows.append([bid[2], bid[1], bid[0], ask[0], ask[1], ask[2]])
+    print(f"{order_book_data.get('instrument')} seq {order_book_data.get('seq')}")
+    print(tabulate(rows, headers=['Orders', 'Bid Qty', 'Bid', 'Ask', 'Ask Qty', 'Orders'], tablefmt='pretty'))
+
+def print_stats(stats):
+    # Engine stats, latency rows only when the engine runs with --metrics
+    latency = stats.pop('latency', None)
+    print(tabulate([(key, value) for key, value in stats.items()], tablefmt='pretty'))
+    if latency:
+        print(tabulate([{'stage': name, **summary} for name, summary in latency.items()], headers='keys',
+                       tablefmt='pretty'))
+
+def print_profile(profile):
+    print(f"{profile['iterations']} iterations, {profile['seconds']}s profiled, written to {profile['file']}")
+    print(tabulate(profile['top'], headers='keys', tablefmt='pretty'))
+
+def print_executed_trades(page):
+    trades = page.get('trades', [])
+    print(tabulate(trades, headers='keys', tablefmt='pretty') if trades else "No executed trades")
+    if page.get('next_cursor') is not None:
+        print(f"more trades: request again with cursor={page['next_cursor']}")
+
+def show_ack(ack_msg):
+    # Binary frames are shown as their tag=value equivalent
+    ack_msg = wire.to_text(ack_msg) if wire.is_binary(ack_msg) else ack_msg.decode()
+    print("----------start--------------")
+    # Check if the message is an order book message
+    if ack_msg.startswith('order_book;'):
+    
+        order_book_data = json.loads(ack_msg.split(';', 1)[1])
+        print_order_book(order_book_data)
+    elif ack_msg.startswith('order_book_l2;{'):
+        print_order_book_l2(json.loads(ack_msg.split(';', 1)[1]))
+    elif ack_msg.startswith('retrieve_executed_trades;{'):
+        print_executed_trades(json.loads(ack_msg.split(';', 1)[1]))
+    elif ack_msg.startswith('stats;{'):
+        print_stats(json.loads(ack_msg.split(';', 1)[1]))
+    elif ack_msg.startswith('profile;{"file"'):
+        print_profile(json.loads(ack_msg.split(';', 1)[1]))
+    else:
+        print("Received Acknowledgement message:")
+        print(f"Raw Ack: {ack_msg}")
+        print(f"Parsed Ack: {pretty_ack(ack_msg)}\n")
+    print("----------end--------------")
+
 def listen_for_acks():
     context = zmq.Context()
     
@@ -88,19 +123,9 @@ def listen_for_acks():
     
     try:
         while True:
-            # Receive acknowledgement messages
-            ack_msg = subscriber.recv_string()
-            print("----------start--------------")
-            # Check if the message is an order book message
-            if ack_msg.startswith('order_book;'):
-            
-                order_book_data = json.loads(ack_msg.split(';', 1)[1])
-                print_order_book(order_book_data)
-            else:
-                print("Received Acknowledgement message:")
-                print(f"Raw Ack: {ack_msg}")
-                print(f"Parsed Ack: {pretty_ack(ack_msg)}\n")
-            print("----------end--------------")
+            # [SenderCompID topic, ack, ...], a batching engine sends several acks for one client together
+            for ack_msg in subscriber.recv_multipart()[1:]:
+                show_ack(ack_msg)
     except KeyboardInterrupt:
         print("Stopped listening for acks.")
     finally:
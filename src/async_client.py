@@ -0,0 +1,272 @@
+import asyncio
+import json
+import random
+import string
+import time
+from collections import deque
+from itertools import count
+from typing import Callable, Dict, Optional
+
+import zmq
+import zmq.asyncio
+
+import wire
+from tag_codec import ack_topic, decode, decode_market_data
+
+# Headless asyncio client: every request returns a future that the engine's reply on the ack feed
+# resolves, so any number of orders can be in flight at once.
+#
+#   async with AsyncTradingClient() as client:
+#       order = await client.place_order("BTCUSDT", "1", 0.5, 30000.0)   # accepted
+#       await client.cancel(order.order_id)                               # True, or False if it already filled
+#       book = await client.book("BTCUSDT")
+#
+# The client only subscribes to its own SenderCompID's topic, every request carries 49= so the engine
+# routes the reply there. Replies are matched to requests by OrderID (orders, fills, cancels), by
+# instrument (books) and by the "PAIR USER" line the engine sends ahead of a trades page. Nothing
+# times out on its own, wrap awaits in asyncio.wait_for when the engine may not be there.
+
+ORDER_ENDPOINT = "tcp://127.0.0.1:5557"
+ACK_FEED_ENDPOINT = "tcp://127.0.0.1:5560"
+MARKET_DATA_ENDPOINT = "tcp://127.0.0.1:5556"
+CONNECT_DELAY = 0.3  # PUB/SUB drop what is sent before the connection is up
+DRAIN_LIMIT = 1000  # frames read per wakeup before other tasks get the loop back
+
+
+class ClientOrder:
+    __slots__ = ('order_id', 'pair', 'side', 'qty', 'price', 'leaves_qty', 'fills', 'accepted', 'done', 'sent_ns')
+
+    def __init__(self, order_id: str, pair: str, side: str, qty: float, price: float, loop):
+        self.order_id = order_id
+        self.pair = pair
+        self.side = side
+        self.qty = qty
+        self.price = price
+        self.leaves_qty = qty
+        self.fills = []  # [(filled qty, execution price)]
+        self.accepted = loop.create_future()  # resolves to this order once the engine booked it
+        self.done = loop.create_future()  # resolves to "filled" or "canceled"
+        self.sent_ns = time.perf_counter_ns()
+
+    def __repr__(self):
+        return f"ClientOrder({self.order_id} {self.pair} {self.side} {self.qty}@{self.price} leaves {self.leaves_qty})"
+
+
+class AsyncTradingClient:
+    def __init__(self, sender_comp_id: str = None, encoding: str = "text", quotes: bool = False,
+                 on_fill: Callable[[ClientOrder, float, float], None] = None,
+                 order_endpoint: str = ORDER_ENDPOINT, ack_endpoint: str = ACK_FEED_ENDPOINT,
+                 market_data_endpoint: str = MARKET_DATA_ENDPOINT):
+        if encoding not in wire.ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding}, expected one of {wire.ENCODINGS}")
+        self.sender_comp_id = sender_comp_id or ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        self.encoding = encoding
+        self.on_fill = on_fill  # called as on_fill(order, qty, execution price) for every execution
+        # OrderIDs are a per-session prefix and a counter: unique across clients, so the OrderID that is
+        # all a cancel reply carries is enough to find the request. 6 + 10 digits fit the binary field.
+        self._session = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
+        self._ids = count(1)
+        self.orders: Dict[str, ClientOrder] = {}  # open orders: sent and not yet filled or canceled
+        self.quotes: Dict[str, tuple] = {}  # {instrument: (bid, ask)} with quotes=True
+        self._cancels: Dict[str, deque] = {}  # {OrderID: futures of its cancel requests}
+        self._books: Dict[str, deque] = {}  # {instrument: futures of its book requests}
+        self._trades: Dict[str, deque] = {}  # {instrument: futures of its trades requests}
+        self._trades_for = None  # instrument of the trades page the engine announced next
+        self._want_quotes = quotes
+        self._endpoints = (order_endpoint, ack_endpoint, market_data_endpoint)
+        self._context = None
+        self._tasks = []
+
+    async def start(self):
+        order_endpoint, ack_endpoint, market_data_endpoint = self._endpoints
+        self._context = zmq.asyncio.Context()
+        # Only waiting for input goes through asyncio: sends and the reads after a wakeup are plain zmq
+        # calls, a zmq.asyncio future per frame costs more than handling the frame
+        self._orders = zmq.Context.shadow(self._context.underlying).socket(zmq.PUB)
+        self._orders.connect(order_endpoint)
+        self._acks = self._context.socket(zmq.SUB)
+        self._acks.connect(ack_endpoint)
+        self._acks.setsockopt(zmq.SUBSCRIBE, ack_topic(self.sender_comp_id))
+        self._tasks.append(asyncio.create_task(self._read_acks()))
+        if self._want_quotes:
+            self._market_data = self._context.socket(zmq.SUB)
+            self._market_data.connect(market_data_endpoint)
+            self._market_data.setsockopt_string(zmq.SUBSCRIBE, "Q")
+            self._tasks.append(asyncio.create_task(self._read_quotes()))
+        await asyncio.sleep(CONNECT_DELAY)
+        return self
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._context is not None:
+            self._orders.close(linger=0)  # made by a plain shadow context, not tracked by self._context
+            self._context.destroy(linger=0)
+            self._context = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _send(self, payload):
+        # PUB never blocks, it drops at the high water mark
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._orders.send(payload)
+
+    def place_order(self, pair: str, side: str, qty: float, price: float) -> asyncio.Future:
+        """
+        Sends a limit order, side "1" buy or "2" sell. The future resolves to its ClientOrder once booked;
+        the order's .done future resolves when it is filled or canceled.
+        """
+        order_id = f"{self._session}{next(self._ids)}"
+        order = ClientOrder(order_id, pair, side, qty, price, asyncio.get_running_loop())
+        self.orders[order_id] = order
+        sending_time = time.time_ns() // 1_000_000
+        if self.encoding == "binary":
+            self._send(wire.pack_order("D", order_id, qty, "2", price, self.sender_comp_id, sending_time, side,
+                                       0.0, pair))
+        else:
+            self._send(f"0;35=D;49={self.sender_comp_id};37={order_id};38={qty};40=2;44={price};"
+                       f"52={sending_time};54={side};6404=0.0;55={pair}")
+        return order.accepted
+
+    def cancel(self, order_id: str) -> asyncio.Future:
+        # Resolves to True if the engine canceled it, False if it was no longer resting
+        future = asyncio.get_running_loop().create_future()
+        self._cancels.setdefault(order_id, deque()).append(future)
+        if self.encoding == "binary":
+            self._send(wire.pack_cancel(self.sender_comp_id, order_id))
+        else:
+            self._send(f"1;49={self.sender_comp_id};37={order_id}")
+        return future
+
+    def book(self, pair: str, depth: int = 10) -> asyncio.Future:
+        # Resolves to {"instrument", "seq", "bids": [[price, qty, orders], ...], "asks"}
+        future = asyncio.get_running_loop().create_future()
+        self._books.setdefault(pair, deque()).append(future)
+        self._send(f"2;order_book;{pair};depth={int(depth)};49={self.sender_comp_id}")
+        return future
+
+    def trades(self, pair: str, **params: int) -> asyncio.Future:
+        # This client's executed trades, resolves to {"trades": [...], "next_cursor"}; params since/until/limit/cursor
+        future = asyncio.get_running_loop().create_future()
+        self._trades.setdefault(pair, deque()).append(future)
+        query = ''.join(f";{name}={int(value)}" for name, value in params.items())
+        self._send(f"3;49={self.sender_comp_id};55={pair}{query}")
+        return future
+
+    @staticmethod
+    async def _drain(socket):
+        # Yields every multipart message queued on socket, waiting in asyncio when there are none
+        sync = zmq.Socket.shadow(socket.underlying)
+        while True:
+            await socket.poll(flags=zmq.POLLIN)
+            for _ in range(DRAIN_LIMIT):
+                try:
+                    yield sync.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+            await asyncio.sleep(0)
+
+    async def _read_acks(self):
+        # [our topic, ack, ...], a batching engine sends several acks as one multipart message
+        async for frames in self._drain(self._acks):
+            for frame in frames[1:]:
+                self._dispatch(frame)
+
+    async def _read_quotes(self):
+        async for frames in self._drain(self._market_data):
+            frame = frames[0]
+            if wire.is_binary(frame):
+                try:
+                    instrument, _, bid, _, ask, *_ = wire.unpack_quote(frame)
+                except ValueError:  # wire.FrameError, not a quote this client can read
+                    continue
+            else:
+                fields = decode_market_data(frame.decode())
+                instrument = fields.get('instrument')
+                bid, ask = float(fields.get('best_bid_price', 'nan')), float(fields.get('best_ask_price', 'nan'))
+            self.quotes[instrument] = (bid, ask)
+
+    def _dispatch(self, frame: bytes):
+        if wire.is_binary(frame):
+            if wire.frame_kind(frame) == wire.KIND_ACK:
+                try:
+                    ack = wire.unpack_ack(frame)
+                except ValueError:  # wire.FrameError
+                    return
+                self._on_ack(*ack)
+            return
+        text = frame.decode(errors='replace')
+        if text.startswith("35="):
+            fields = decode(text)
+            self._on_ack(fields.get('56'), fields.get('35'), fields.get('37'), float(fields.get('38', 0)),
+                         float(fields.get('44', 0)), float(fields['1000']) if '1000' in fields else None,
+                         float(fields['151']) if '151' in fields else None)
+        elif text.startswith("cancel_order;Order "):
+            self._on_cancel(text[len("cancel_order;Order "):])
+        elif text.startswith("order_book_l2;{"):
+            book = json.loads(text[len("order_book_l2;"):])
+            self._resolve(self._books, book.get('instrument'), book)
+        elif text.startswith("retrieve_executed_trades;{"):
+            pair, self._trades_for = self._trades_for, None
+            if pair is not None:
+                self._resolve(self._trades, pair, json.loads(text[len("retrieve_executed_trades;"):]))
+        elif text.endswith(f" {self.sender_comp_id}"):  # "PAIR USER" ahead of our trades page
+            self._trades_for = text.split(' ', 1)[0]
+
+    def _on_ack(self, target, msg_type, order_id, qty, price, action_price, leaves_qty):
+        if target != self.sender_comp_id:
+            return
+        order = self.orders.get(order_id)
+        if order is None:
+            return
+        if msg_type == "3":  # booked
+            if not order.accepted.done():
+                order.accepted.set_result(order)
+        elif msg_type == "4":  # execution
+            order.fills.append((qty, action_price))
+            order.leaves_qty = leaves_qty if leaves_qty is not None else max(order.leaves_qty - qty, 0.0)
+            if not order.accepted.done():  # filled before its booking ack was read
+                order.accepted.set_result(order)
+            if self.on_fill is not None:
+                self.on_fill(order, qty, action_price)
+            if order.leaves_qty <= 0:
+                self._finish(order, "filled")
+
+    def _on_cancel(self, body: str):
+        # "ID canceled" or "ID not found"
+        if body.endswith(" canceled"):
+            order_id, canceled = body[:-len(" canceled")], True
+        elif body.endswith(" not found"):
+            order_id, canceled = body[:-len(" not found")], False
+        else:
+            return
+        if order_id not in self._cancels:
+            return  # someone else's
+        self._resolve(self._cancels, order_id, canceled)
+        order = self.orders.get(order_id)
+        if canceled and order is not None:
+            self._finish(order, "canceled")
+
+    def _finish(self, order: ClientOrder, status: str):
+        del self.orders[order.order_id]
+        if not order.done.done():
+            order.done.set_result(status)
+
+    @staticmethod
+    def _resolve(pending: Dict[str, deque], key: Optional[str], result):
+        # Oldest request first, the engine answers in order
+        futures = pending.get(key)
+        while futures:
+            future = futures.popleft()
+            if not future.done():  # skip ones the caller gave up on
+                future.set_result(result)
+                break
+        if futures is not None and not futures:
+            del pending[key]
@@ -0,0 +1,2 @@
+# Benchmarks for the exchange components, run from src/:
+#   poetry run python -m benchmarks.order_memory
@@ -0,0 +1,59 @@
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from book_ticker_cache import build_cache, iter_rows, load_book_ticker
+
+
+def write_synthetic_csv(path, rows):
+    rng = random.Random(7)
+    price = 30000.0
+    event_time = 1700000000000
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['update_id', 'best_bid_price', 'best_bid_qty', 'best_ask_price', 'best_ask_qty',
+                         'transaction_time', 'event_time'])
+        for update_id in range(rows):
+            price += rng.choice((-0.01, 0.0, 0.01))
+            event_time += rng.randint(0, 3)
+            writer.writerow([update_id, f'{price:.2f}', f'{rng.random():.3f}', f'{price + 0.01:.2f}',
+                             f'{rng.random():.3f}', event_time - 1, event_time])
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bookTicker CSV parse vs columnar cache load")
+    parser.add_argument("-n", type=int, default=1_000_000, help="rows in the synthetic CSV")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'BTCUSDT-bookTicker.csv')
+        write_synthetic_csv(path, args.n)
+
+        def parse_csv():
+            with open(path, newline='') as file:
+                return list(csv.reader(file))[1:]
+
+        csv_s, rows = timed(parse_csv)
+        build_s, _ = timed(lambda: build_cache(path))
+        load_s, columns = timed(lambda: load_book_ticker(path))
+        iterate_s, count = timed(lambda: sum(1 for _ in iter_rows(columns)))
+        assert count == len(rows)
+
+    print(f"{args.n:,} rows")
+    print(f"{'csv.reader, full parse':32} {csv_s * 1000:10.1f} ms")
+    print(f"{'build cache (once)':32} {build_s * 1000:10.1f} ms")
+    print(f"{'load cache (mmap)':32} {load_s * 1000:10.1f} ms")
+    print(f"{'iterate cached rows':32} {iterate_s * 1000:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
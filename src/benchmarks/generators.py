@@ -0,0 +1,66 @@
+import random
+from typing import Iterator, List
+
+from exchange import Order
+from tag_codec import MARKET_DATA_TOPIC, encode_quote
+
+# Synthetic bookTicker quotes and client orders, deterministic for a given seed so two runs of
+# the suite (or two versions of the code) see exactly the same message stream.
+
+START_PRICE = 30000.0
+TICK = 0.01
+
+
+def instruments(count: int) -> List[str]:
+    names = ['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'BNBUSDT', 'XRPUSDT', 'ADAUSDT', 'DOGEUSDT', 'AVAXUSDT']
+    return [names[i] if i < len(names) else f'SYN{i}USDT' for i in range(count)]
+
+
+def clients(count: int) -> List[str]:
+    return [f'USER{i:04d}' for i in range(count)]
+
+
+def quote_rows(n: int, pairs: List[str], seed: int = 7) -> Iterator[tuple]:
+    """
+    (instrument, row) with row in QUOTE_KEYS order, a random walk per instrument, 1 tick spread.
+    """
+    rng = random.Random(seed)
+    mids = {pair: START_PRICE for pair in pairs}
+    event_time = 1_700_000_000_000
+    for update_id in range(n):
+        pair = pairs[update_id % len(pairs)]
+        mid = mids[pair] = round(mids[pair] + rng.choice((-TICK, 0.0, TICK)), 2)
+        event_time += rng.randint(0, 3)
+        yield pair, (update_id, f'{mid:.2f}', f'{rng.random() * 5:.3f}', f'{mid + TICK:.2f}',
+                     f'{rng.random() * 5:.3f}', event_time - 1, event_time)
+
+
+def quote_messages(n: int, pairs: List[str], seed: int = 7) -> List[str]:
+    # As the streamer publishes them, topic included
+    return [f"{MARKET_DATA_TOPIC}{encode_quote(pair, row)}" for pair, row in quote_rows(n, pairs, seed)]
+
+
+def order_fields(n: int, users: List[str], pairs: List[str], seed: int = 11, spread: float = 50.0,
+                 id_prefix: str = 'o') -> Iterator[tuple]:
+    """
+    Order.__init__ arguments. Buys below and sells above the start price, within spread, so a
+    resting book built from them doesn't cross until quotes walk into it.
+    """
+    rng = random.Random(seed)
+    for i in range(n):
+        side = '1' if i % 2 == 0 else '2'
+        offset = round(rng.random() * spread, 2) + TICK
+        price = START_PRICE - offset if side == '1' else START_PRICE + TICK + offset
+        yield ('D', f'{id_prefix}{i}', round(0.1 + rng.random(), 3), '2', round(price, 2), users[i % len(users)],
+               1_700_000_000_000 + i, side, 0.0, pairs[i % len(pairs)])
+
+
+def order_messages(n: int, users: List[str], pairs: List[str], seed: int = 11, **kwargs) -> List[str]:
+    return [f"0;35={msg_type};49={sender};37={order_id};38={qty};40={ord_type};44={price};52={sending_time};"
+            f"54={side};6404={pov};55={pair}"
+            for msg_type, order_id, qty, ord_type, price, sender, sending_time, side, pov, pair
+            in order_fields(n, users, pairs, seed, **kwargs)]
+
+
+def orders(n: int, users: List[str], pairs: List[str], seed: int = 11, **kwargs) -> List[Order]:
+    return [Order(*fields) for fields in order_fields(n, users, pairs, seed, **kwargs)]
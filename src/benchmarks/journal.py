@@ -0,0 +1,95 @@
+import argparse
+import glob
+import logging
+import os
+import tempfile
+import time
+
+from exchange import BidAskQueue, Order
+from journal import Journal, encode_order
+
+
+def make_orders(n):
+    # Buys that never fill, there is no market data here
+    return [Order('D', str(i), 1.0, '2', 1000.0 + i % 500 / 100, f'USER{i % 100}', i, '1', 0.0, 'BTCUSDT')
+            for i in range(n)]
+
+
+def book_orders(journal, n):
+    orders = make_orders(n)
+    book = BidAskQueue("top")
+    book.journal = journal
+    start = time.perf_counter()
+    for i, order in enumerate(orders):
+        book.add_client_order(order)
+        if journal is not None and i % 64 == 63:  # one commit per engine loop iteration of 64 orders
+            journal.commit()
+    if journal is not None:
+        journal.commit()
+    return time.perf_counter() - start, book, orders
+
+
+def main():
+    parser = argparse.ArgumentParser(description="journal append cost and recovery time")
+    parser.add_argument("-n", type=int, default=200000, help="orders journaled")
+    parser.add_argument("--mmap", action="store_true", help="memory-mapped journal writes")
+    parser.add_argument("--keep", type=float, default=0.1,
+                        help="fraction of orders still resting at the end, the rest are cancelled")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Book fresh orders without and with the journal attached, best of 3 each, interleaved
+        plain_s = journaled_s = float('inf')
+        for attempt in range(3):
+            plain_s = min(plain_s, book_orders(None, args.n)[0])
+            for path in glob.glob(os.path.join(directory, '*')):
+                os.remove(path)
+            journal = Journal(directory, fsync_ms=5.0, use_mmap=args.mmap)
+            journal.start()
+            elapsed, book, orders = book_orders(journal, args.n)
+            journaled_s = min(journaled_s, elapsed)
+            if attempt < 2:  # the last run is kept for the recovery measurements
+                journal.close()
+
+        # Most orders get cancelled: the journal keeps the whole history, a snapshot only what rests
+        resting = int(args.n * args.keep)
+        for order in orders[resting:]:
+            book.cancel_order(order.OrderID, order.SenderCompID)
+        journal.commit()
+
+        start = time.perf_counter()
+        for _ in range(100000):
+            encode_order(orders[0])
+        encode_ns = (time.perf_counter() - start) / 100000 * 1e9
+
+        def recover():
+            restored = BidAskQueue("top")
+            started = time.perf_counter()
+            for kind, values in Journal(directory).replay():
+                restored.apply_record(kind, values)
+            assert len(restored.client_orders) == resting
+            return time.perf_counter() - started
+
+        replay_s = recover()
+        # The engine thread only waits for snapshot() itself, the write and fsyncs happen in the background
+        start = time.perf_counter()
+        journal.snapshot(book.snapshot_records())
+        pause_s = time.perf_counter() - start
+        journal.join_snapshot()
+        snapshot_s = time.perf_counter() - start
+        journal.close()
+        snapshot_replay_s = recover()
+
+    print(f"{args.n:,} orders, {resting:,} still resting, {'mmap' if args.mmap else 'write+fsync'} journal")
+    print(f"{'book only':34} {plain_s / args.n * 1e9:10.0f} ns/order")
+    print(f"{'book + journal (group commit)':34} {journaled_s / args.n * 1e9:10.0f} ns/order")
+    print(f"{'encode_order':34} {encode_ns:10.0f} ns")
+    print(f"{'recover from journal':34} {replay_s:10.3f} s")
+    print(f"{'snapshot: engine thread paused':34} {pause_s:10.3f} s")
+    print(f"{'snapshot: written and fsynced':34} {snapshot_s:10.3f} s")
+    print(f"{'recover from snapshot':34} {snapshot_replay_s:10.3f} s")
+
+
+if __name__ == "__main__":
+    main()
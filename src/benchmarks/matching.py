@@ -0,0 +1,70 @@
+import argparse
+import logging
+import random
+import time
+
+from exchange import BidAskQueue, Order
+
+# Matching cost per event against books of growing depth. Each event only touches the top of the
+# MatchQueues and one price level, so ns/event should grow with log(resting orders), not with the count.
+
+
+def resting_book(n, rng):
+    # n client orders around 30000, bids below 29999 and asks above 30001, nothing crossing
+    book = BidAskQueue("top")
+    for i in range(n):
+        if i % 2:
+            price = round(30001.0 + rng.random() * 100, 2)
+            side = '2'
+        else:
+            price = round(29999.0 - rng.random() * 100, 2)
+            side = '1'
+        book.add_client_order(Order('D', f'r{i}', 1.0, '2', price, f'USER{i % 100}', i, side, 0.0, 'BTCUSDT'))
+    book.apply_quote('BTCUSDT', 0, 29999.5, 5.0, 30000.5, 5.0, 0, 0)
+    return book
+
+
+def events(book, count, rng):
+    # A mix of what the engine sees: quotes that don't cross, quotes whose qty lifts the best client order,
+    # aggressive client orders that partially fill against the book, passive orders and cancels
+    filled = []
+    start = time.perf_counter()
+    for i in range(count):
+        kind = i % 5
+        if kind == 0:  # quote inside the spread
+            book.apply_quote('BTCUSDT', i, 29999.5, 5.0, 30000.5, 5.0, i, i)
+        elif kind == 1:  # quote through the best bid, fills part of it
+            best = book.best_bid('BTCUSDT')
+            book.apply_quote('BTCUSDT', i, best - 1.0, 1.0, best - 0.01, 0.4, i, i)
+        elif kind == 2:  # aggressive sell for 1.5: fills one order and part of the next, rests nothing
+            book.add_client_order(Order('D', f'a{i}', 1.5, '2', 29000.0, 'TAKER', i, '2', 0.0, 'BTCUSDT'))
+        elif kind == 3:  # passive buy, rests; replaces the qty the fills above take out
+            book.add_client_order(Order('D', f'p{i}', 2.5, '2', round(29999.0 - rng.random() * 100, 2), 'MAKER',
+                                        i, '1', 0.0, 'BTCUSDT'))
+        else:  # cancel an older passive buy, if it is still resting
+            book.cancel_order(f'p{i - 51}', 'MAKER')
+        book.fill_orders(filled)
+        filled.clear()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="price-time matching cost per event vs book depth")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="resting orders, comma separated")
+    parser.add_argument("-n", type=int, default=100_000, help="events timed per book size")
+    parser.add_argument("--target", type=int, default=20_000,
+                        help="events/s every book size has to sustain, one core, fills and trade records included")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print(f"{'resting orders':>16} {'ns/event':>10} {'events/s':>12}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        rng = random.Random(7)
+        book = resting_book(size, rng)
+        elapsed = min(events(book, args.n, rng) for _ in range(3))
+        rate = args.n / elapsed
+        print(f"{size:>16,} {elapsed / args.n * 1e9:10.0f} {rate:12,.0f}  {'ok' if rate >= args.target else 'BELOW TARGET'}")
+
+
+if __name__ == "__main__":
+    main()
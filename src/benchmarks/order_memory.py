@@ -0,0 +1,99 @@
+import argparse
+import gc
+import tracemalloc
+
+from exchange import BidAskQueue, ExtendedAck, Order
+
+
+class DictOrder:
+    # Layout of Order before it was slotted: a plain instance __dict__ per order
+    def __init__(self, msg_type, order_id, order_qty, ord_type, price,
+                 sender_comp_id, sending_time, side, pov_target_percentage, trading_pair):
+        self.MsgType = msg_type
+        self.OrderID = order_id
+        self.OrderQty = order_qty
+        self.OrdType = ord_type
+        self.Price = price
+        self.SenderCompID = sender_comp_id
+        self.SendingTime = sending_time
+        self.Side = side
+        self.POVTargetPercentage = pov_target_percentage
+        self.TradingPair = trading_pair
+
+
+class DictAck:
+    def __init__(self, target_comp_id, msg_type, order_id, order_qty, price, action_price):
+        self.TargetCompID = target_comp_id
+        self.MsgType = msg_type
+        self.OrderID = order_id
+        self.OrderQty = order_qty
+        self.Price = price
+        self.ActionPrice = action_price
+
+
+def order_messages(n: int, users: int = 100):
+    for i in range(n):
+        side = "1" if i % 2 == 0 else "2"
+        price = 30000.0 + (i % 500) * 0.5 if side == "1" else 30300.0 + (i % 500) * 0.5
+        yield f"0;35=D;49=USER{i % users:04d};37={i};38=0.5;40=2;44={price};52=1700000000000;54={side};6404=0.0;55=BTCUSDT"
+
+
+def measure(build, n: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(n)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / n
+
+
+def build_dict_orders(n):
+    res = []
+    for msg in order_messages(n):
+        o = Order.from_string(msg)
+        res.append(DictOrder(o.MsgType, o.OrderID, o.OrderQty, o.OrdType, o.Price, o.SenderCompID,
+                             o.SendingTime, o.Side, o.POVTargetPercentage, o.TradingPair))
+    return res
+
+
+def build_slotted_orders(n):
+    return [Order.from_string(msg) for msg in order_messages(n)]
+
+
+def build_dict_acks(n):
+    return [DictAck("USER0001", "4", str(i), 0.5, 30000.0 + i, 30000.0) for i in range(n)]
+
+
+def build_slotted_acks(n):
+    return [ExtendedAck("USER0001", "4", str(i), 0.5, 30000.0 + i, 30000.0) for i in range(n)]
+
+
+def build_resting_book(n):
+    # Everything a resting client order costs: the object, its book level, trigger heap and indexes
+    bid_ask = BidAskQueue()
+    for msg in order_messages(n):
+        bid_ask.add_client_order(Order.from_string(msg))
+    return bid_ask
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per resting order, dict-backed vs slotted")
+    parser.add_argument("-n", type=int, default=200000, help="number of orders to allocate")
+    args = parser.parse_args()
+
+    rows = [
+        ("Order (dict-backed)", measure(build_dict_orders, args.n)),
+        ("Order (__slots__)", measure(build_slotted_orders, args.n)),
+        ("ExtendedAck (dict-backed)", measure(build_dict_acks, args.n)),
+        ("ExtendedAck (__slots__)", measure(build_slotted_acks, args.n)),
+        ("Resting client order, incl. book and indexes", measure(build_resting_book, args.n)),
+    ]
+    print(f"{args.n} objects each")
+    for name, per_object in rows:
+        print(f"{name:48} {per_object:8.1f} bytes/object")
+
+
+if __name__ == "__main__":
+    main()
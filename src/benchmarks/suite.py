@@ -0,0 +1,280 @@
+import argparse
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from itertools import chain
+
+import zmq
+
+import wire
+from benchmarks import generators
+from exchange import BidAskQueue, Order, TradeMatchingEngine
+from tag_codec import decode, decode_market_data
+
+# End-to-end benchmark suite: every component on the order and market data path, then the full
+# TradeMatchingEngine.run loop over inproc sockets. Each case reports msgs/s and p50/p99/p999 latency
+# per message; --json writes them for --compare against a later run.
+#
+#   python -m benchmarks.suite --json before.json
+#   (change something)
+#   python -m benchmarks.suite --compare before.json   # exit status 1 on a regression
+
+RESULT_VERSION = 1
+ENGINE_TIMEOUT_S = 10.0
+
+
+def summarize(name, samples, total_ns, **extra) -> dict:
+    samples.sort()
+    count = len(samples)
+
+    def pct(q):
+        return samples[min(count - 1, int(q * count))] / 1000
+
+    result = {'name': name, 'count': count, 'msgs_per_s': round(count / total_ns * 1e9, 1),
+              'p50_us': pct(0.50), 'p99_us': pct(0.99), 'p999_us': pct(0.999), 'max_us': samples[-1] / 1000}
+    result.update(extra)
+    return result
+
+
+def timed_calls(name, fn, items, **extra) -> dict:
+    # fn(item) once per item, each call timed on its own; msgs/s includes the timer overhead (~50ns)
+    clock = time.perf_counter_ns
+    samples = []
+    append = samples.append
+    start = clock()
+    for item in items:
+        t0 = clock()
+        fn(item)
+        append(clock() - t0)
+    return summarize(name, samples, clock() - start, **extra)
+
+
+def resting_book(args, users, pairs) -> BidAskQueue:
+    book = BidAskQueue(args.quote_mode)
+    for order in generators.orders(args.book_size, users, pairs, seed=args.seed, spread=args.spread, id_prefix='r'):
+        book.add_client_order(order)
+    return book
+
+
+def component_cases(args, users, pairs):
+    order_msgs = generators.order_messages(args.n, users, pairs, seed=args.seed + 1, id_prefix='n')
+    quote_msgs = generators.quote_messages(args.n, pairs, seed=args.seed)
+    binary_quotes = [wire.pack_quote(pair, update_id, float(bid), float(bid_qty), float(ask), float(ask_qty), tt, et)
+                     for pair, (update_id, bid, bid_qty, ask, ask_qty, tt, et)
+                     in generators.quote_rows(args.n, pairs, seed=args.seed)]
+
+    yield timed_calls('tag_codec.decode order', decode, order_msgs)
+    yield timed_calls('Order.from_string', Order.from_string, order_msgs)
+    yield timed_calls('decode_market_data', decode_market_data, quote_msgs)
+    yield timed_calls('wire.unpack_quote', wire.unpack_quote, binary_quotes)
+
+    book = resting_book(args, users, pairs)
+    yield timed_calls('adding_quotes_into_queues', book.adding_quotes_into_queues, quote_msgs,
+                      book_size=args.book_size)
+
+    # fill_orders after every quote: the quotes random-walk into the resting book and fill it
+    book = resting_book(args, users, pairs)
+    filled = []
+    clock = time.perf_counter_ns
+    samples = []
+    fills = 0
+    start = clock()
+    for msg in quote_msgs:
+        book.adding_quotes_into_queues(msg)
+        t0 = clock()
+        book.fill_orders(filled)
+        samples.append(clock() - t0)
+        fills += len(filled)
+        filled.clear()
+    yield summarize('fill_orders', samples, clock() - start, book_size=args.book_size, fills=fills)
+
+    book = resting_book(args, users, pairs)
+    new_orders = generators.orders(args.n, users, pairs, seed=args.seed + 1, id_prefix='n')
+    yield timed_calls('add_client_order', book.add_client_order, new_orders, book_size=args.book_size)
+
+    resting = list(book.client_orders.values())
+    random.Random(args.seed).shuffle(resting)
+    resting = resting[:args.n]
+    yield timed_calls('cancel_order', lambda order: book.cancel_order(order.OrderID, order.SenderCompID), resting,
+                      book_size=len(book.client_orders))
+
+    book = resting_book(args, users, pairs)
+    pair = pairs[0]
+    yield timed_calls('order book L2 snapshot (depth 10)',
+                      lambda _: json.dumps(book.get_order_book_l2(pair, 10)), range(args.n),
+                      book_size=args.book_size)
+    yield timed_calls('order book full snapshot', lambda _: json.dumps(book.get_order_book(pair)),
+                      range(max(1, args.n // 1000)), book_size=args.book_size)
+
+
+def engine_case(args, users, pairs):
+    """
+    The unmodified run() loop in a thread, driven over inproc sockets from this one. Latency cases are
+    ping-pong (one message in flight), the throughput case sends everything and waits for the last ack.
+    Both threads share the GIL, so absolute numbers are a lower bound on what separate processes get.
+    """
+    context = zmq.Context()
+    market_data = context.socket(zmq.PUB)
+    market_data.bind("inproc://bench-md")
+    acks = context.socket(zmq.SUB)
+    acks.setsockopt(zmq.RCVHWM, 0)  # nothing may be dropped while the sender is busy
+    acks.bind("inproc://bench-acks")
+    acks.setsockopt_string(zmq.SUBSCRIBE, "")
+
+    engine = TradeMatchingEngine(quote_mode=args.quote_mode, batch_size=args.batch,
+                                 order_endpoint="inproc://bench-orders", market_data_endpoint="inproc://bench-md",
+                                 ack_endpoint="inproc://bench-acks", ack_feed_endpoint="inproc://bench-ack-feed")
+    for order in generators.orders(args.book_size, users, pairs, seed=args.seed, spread=args.spread, id_prefix='r'):
+        engine.bid_ask.add_client_order(order)
+    thread = threading.Thread(target=engine.run, args=(context,), name="engine", daemon=True)
+    thread.start()
+    orders = context.socket(zmq.PUSH)
+    orders.connect("inproc://bench-orders")
+    poller = zmq.Poller()
+    poller.register(acks, zmq.POLLIN)
+
+    def wait_for(marker: bytes):
+        deadline = time.monotonic() + ENGINE_TIMEOUT_S
+        while time.monotonic() < deadline:
+            if not poller.poll(100):
+                continue
+            if any(frame.startswith(marker) for frame in acks.recv_multipart()):
+                return
+        raise TimeoutError(f"no ack starting with {marker!r} from the engine")
+
+    pair = pairs[0]
+    user = users[0]
+    price = generators.START_PRICE
+
+    def order_msg(order_id, side, qty, order_price):
+        return (f"0;35=D;49={user};37={order_id};38={qty};40=2;44={order_price};52=1;54={side};"
+                f"6404=0.0;55={pair}").encode()
+
+    try:
+        orders.send(order_msg('warmup', '1', 1.0, 1.0))  # far from the book, rests, proves the loop is up
+        wait_for(f"35=3;56={user};37=warmup;".encode())
+        # Quotes away from the resting book, nothing fills
+        market_data.send_string(f"Q instrument={pair};update_id=0;best_bid_price={price - 100};best_bid_qty=1;"
+                                f"best_ask_price={price + 100};best_ask_qty=1;transaction_time=0;event_time=0;")
+
+        clock = time.perf_counter_ns
+        samples = []
+        start = clock()
+        for i in range(args.engine_samples):
+            t0 = clock()
+            orders.send(order_msg(f'p{i}', '1', 1.0, 1.0))
+            wait_for(f"35=3;56={user};37=p{i};".encode())
+            samples.append(clock() - t0)
+        yield summarize('engine order -> ack', samples, clock() - start, book_size=args.book_size)
+
+        # Tick to trade: a resting buy at the start price, then a quote offering exactly its qty there
+        samples = []
+        start = clock()
+        for i in range(args.engine_samples):
+            orders.send(order_msg(f't{i}', '1', 1.0, price))
+            wait_for(f"35=3;56={user};37=t{i};".encode())
+            t0 = clock()
+            market_data.send_string(f"Q instrument={pair};update_id={i + 1};best_bid_price={price - 100};"
+                                    f"best_bid_qty=1;best_ask_price={price};best_ask_qty=1.0;"
+                                    f"transaction_time={i};event_time={i};")
+            wait_for(f"35=4;56={user};37=t{i};".encode())
+            samples.append(clock() - t0)
+        yield summarize('engine quote -> fill ack (tick to trade)', samples, clock() - start,
+                        book_size=args.book_size)
+
+        # Throughput: every order sent before the first ack is awaited, passive so the book only grows
+        count = args.engine_samples * 5
+        start = clock()
+        for i in range(count):
+            orders.send(order_msg(f'b{i}', '1', 1.0, 2.0))
+        wait_for(f"35=3;56={user};37=b{count - 1};".encode())
+        elapsed = clock() - start
+        yield {'name': 'engine order throughput', 'count': count, 'msgs_per_s': round(count / elapsed * 1e9, 1),
+               'book_size': args.book_size}
+    finally:
+        for socket in (market_data, acks, orders):
+            socket.close(linger=0)
+        context.term()  # run() sees ContextTerminated, closes its sockets and returns
+        thread.join(ENGINE_TIMEOUT_S)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold) -> bool:
+    # Returns True when a case lost more than threshold of its throughput or its p99 grew by more
+    with open(baseline_path) as file:
+        baseline = {case['name']: case for case in json.load(file)['results']}
+    regressed = False
+    print(f"\n{'vs ' + baseline_path:44} {'msgs/s':>10} {'p99':>10}")
+    for case in results:
+        old = baseline.get(case['name'])
+        if old is None:
+            continue
+        rate = case['msgs_per_s'] / old['msgs_per_s'] - 1
+        p99 = case['p99_us'] / old['p99_us'] - 1 if 'p99_us' in case and old.get('p99_us') else None
+        worse = rate < -threshold or (p99 is not None and p99 > threshold)
+        regressed = regressed or worse
+        p99_text = f"{p99:+10.1%}" if p99 is not None else f"{'':>10}"
+        print(f"{case['name']:44} {rate:+10.1%} {p99_text}  {'REGRESSION' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="exchange benchmark suite, msgs/s and latency percentiles per component")
+    parser.add_argument("-n", type=int, default=20_000, help="messages per component case")
+    parser.add_argument("--book-size", type=int, default=10_000, help="resting client orders before each case")
+    parser.add_argument("--clients", type=int, default=100, help="distinct SenderCompIDs")
+    parser.add_argument("--instruments", type=int, default=2, help="distinct trading pairs")
+    parser.add_argument("--spread", type=float, default=5.0,
+                        help="resting orders are spread this far below/above the start price, quotes walk into them")
+    parser.add_argument("--quote-mode", choices=("book", "top"), default="top")
+    parser.add_argument("--batch", type=int, default=0, help="engine --batch for the run() loop cases")
+    parser.add_argument("--engine-samples", type=int, default=2000, help="messages per run() loop case")
+    parser.add_argument("--skip-engine", action="store_true", help="components only")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the one with the best msgs/s is kept")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--compare", default=None, help="results file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="with --compare, relative loss in msgs/s or growth in p99 that counts as a regression")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    users = generators.clients(args.clients)
+    pairs = generators.instruments(args.instruments)
+    best = {}  # {name: case}, insertion ordered
+    for _ in range(args.repeat):
+        cases = component_cases(args, users, pairs)
+        if not args.skip_engine:
+            cases = chain(cases, engine_case(args, users, pairs))
+        for case in cases:
+            if case['name'] not in best or case['msgs_per_s'] > best[case['name']]['msgs_per_s']:
+                best[case['name']] = case
+
+    results = list(best.values())
+    print(f"{'case':44} {'msgs/s':>12} {'p50 us':>9} {'p99 us':>9} {'p999 us':>9}")
+    for case in results:
+        p = [f"{case[key]:9.2f}" if key in case else f"{'':>9}" for key in ('p50_us', 'p99_us', 'p999_us')]
+        print(f"{case['name']:44} {case['msgs_per_s']:12,.0f} {' '.join(p)}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'version': RESULT_VERSION, 'revision': git_revision(), 'python': platform.python_version(),
+                       'created': int(time.time()), 'params': vars(args), 'results': results}, file, indent=2)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import timeit
+
+from tag_codec import decode, decode_market_data, encode_quote
+
+ORDER_MSG = "0;35=D;49=K3J9X2QZ;37=42;38=0.5;40=2;44=30123.45;52=1700000000000;54=1;6404=0.0;55=BTCUSDT"
+QUOTE_ROW = ["4011717434", "30123.45", "1.204", "30123.46", "0.311", "1700000000123", "1700000000125"]
+QUOTE_MSG = "Q " + encode_quote("BTCUSDT", QUOTE_ROW)
+
+
+def legacy_decode(msg):
+    # The dict comprehension each module used before tag_codec
+    return {segment.split('=')[0]: segment.split('=')[1] for segment in msg.split(';') if '=' in segment}
+
+
+def legacy_decode_market_data(msg):
+    return {item.split('=')[0].replace('Q ', ''): item.split('=')[1] for item in msg.split(';') if '=' in item}
+
+
+def legacy_encode_quote(instrument, row):
+    return (
+        f"instrument={instrument};"
+        f"update_id={row[0]};"
+        f"best_bid_price={row[1]};"
+        f"best_bid_qty={row[2]};"
+        f"best_ask_price={row[3]};"
+        f"best_ask_qty={row[4]};"
+        f"transaction_time={row[5]};"
+        f"event_time={row[6]};"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tag=value codec micro-benchmark")
+    parser.add_argument("-n", type=int, default=200000, help="calls per case")
+    args = parser.parse_args()
+
+    assert decode(ORDER_MSG) == legacy_decode(ORDER_MSG)
+    assert decode_market_data(QUOTE_MSG) == legacy_decode_market_data(QUOTE_MSG)
+
+    cases = [
+        ("decode order", lambda: legacy_decode(ORDER_MSG), lambda: decode(ORDER_MSG)),
+        ("decode quote", lambda: legacy_decode_market_data(QUOTE_MSG), lambda: decode_market_data(QUOTE_MSG)),
+        ("encode quote", lambda: legacy_encode_quote("BTCUSDT", QUOTE_ROW), lambda: encode_quote("BTCUSDT", QUOTE_ROW)),
+    ]
+    print(f"{'case':14} {'legacy ns/op':>13} {'codec ns/op':>12} {'speedup':>8}")
+    for name, legacy, codec in cases:
+        legacy_ns = min(timeit.repeat(legacy, number=args.n, repeat=3)) / args.n * 1e9
+        codec_ns = min(timeit.repeat(codec, number=args.n, repeat=3)) / args.n * 1e9
+        print(f"{name:14} {legacy_ns:13.0f} {codec_ns:12.0f} {legacy_ns / codec_ns:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
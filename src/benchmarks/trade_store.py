@@ -0,0 +1,51 @@
+import argparse
+import tempfile
+import time
+
+from trade_store import TradeStore
+
+
+def record_trades(store, n, users):
+    # Returns the total and the slowest single record(), the latter is where a spill shows up
+    worst = 0.0
+    start = time.perf_counter()
+    for i in range(n):
+        started = time.perf_counter()
+        store.record("BTCUSDT", f"USER{i % users}", str(i), "1", 1.0, 100.0, 100.0, "2", 0.0, exec_time=i)
+        worst = max(worst, time.perf_counter() - started)
+    return time.perf_counter() - start, worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="trade store record cost with spilling, and queries into segments")
+    parser.add_argument("-n", type=int, default=1_000_000, help="trades recorded")
+    parser.add_argument("--max-in-memory", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TradeStore(args.max_in_memory, directory)
+        record_s, worst_s = record_trades(store, args.n, args.users)
+        store.join_spill()
+
+        # A page from the oldest segment, then one across the last segment and memory
+        queries = 20
+        start = time.perf_counter()
+        for _ in range(queries):
+            store.query("BTCUSDT", "USER7", limit=100)
+        oldest_s = (time.perf_counter() - start) / queries
+        boundary = store.trades[0].ExecTime - args.users * 50
+        start = time.perf_counter()
+        for _ in range(queries):
+            store.query("BTCUSDT", "USER7", since=boundary, limit=100)
+        boundary_s = (time.perf_counter() - start) / queries
+
+    print(f"{args.n:,} trades, {args.max_in_memory:,} in memory, {len(store.segments)} segments")
+    print(f"{'record':34} {record_s / args.n * 1e9:10.0f} ns/trade")
+    print(f"{'slowest record':34} {worst_s * 1e3:10.3f} ms")
+    print(f"{'query oldest segment':34} {oldest_s * 1e3:10.3f} ms")
+    print(f"{'query segment/memory boundary':34} {boundary_s * 1e3:10.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import time
+
+# Columnar binary cache for Binance bookTicker CSVs.
+# The first load parses the CSV once into one typed .npy file per column, next to the CSV under .cache/.
+# Later loads memory-map those files, so startup costs a few page faults instead of a full reparse.
+# numpy is optional (poetry install -E cache) and only imported when a cache is used.
+
+COLUMNS = (
+    ('update_id', 'int64'),
+    ('best_bid_price', 'float64'),
+    ('best_bid_qty', 'float64'),
+    ('best_ask_price', 'float64'),
+    ('best_ask_qty', 'float64'),
+    ('transaction_time', 'int64'),
+    ('event_time', 'int64'),
+)
+CACHE_VERSION = 1
+CHUNK_ROWS = 65536
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("the bookTicker cache needs numpy: poetry install -E cache") from None
+    return numpy
+
+
+def cache_dir(csv_path):
+    head, name = os.path.split(os.path.abspath(csv_path))
+    return os.path.join(head, '.cache', os.path.splitext(name)[0])
+
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _is_fresh(csv_path, directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as file:
+            return json.load(file) == _source_stamp(csv_path)
+    except (OSError, ValueError):
+        return False
+
+
+def build_cache(csv_path):
+    """
+    Parse a bookTicker CSV into typed columns and write them as .npy files. Returns the cache directory.
+    """
+    np = _numpy()
+    with open(csv_path) as file:
+        first = file.readline()
+    skip = 0 if first[:1].isdigit() else 1  # some Binance dumps ship without the header row
+    table = np.loadtxt(csv_path, delimiter=',', skiprows=skip, ndmin=2,
+                       dtype=np.dtype([(name, dtype) for name, dtype in COLUMNS]))
+    table = table.reshape(-1)
+
+    directory = cache_dir(csv_path)
+    os.makedirs(directory, exist_ok=True)
+    for name, _ in COLUMNS:
+        np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(table[name]))
+    # Written last: a crash mid-build leaves a cache that is simply rebuilt next time
+    with open(os.path.join(directory, 'meta.json'), 'w') as file:
+        json.dump(_source_stamp(csv_path), file)
+    return directory
+
+
+def load_book_ticker(csv_path, rebuild=False):
+    """
+    Return {column: read-only memory-mapped array}, building the cache first if it is missing or stale.
+    """
+    np = _numpy()
+    directory = cache_dir(csv_path)
+    if rebuild or not _is_fresh(csv_path, directory):
+        build_cache(csv_path)
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name, _ in COLUMNS}
+
+
+def iter_rows(columns, chunk_rows=CHUNK_ROWS):
+    """
+    Yield bookTicker rows as tuples of Python ints and floats, in CSV column order.
+    Converts a chunk at a time with tolist(), which is far cheaper than touching numpy scalars per row.
+    """
+    total = len(columns['event_time'])
+    for start in range(0, total, chunk_rows):
+        stop = start + chunk_rows
+        yield from zip(*[columns[name][start:stop].tolist() for name, _ in COLUMNS])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the columnar cache for bookTicker CSVs")
+    parser.add_argument("csv_files", nargs='+')
+    parser.add_argument("--rebuild", action="store_true", help="rebuild even if the cache is up to date")
+    args = parser.parse_args()
+    for csv_path in args.csv_files:
+        start = time.perf_counter()
+        columns = load_book_ticker(csv_path, args.rebuild)
+        elapsed = time.perf_counter() - start
+        print(f'{csv_path}: {len(columns["event_time"]):,} rows -> {cache_dir(csv_path)} ({elapsed:.2f}s)')
+
+
+if __name__ == "__main__":
+    main()
+
+
+# poetry run python book_ticker_cache.py data/BTCUSDT-bookTicker.csv data/ETHUSDT-bookTicker.csv
@@ -1,15 +1,20 @@
+import argparse
 import random
 import string
 import zmq
 import threading
 import json
+from itertools import count
 from typing import Dict
+from tag_codec import ack_topic, decode, decode_market_data, encode
+import wire
+
+ORDER_BOOK_DEPTH = 10
 
 
 class TradingClient:
-    order_id_counter = 0
-    
-    def __init__(self):
+    def __init__(self, encoding: str = "text"):
+        self.encoding = encoding  # encoding of orders and cancels sent to the exchange
         self.context = zmq.Context()
 
         self.subscriber = self.context.socket(zmq.SUB)
@@ -24,14 +29,15 @@ class TradingClient:
         self.order_publisher = self.context.socket(zmq.PUB)
         self.order_publisher.connect("tcp://127.0.0.1:5557")
 
+        self.sender_comp_id = self.generate_random_id()
+        self.order_ids = count(1)  # per client: OrderIDs only have to be unique per SenderCompID
+
         self.ack_subscriber = self.context.socket(zmq.SUB)
-        self.ack_subscriber.connect("tcp://127.0.0.1:5558")
-        self.ack_subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+        self.ack_subscriber.connect("tcp://127.0.0.1:5560")  # the engine's ack feed, ack.py binds 5558
+        self.ack_subscriber.setsockopt(zmq.SUBSCRIBE, ack_topic(self.sender_comp_id))  # only our own acks
 
         self.user_input_thread = threading.Thread(target=self.handle_user_input)
         self.user_input_thread.start()
-        
-        self.sender_comp_id = self.generate_random_id()
 
         self.trading_pair = ''
         
@@ -39,20 +45,27 @@ class TradingClient:
 
     def get_trading_time(self):
         while True:
-            message = self.subscriber.recv_string()
+            message = self.subscriber.recv()
+            if wire.is_binary(message):
+                try:
+                    self.trading_time = wire.unpack_quote(message)[6]  # transaction_time
+                except ValueError:  # wire.FrameError, keeps the last good time
+                    pass
+                continue
+            message = message.decode()
 
-            trading_time = self.parse_trading_time(message)  # Define this method to parse the message
-            self.trading_time = trading_time  # Assuming a class variable to store the trading time
+            trading_time = self.parse_trading_time(message)
+            if trading_time is not None:  # a bad message keeps the last good time
+                self.trading_time = trading_time
 
             
     def parse_trading_time(self, message):
-        # Assuming the trading time is sent in a message formatted as "TradingTime=HH:MM:SS"
-        try:
-            trading_time = message.split('=')[7]
-            return trading_time
-        except IndexError:
+        # transaction_time of a "Q instrument=...;transaction_time=...;event_time=...;" quote, ms since epoch
+        trading_time = decode_market_data(message).get('transaction_time')
+        if trading_time is None or not trading_time.isdigit():
             print("Failed to parse trading time from message:", message)
             return None
+        return int(trading_time)
 
 
     @staticmethod
@@ -67,6 +80,7 @@ class TradingClient:
             '3': ('Retrieve Order Book', self.retrieve_order_book),
             '4': ('Retrieve Executed Trades', self.retrieve_executed_trades),
             '5': ('Search Order', self.search_order),
+            '6': ('Engine Stats', self.engine_stats),
         }
 
         while True:
@@ -97,6 +111,8 @@ class TradingClient:
             elif user_command == '5':  # Search Order
                 order_id = self.sender_comp_id
                 commands[user_command][1](order_id)
+            elif user_command == '6':  # Engine Stats
+                commands[user_command][1]()
             else:
                 commands[user_command][1](trading_pair)
 
@@ -106,8 +122,8 @@ class TradingClient:
         """
         msg = f"{msg_type};"
         if name:
-            msg += ';'.join(f"{key}={value}" for key, value in name.items()) + ';'
-        msg += ';'.join(f"{key}={value}" for key, value in fields.items())
+            msg += encode(name) + ';'
+        msg += encode(fields)
         return msg
 
 
@@ -115,20 +131,22 @@ class TradingClient:
         """
         Parse a message according to the specified rules.
         """
-        segments = msg.split(';')
-        fields = {segment.split('=')[0]: segment.split('=')[1] for segment in segments if '=' in segment}
-        return fields
+        return decode(msg)
 
 
     def place_order(self, order_details):
         try:
-            # Splitting the user input into individual details
-            details = order_details.split(';')
-            
             # Assuming order_details are given in the format: "Price=100;Qty=10;Side=Buy"
-            fields = {detail.split('=')[0]: detail.split('=')[1] for detail in details if '=' in detail}
-            order_id = TradingClient.order_id_counter
-            TradingClient.order_id_counter += 1
+            fields = decode(order_details)
+            order_id = next(self.order_ids)
+            side = '1' if fields['Side'].lower() == 'buy' else '2'
+            if self.encoding == "binary":
+                frame = wire.pack_order("D", str(order_id), float(fields['Qty']), "2", float(fields['Price']),
+                                        self.sender_comp_id, self.trading_time or 0, side, 0.0, self.trading_pair)
+                print(f"Sending order: {wire.to_text(frame)}")
+                self.trading_pair = '' # Resetting trading pair
+                self.order_publisher.send(frame)
+                return
             # Constructing the message string based on the given format
             order_message = (
                 f"0;"
@@ -138,8 +156,8 @@ class TradingClient:
                 f"38={fields['Qty']};"  # Quantity
                 f"40=2;"  # Order type, assuming '2' is the desired value
                 f"44={fields['Price']};"  # Price
-                f"52={self.trading_time};"  # Placeholder for sending time, replace with actual value if necessary
-                f"54={'1' if fields['Side'].lower() == 'buy' else '2'};"  # Side, assuming '1' for Buy and '2' for Sell
+                f"52={self.trading_time or 0};"  # Placeholder for sending time, replace with actual value if necessary
+                f"54={side};"  # Side, assuming '1' for Buy and '2' for Sell
                 f"6404=0.0;"  # Placeholder for POV target percentage, replace with actual value if necessary
                 f"55={self.trading_pair}"  # Trading pair
             )
@@ -152,6 +170,11 @@ class TradingClient:
             print(f"Error: {e}. Please ensure that order details are formatted correctly.")
             
     def cancel_order(self, order_id):
+        if self.encoding == "binary":
+            frame = wire.pack_cancel(self.sender_comp_id, order_id)
+            print(f"Sending cancel: {wire.to_text(frame)}")
+            self.order_publisher.send(frame)
+            return
         fields = {"37": order_id}  # Assuming "37" is the key for OrderID
         name = {"49": self.sender_comp_id}  # Assuming "49" is the key for SenderCompID
         cancel_message = self.format_message("1", fields, name)  # Assuming msg_type "1" for cancel orders
@@ -159,7 +182,8 @@ class TradingClient:
         self.order_publisher.send_string(cancel_message)
 
     def retrieve_order_book(self, trading_pair):
-        request_message = f"2;order_book;{trading_pair}"  # Adding trading pair to the request message
+        # Top ORDER_BOOK_DEPTH aggregated levels; without depth= the engine sends every resting order
+        request_message = f"2;order_book;{trading_pair};depth={ORDER_BOOK_DEPTH};49={self.sender_comp_id}"
         print(f"Sending order book request: {request_message}")
         self.order_publisher.send_string(request_message)
 
@@ -174,24 +198,39 @@ class TradingClient:
         request_message = f"5;search_order;{order_id}"
         print(f"Sending search order request: {request_message}")
         self.order_publisher.send_string(request_message)
+
+    def engine_stats(self):
+        request_message = f"6;stats;49={self.sender_comp_id}"
+        print(f"Sending stats request: {request_message}")
+        self.order_publisher.send_string(request_message)
         
     def listen_for_acks(self):
         while True:
-            ack_message = self.ack_subscriber.recv_string()
-            fields = self.parse_message(ack_message)
-            print(f"Received Ack: {fields}")
-
-            if fields.get("35") == "order_book":  # Assuming msg_type "order_book" for order book updates
-                order_book = json.loads(fields.get("data", "{}"))
-                print(f"Order Book: {order_book}")
-            elif fields.get("35") == "executed_trades":  # Assuming msg_type "executed_trades" for executed trades updates
-                executed_trades = json.loads(fields.get("data", "{}"))
-                print(f"Executed Trades: {executed_trades}")
-            elif fields.get("35") == "search_order":  # Assuming msg_type "search_order" for search order responses
-                order_data = json.loads(fields.get("data", "{}"))
-                print(f"Order Data: {order_data}")
+            # [our topic, ack, ...], a batching engine sends several acks as one multipart message
+            for ack_message in self.ack_subscriber.recv_multipart()[1:]:
+                self.handle_ack(ack_message)
+
+    def handle_ack(self, ack_message: bytes):
+        ack_message = wire.to_text(ack_message) if wire.is_binary(ack_message) else ack_message.decode()
+        fields = self.parse_message(ack_message)
+        print(f"Received Ack: {fields}")
+
+        if fields.get("35") == "order_book":  # Assuming msg_type "order_book" for order book updates
+            order_book = json.loads(fields.get("data", "{}"))
+            print(f"Order Book: {order_book}")
+        elif fields.get("35") == "executed_trades":  # Assuming msg_type "executed_trades" for executed trades updates
+            executed_trades = json.loads(fields.get("data", "{}"))
+            print(f"Executed Trades: {executed_trades}")
+        elif fields.get("35") == "search_order":  # Assuming msg_type "search_order" for search order responses
+            order_data = json.loads(fields.get("data", "{}"))
+            print(f"Order Data: {order_data}")
 
 if __name__ == "__main__":
-    client = TradingClient()
+    parser = argparse.ArgumentParser(description="Interactive trading client")
+    parser.add_argument("--encoding", choices=wire.ENCODINGS, default="text",
+                        help="send orders and cancels as 'text' tag=value messages or 'binary' frames")
+    args = parser.parse_args()
+
+    client = TradingClient(args.encoding)
 
 # poetry run python client.py
\ No newline at end of file
@@ -0,0 +1,73 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+
+# Leveled logging for the exchange. Call sites only build a LogRecord, and only when the level is
+# enabled. The message itself (msg % args) is rendered on the calling thread by QueueHandler.prepare,
+# args such as Orders keep changing after the call; colors, JSON lines and all I/O happen on a
+# QueueListener thread. Per-order and per-fill logs are DEBUG so an INFO engine renders none of them.
+
+LEVEL_COLORS = {
+    logging.DEBUG: '\033[96m',  # bcolors.OKCYAN
+    logging.INFO: '\033[92m',  # bcolors.OKGREEN
+    logging.WARNING: '\033[93m',  # bcolors.WARNING
+    logging.ERROR: '\033[91m',  # bcolors.FAIL
+    logging.CRITICAL: '\033[91m',
+}
+ENDC = '\033[0m'
+
+
+class ConsoleFormatter(logging.Formatter):
+    # Human readable, colored by level
+    def format(self, record: logging.LogRecord) -> str:
+        color = LEVEL_COLORS.get(record.levelno, '')
+        return f"{color}{super().format(record)}{ENDC}"
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # One JSON object per line for the machine-readable log file. A traceback is part of 'msg':
+    # QueueHandler.prepare renders it into the message and drops exc_info before the record is queued.
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            'ts': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        })
+
+
+def setup_logging(level: str = "INFO", log_file: str = None, console: bool = True,
+                  file_level: str = None, fmt: str = '%(message)s') -> logging.handlers.QueueListener:
+    """
+    Route the root logger through a queue to a background writer thread.
+    The console and the JSON-lines file get separate handlers and may use separate levels.
+    """
+    handlers = []
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(level)
+        console_handler.setFormatter(ConsoleFormatter(fmt))
+        handlers.append(console_handler)
+    if log_file:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setLevel(file_level or level)
+        file_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]  # renders the message, see above
+    # The logger level is the cheapest filter, it rejects a call before any record is built
+    root.setLevel(min((handler.level for handler in handlers), default=logging.WARNING))
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)  # drain whatever is still queued on exit
+    return listener
+
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    if listener._thread is not None:  # already stopped by the caller
+        listener.stop()
@@ -1,12 +1,27 @@
 from ast import List
-from collections import deque
+import argparse
 import json
+import logging
 import math
 import shutil
+import sys
 import zmq
 import time
 from typing import List, Union
 from tabulate import tabulate
+from itertools import count
+from collections import OrderedDict
+from order_book import QTY_DECIMALS, BookSide, MatchQueue, TopOfBook
+from trade_store import Trade, TradeStore
+from tag_codec import (BOOK_DELTA_TOPIC, METRICS_TOPIC, PUBLIC_ACK_TOPIC, ack_topic, decode, decode_market_data,
+                       quote_topic)
+import wire
+import journal
+from engine_logging import setup_logging
+from metrics import EngineMetrics
+from profiling import LoopProfiler
+
+logger = logging.getLogger("exchange")
 
 
 class bcolors:
@@ -21,8 +36,14 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 class Order:
+    # Slotted: millions of these are created on the hot path, a per-instance __dict__ is most of their size.
+    # Side/OrdType/MsgType stay single-character strings, which CPython caches like small ints.
+    __slots__ = ('MsgType', 'OrderID', 'OrderQty', 'OrdType', 'Price', 'SenderCompID', 'SendingTime',
+                 'Side', 'POVTargetPercentage', 'TradingPair', 'LeavesQty')
+
     def __init__(self, msg_type: str, order_id: str, order_qty: float, ord_type: str, price: float,
-                 sender_comp_id: str, sending_time: int, side: str, pov_target_percentage: float, trading_pair: str):
+                 sender_comp_id: str, sending_time: int, side: str, pov_target_percentage: float, trading_pair: str,
+                 leaves_qty: float = None):
         self.MsgType = msg_type
         self.OrderID = order_id
         self.OrderQty = order_qty
@@ -33,25 +54,30 @@ class Order:
         self.Side = side
         self.POVTargetPercentage = pov_target_percentage
         self.TradingPair = trading_pair  # Added TradingPair attribute
+        self.LeavesQty = order_qty if leaves_qty is None else leaves_qty  # still open, partial fills reduce it
 
     @classmethod
     def from_string(cls, msg: str):
-        segments = msg.split(';')
-        fields = {segment.split('=')[0]: segment.split('=')[1] for segment in segments if '=' in segment}
+        fields = decode(msg)
         try:
             sending_time = int(fields['52'])
         except ValueError:
             raise ValueError(f"Expected integer for sending_time, got: {fields['52']}")
         # ... repeat for other fields you expect to convert ...
+        # Interned so every resting order of a user / pair shares one string object
         return cls(
-            fields['35'], fields['37'], float(fields['38']), fields['40'], float(fields['44']), fields['49'],
-            sending_time, fields['54'], float(fields['6404']), fields['55']  # Added trading_pair
+            fields['35'], fields['37'], float(fields['38']), fields['40'], float(fields['44']), sys.intern(fields['49']),
+            sending_time, fields['54'], float(fields['6404']), sys.intern(fields['55'])  # Added trading_pair
         )
 
     def to_string(self) -> str:
         return f"35={self.MsgType};49={self.SenderCompID};37={self.OrderID};38={self.OrderQty};" \
                f"40={self.OrdType};44={self.Price};52={self.SendingTime};54={self.Side};" \
-               f"6404={self.POVTargetPercentage};55={self.TradingPair}"  # Added trading_pair
+               f"6404={self.POVTargetPercentage};55={self.TradingPair};151={self.LeavesQty}"  # Added trading_pair, open qty
+
+    def __repr__(self) -> str:
+        # Lets log calls pass the order itself and only serialize it when the record is emitted
+        return self.to_string()
 
     def to_dict(self):
         return {
@@ -64,9 +90,12 @@ class Order:
             'SendingTime': self.SendingTime,
             'Side': self.Side,
             'POVTargetPercentage': self.POVTargetPercentage,
-            'TradingPair': self.TradingPair  # Added TradingPair
+            'TradingPair': self.TradingPair,  # Added TradingPair
+            'LeavesQty': self.LeavesQty
         }
 class Ack:
+    __slots__ = ('TargetCompID', 'MsgType', 'OrderID', 'OrderQty', 'Price')
+
     def __init__(self, target_comp_id: str, msg_type: str, order_id: str, order_qty: float, price: float):
         self.TargetCompID = target_comp_id
         self.MsgType = msg_type
@@ -76,28 +105,29 @@ class Ack:
 
     @classmethod
     def from_string(cls, msg: str):
-        segments = msg.split(';')
-        fields = {int(segment.split('=')[0]): segment.split('=')[1] for segment in segments}
-        return cls(fields[56], fields[35], fields[37], float(fields[38]), float(fields[44]))
+        fields = decode(msg)
+        return cls(fields['56'], fields['35'], fields['37'], float(fields['38']), float(fields['44']))
 
     def to_string(self) -> str:
         return f"35={self.MsgType};56={self.TargetCompID};37={self.OrderID};38={self.OrderQty};44={self.Price}"
     
 class ExtendedAck(Ack):
-    def __init__(self, target_comp_id: str, msg_type: str, order_id: str, order_qty: float, price: float, action_price: float):
+    __slots__ = ('ActionPrice', 'LeavesQty')
+
+    def __init__(self, target_comp_id: str, msg_type: str, order_id: str, order_qty: float, price: float,
+                 action_price: float, leaves_qty: float = None):
         super().__init__(target_comp_id, msg_type, order_id, order_qty, price)
         self.ActionPrice = action_price  # The price at which the action occurred (market price)
+        self.LeavesQty = leaves_qty  # fills: qty still open after this execution, 0 once fully filled
 
     def to_string(self) -> str:
-        return f"{super().to_string()};1000={self.ActionPrice}"  # Assuming 1000 is the tag for action price
+        text = f"{super().to_string()};1000={self.ActionPrice}"  # Assuming 1000 is the tag for action price
+        return text if self.LeavesQty is None else f"{text};151={self.LeavesQty}"
 
 
 def parse_quotes(market_data: str, instrument: str) -> List[Order]:
     res = []
-    segments = market_data.split(';')
-    # print(f"Segments: {segments}")  # Debugging statement to print segments
-    fields = {segment.split('=')[0]: segment.split('=')[1] for segment in segments if '=' in segment}
-    # print(f"Fields: {fields}")  # Debugging statement to print fields
+    fields = decode_market_data(market_data)
     
     try:
         bid_price = float(fields.get('best_bid_price', 'NaN'))  # Using the correct key 'best_bid_price'
@@ -107,7 +137,7 @@ def parse_quotes(market_data: str, instrument: str) -> List[Order]:
         transaction_time = int(fields.get('transaction_time', '0'))  # Using the correct key 'transaction_time'
         event_time = int(fields.get('event_time', '0'))  # Using the correct key 'event_time'
     except ValueError as ve:
-        print(f"ValueError: {ve}, market_data: {market_data}")
+        logger.error("ValueError: %s, market_data: %s", ve, market_data)
         return res  # Return empty list if parsing fails
 
     if not (math.isnan(bid_price) or math.isnan(bid_qty)):
@@ -140,6 +170,28 @@ def parse_quotes(market_data: str, instrument: str) -> List[Order]:
 
     return res
 
+def reply_to(update: str, msg_type: str) -> str:
+    # SenderCompID a request's replies are routed to: its 49=, or the user searched for by "5;search_order;USER".
+    # None for requests without one (stats, profiling, order books from old clients), those go to PUBLIC_ACK_TOPIC.
+    if msg_type == "5":
+        segments = update.split(';')
+        return segments[2] if len(segments) > 2 else None
+    start = update.find(";49=")
+    if start < 0:
+        return None
+    start += 4
+    end = update.find(";", start)
+    return update[start:] if end < 0 else update[start:end]
+
+
+def conflation_key(frame: bytes) -> bytes:
+    # Quotes of the same instrument share it: the binary topic prefix, or "Q instrument=PAIR" of a text quote
+    if wire.is_binary(frame):
+        return frame[:15]
+    end = frame.find(b';')
+    return frame if end < 0 else frame[:end]
+
+
 def rounding_off_float(val: float, precision: int = 10000) -> float:
     return round(val * precision) / precision
 
@@ -147,9 +199,9 @@ def rounding_off_float(val: float, precision: int = 10000) -> float:
 def send_all_messages(filled_orders: List[Order], publisher, log):
     for order in filled_orders:
         data = order.to_string()
-        print(f"Strategy out: [[{'N' if order.MsgType == '0' else 'C'}{order.Price}:{order.OrderQty}]]")
+        log.debug("Strategy out: [[%s%s:%s]]", 'N' if order.MsgType == '0' else 'C', order.Price, order.OrderQty)
         publisher.send_string(data)
-        print(f"sent: {data}")
+        log.debug("sent: %s", data)
 
 
 def send_all_messages_ack(acks: List[Ack], publisher, log, cumulative_quantity: float):
@@ -157,69 +209,236 @@ def send_all_messages_ack(acks: List[Ack], publisher, log, cumulative_quantity:
         data = ack.to_string()
         if ack.MsgType == "3":
             cumulative_quantity += ack.OrderQty
-            print(f"Filled: {ack.OrderQty}@{ack.Price}, Cumulative Quantity: {cumulative_quantity}")
+            log.info("Filled: %s@%s, Cumulative Quantity: %s", ack.OrderQty, ack.Price, cumulative_quantity)
         publisher.send_string(data)
-        print(f"sent: {data}")
+        log.debug("sent: %s", data)
+
+QUOTE_MODES = ("book", "top")
+
 
 class BidAskQueue:
-    def __init__(self):
-        self.bid_queue = {}  # {instrument: deque()}
-        self.ask_queue = {}  # {instrument: deque()}
-        self.client_orders = []
-        self.executed_trades = {}  # {instrument: []}
+    def __init__(self, quote_mode: str = "book", quote_history: int = 0, track_deltas: bool = False,
+                 trade_store: TradeStore = None):
+        # quote_mode "book" books every market quote as an EXCHANGE order (unbounded),
+        # "top" only keeps the latest quote per instrument in self.top_of_book
+        if quote_mode not in QUOTE_MODES:
+            raise ValueError(f"Unknown quote mode: {quote_mode}, expected one of {QUOTE_MODES}")
+        self.quote_mode = quote_mode
+        self.quote_history = quote_history  # ring buffer size per instrument, 0 keeps no history
+        self.top_of_book = {}  # {instrument: TopOfBook}
+        self.quote_orders = {}  # {instrument: (bid Order, ask Order)} booked for the latest quote in "book" mode
+        self.bid_queue = {}  # {instrument: BookSide(is_bid=True)}
+        self.ask_queue = {}  # {instrument: BookSide(is_bid=False)}
+        self.client_orders = {}  # {(SenderCompID, OrderID): Order}, insertion ordered
+        self.match_queues = {}  # {instrument: (buy MatchQueue, sell MatchQueue)}, client orders in price-time priority
+        self._arrivals = count()  # shared by every MatchQueue, tells which of two crossing orders was resting
+        self.order_index = {}  # {OrderID: {SenderCompID: Order}}, the order carries its instrument, side and level
+        self.user_orders = {}  # {SenderCompID: {OrderID: Order}}
+        self.trade_store = trade_store if trade_store is not None else TradeStore()
+        self.track_deltas = track_deltas  # book sides record changed price levels for collect_deltas()
+        self.delta_seq = {}  # {instrument: sequence number of the last delta}
+        self.book_versions = {}  # {instrument: int}, bumped on every change a book snapshot could show
+        self.journal = None  # journal.Journal, set once recovery is done; every state change is appended to it
+        self._moved_prices = set()  # instruments whose current price changed since journal_prices()
         self.order_counter = 0  
         self.current_prices = {}
         
-    def search_order(self, order_id):
-        for instrument, queue in self.bid_queue.items():
-            for order in queue:
-                if order.OrderID == order_id:
-                    return order, instrument, "bid"
-        for instrument, queue in self.ask_queue.items():
-            for order in queue:
-                if order.OrderID == order_id:
-                    return order, instrument, "ask"
-        return None, None, None  # Return None values if order not found
-    
+    def search_order(self, order_id, sender_comp_id=None):
+        if sender_comp_id is not None:
+            order = self.user_orders.get(sender_comp_id, {}).get(order_id)
+        else:
+            order = next(iter(self.order_index.get(order_id, {}).values()), None)
+        if order is None:
+            return None, None, None  # Return None values if order not found
+        return order, order.TradingPair, "bid" if order.Side == "1" else "ask"
+
     def search_user_order(self, USER_ID):
-        res = []
-        for client_order in self.client_orders:
-            # print(f"{bcolors.WARNING}search_user_order: {client_order} {bcolors.ENDC}")
-            if client_order.SenderCompID == USER_ID[0]:  # Changed from OrderID to SenderCompID
-                res.append(client_order.to_string())    
-            # res.append(client_order.SenderCompID)
-            # res.append(USER_ID)
-        return res
+        # USER_ID is the segment list sliced from the request, SenderCompID first
+        return [client_order.to_string() for client_order in self.user_orders.get(USER_ID[0], {}).values()]
     
-    def insert_bid(self, instrument, ord: Order):
-        if instrument not in self.bid_queue:
-            self.bid_queue[instrument] = deque()
-        self.bid_queue[instrument].append(ord)
-
-    def record_trade(self, instrument, trading_pair, sender_comp_id, executed_orders_info):
-        trade_info = {
-            'TradingPair': trading_pair,
-            'SenderCompID': sender_comp_id,
-            'executed_orders_info': executed_orders_info
-        }
-        if instrument not in self.executed_trades:
-            self.executed_trades[instrument] = []
-        self.executed_trades[instrument].append(trade_info)
-
+    @staticmethod
+    def order_error(order: Order) -> Union[str, None]:
+        # A nan qty never reaches 0 and keeps match_instrument looping, a negative one adds to the quote
+        if not math.isfinite(order.OrderQty) or order.OrderQty <= 0:
+            return f"OrderQty must be a positive number, got {order.OrderQty}"
+        if not math.isfinite(order.Price):
+            return f"Price must be a finite number, got {order.Price}"
+        return None
+
+    def add_client_order(self, order: Order) -> bool:
+        if order.Side not in ("1", "2") or self.order_error(order) is not None:
+            return False
+        if self.journal is not None:
+            self.journal.append(journal.encode_order(order))
+        previous = self.client_orders.get((order.SenderCompID, order.OrderID))
+        if previous is not None:  # a resent OrderID replaces the resting order
+            self.remove_client_order(previous)
+        if order.Side == "1":  # Bid order
+            self.insert_bid(order.TradingPair, order)
+        else:  # Ask order
+            self.insert_ask(order.TradingPair, order)
+        self.client_orders[(order.SenderCompID, order.OrderID)] = order
+        self.order_index.setdefault(order.OrderID, {})[order.SenderCompID] = order
+        self.user_orders.setdefault(order.SenderCompID, {})[order.OrderID] = order
+        if order.TradingPair not in self.match_queues:
+            self.match_queues[order.TradingPair] = (MatchQueue(True, self._arrivals), MatchQueue(False, self._arrivals))
+        buys, sells = self.match_queues[order.TradingPair]
+        (buys if order.Side == "1" else sells).push(order)
+        return True
+
+    def remove_client_order(self, order: Order) -> None:
+        self.client_orders.pop((order.SenderCompID, order.OrderID), None)
+        self._unindex(self.order_index, order.OrderID, order.SenderCompID)
+        self._unindex(self.user_orders, order.SenderCompID, order.OrderID)
+        book = self.bid_queue if order.Side == "1" else self.ask_queue
+        side = book.get(order.TradingPair)
+        if side is not None and side.remove(order):
+            self._touch(order.TradingPair)
+        buys, sells = self.match_queues[order.TradingPair]
+        (buys if order.Side == "1" else sells).discard(order)
+
+    @staticmethod
+    def _unindex(index, outer_key, inner_key) -> None:
+        inner = index.get(outer_key)
+        if inner is not None:
+            inner.pop(inner_key, None)
+            if not inner:
+                del index[outer_key]
+
+    def book_version(self, instrument) -> int:
+        return self.book_versions.get(instrument, 0)
+
+    def _touch(self, instrument) -> None:
+        self.book_versions[instrument] = self.book_versions.get(instrument, 0) + 1
 
-    def get_executed_trades(self, instrument, sender_comp_id):
-        trades = self.executed_trades.get(instrument, [])
-        return [trade for trade in trades if trade['SenderCompID'] == sender_comp_id]
+    def insert_bid(self, instrument, ord: Order):
+        self._side(instrument, is_bid=True).add(ord)
+        self._touch(instrument)
+
+    def _side(self, instrument, is_bid) -> BookSide:
+        book = self.bid_queue if is_bid else self.ask_queue
+        side = book.get(instrument)
+        if side is None:
+            side = book[instrument] = BookSide(is_bid, self.track_deltas)
+        return side
+
+    def record_trade(self, order: Order, qty: float, action_price: float):
+        # qty is what this execution filled, a partially filled order gets one trade per execution
+        trade = self.trade_store.record(order.TradingPair, order.SenderCompID, order.OrderID, order.Side,
+                                        qty, order.Price, action_price, order.OrdType,
+                                        order.POVTargetPercentage)
+        if self.journal is not None:
+            self.journal.append(journal.encode_fill(trade))
+        return trade
+
+    def get_executed_trades(self, instrument, sender_comp_id, since=None, until=None, limit=100, cursor=None):
+        # One page of the user's trades, oldest first; pass next_cursor back as cursor for the next one
+        return self.trade_store.query_dict(instrument, sender_comp_id, since=since, until=until, limit=limit,
+                                           cursor=cursor)
 
     
     def get_order_book(self, instrument):
-        bid_queue = self.bid_queue.get(instrument, deque())
-        ask_queue = self.ask_queue.get(instrument, deque())
+        # Both sides iterate in price-time priority, best level first
+        bid_queue = self.bid_queue.get(instrument, ())
+        ask_queue = self.ask_queue.get(instrument, ())
+        bids = [order.to_dict() for order in bid_queue]
+        asks = [order.to_dict() for order in ask_queue]
+        if self.quote_mode == "top" and instrument in self.top_of_book:
+            top = self.top_of_book[instrument]
+            self._merge_quote_row(bids, top.quote_dict(is_bid=True), is_bid=True)
+            self._merge_quote_row(asks, top.quote_dict(is_bid=False), is_bid=False)
         return {
-            "bids": [order.to_dict() for order in bid_queue],
-            "asks": [order.to_dict() for order in ask_queue]
+            "bids": bids,
+            "asks": asks
         }
 
+    def get_order_book_l2(self, instrument, depth):
+        # Aggregated price levels, [price, total qty, order count], best first. seq is the last delta
+        # published for the instrument, deltas with a higher seq apply on top of this snapshot.
+        return {
+            "instrument": instrument,
+            "seq": self.delta_seq.get(instrument, 0),
+            "bids": self._depth(instrument, True, depth),
+            "asks": self._depth(instrument, False, depth)
+        }
+
+    def _depth(self, instrument, is_bid, depth):
+        side = (self.bid_queue if is_bid else self.ask_queue).get(instrument)
+        rows = side.depth(depth) if side is not None else []
+        quote = self._quote_level(instrument, is_bid)
+        if quote is not None:
+            price, qty = quote
+            for idx, row in enumerate(rows):
+                if row[0] == price:
+                    row[1] += qty
+                    row[2] += 1
+                    break
+                if (row[0] < price) if is_bid else (row[0] > price):
+                    rows.insert(idx, [price, qty, 1])
+                    break
+            else:
+                rows.append([price, qty, 1])
+            del rows[depth:]
+        return rows
+
+    def _quote_level(self, instrument, is_bid):
+        # In "top" mode the market quote is not in the book sides, it is merged into the level it sits on
+        top = self.top_of_book.get(instrument) if self.quote_mode == "top" else None
+        if top is None:
+            return None
+        price, qty = (top.bid_price, top.bid_qty) if is_bid else (top.ask_price, top.ask_qty)
+        return None if price is None or not qty else (price, qty)
+
+    def _level_row(self, instrument, is_bid, price):
+        side = (self.bid_queue if is_bid else self.ask_queue).get(instrument)
+        row = side.level_row(price) if side is not None else [price, 0.0, 0]
+        quote = self._quote_level(instrument, is_bid)
+        if quote is not None and quote[0] == price:
+            row[1] += quote[1]
+            row[2] += 1
+        return row
+
+    def collect_deltas(self):
+        """
+        Changed price levels per instrument since the last call, as [(instrument, delta)].
+        Each row carries the level's new absolute state, qty 0 removes it, so replaying a delta
+        the snapshot already reflects is harmless.
+        """
+        deltas = []
+        for instrument in self.bid_queue.keys() | self.ask_queue.keys():
+            bid_side = self.bid_queue.get(instrument)
+            ask_side = self.ask_queue.get(instrument)
+            bid_prices = bid_side.take_dirty() if bid_side is not None else []
+            ask_prices = ask_side.take_dirty() if ask_side is not None else []
+            if not bid_prices and not ask_prices:
+                continue
+            seq = self.delta_seq[instrument] = self.delta_seq.get(instrument, 0) + 1
+            self._touch(instrument)  # snapshots carry seq, one cached before this delta is stale
+            deltas.append((instrument, {
+                "instrument": instrument,
+                "seq": seq,
+                "bids": [self._level_row(instrument, True, price) for price in bid_prices],
+                "asks": [self._level_row(instrument, False, price) for price in ask_prices]
+            }))
+        return deltas
+
+    def _mark_quote_levels(self, instrument):
+        for is_bid in (True, False):
+            quote = self._quote_level(instrument, is_bid)
+            if quote is not None:
+                self._side(instrument, is_bid).mark(quote[0])
+
+    @staticmethod
+    def _merge_quote_row(rows, quote, is_bid):
+        # The market quote goes ahead of client orders at worse prices, after those at the same price
+        if quote is None:
+            return
+        for idx, row in enumerate(rows):
+            if (row['Price'] < quote['Price']) if is_bid else (row['Price'] > quote['Price']):
+                rows.insert(idx, quote)
+                return
+        rows.append(quote)
+
     def print_order_book(self, instrument):
         order_book = self.get_order_book(instrument)
         print(f"Order Book for {instrument}:")
@@ -231,68 +450,148 @@ class BidAskQueue:
             print(f"Price: {ask['price']}, Quantity: {ask['qty']}")
             
     def insert_ask(self, instrument, ord: Order):
-        if instrument not in self.ask_queue:
-            self.ask_queue[instrument] = deque()
-        self.ask_queue[instrument].append(ord)
+        self._side(instrument, is_bid=False).add(ord)
+        self._touch(instrument)
+
+    def best_bid(self, instrument) -> Union[float, None]:
+        side = self.bid_queue.get(instrument)
+        return side.best_price() if side else None
+
+    def best_ask(self, instrument) -> Union[float, None]:
+        side = self.ask_queue.get(instrument)
+        return side.best_price() if side else None
 
     def clear_bid(self):
+        for instrument in self.bid_queue:
+            self._touch(instrument)
         self.bid_queue.clear()
 
     def clear_ask(self):
+        for instrument in self.ask_queue:
+            self._touch(instrument)
         self.ask_queue.clear()
 
-    def pop_bid(self) -> Union[Order, None]:
-        return self.bid_queue.popleft() if self.bid_queue else None
-
-    def pop_ask(self) -> Union[Order, None]:
-        return self.ask_queue.popleft() if self.ask_queue else None
+    def pop_bid(self, instrument) -> Union[Order, None]:
+        side = self.bid_queue.get(instrument)
+        if not side:
+            return None
+        self._touch(instrument)
+        return side.pop_best()
+
+    def pop_ask(self, instrument) -> Union[Order, None]:
+        side = self.ask_queue.get(instrument)
+        if not side:
+            return None
+        self._touch(instrument)
+        return side.pop_best()
     
     def fill_orders(self, filled_orders: List[ExtendedAck]) -> bool:
         res = False
-        # Log the initial state of client_orders
-        # print(f"{bcolors.WARNING}client_orders: {self.client_orders} {bcolors.ENDC}")
-
-        client_orders_to_remove = []
         executed_orders_info = []  # List to hold information about executed orders
 
-        for client in self.client_orders:
-            instrument = client.TradingPair  # Assuming 'TradingPair' attribute is the instrument in Order class
-            if client.Side == "1":  # Buy Order
-                if self.current_prices[instrument] <= client.Price:
-                    print(f"Order filled at action price: {self.current_prices[instrument]}, user input price: {client.Price}, order: {client.to_string()}")
-                    ack_message = ExtendedAck(client.SenderCompID, "4", client.OrderID, client.OrderQty, client.Price, self.current_prices[instrument])
-                    filled_orders.append(ack_message)
-                    client_orders_to_remove.append(client)
-                    res = True
-                    executed_orders_info.append(f"Buy Order Executed; Trigger Price: {client.Price}, Action Price: {self.current_prices[instrument]}, Instrument: {instrument}, TradingPair: {client.TradingPair}, SenderCompID: {client.SenderCompID}, OrderID: {client.OrderID}, OrderQty: {client.OrderQty}, OrdType: {client.OrdType}, Side: {client.Side}, POVTargetPercentage: {client.POVTargetPercentage}")
-            elif client.Side == "2":  # Sell Order
-                if self.current_prices[instrument] >= client.Price:
-                    print(f"Order filled at action price: {self.current_prices[instrument]}, user input price: {client.Price}, order: {client.to_string()}")
-                    ack_message = ExtendedAck(client.SenderCompID, "4", client.OrderID, client.OrderQty, client.Price, self.current_prices[instrument])
-                    filled_orders.append(ack_message)
-                    client_orders_to_remove.append(client)
-                    res = True
-                    # executed_orders_info.append(f"Sell Order Executed; Trigger Price: {client.Price}, Action Price: {self.current_prices[instrument]}, Instrument: {instrument}")
-                    executed_orders_info.append(f"Buy Order Executed; Trigger Price: {client.Price}, Action Price: {self.current_prices[instrument]}, Instrument: {instrument}, TradingPair: {client.TradingPair}, SenderCompID: {client.SenderCompID}, OrderID: {client.OrderID}, OrderQty: {client.OrderQty}, OrdType: {client.OrdType}, Side: {client.Side}, POVTargetPercentage: {client.POVTargetPercentage}")
-        # Remove fully filled client orders from self.client_orders
-        for client in client_orders_to_remove:
-            self.client_orders.remove(client)
+        # Only the top of each MatchQueue is looked at, an instrument with nothing crossing costs two peeks
+        for instrument in self.match_queues:
+            if self.match_instrument(instrument, filled_orders, executed_orders_info):
+                res = True
+
+        if not res:
+            logger.debug("clientOrderSize: %d", len(self.client_orders))
+            return res, ""
 
+        first_order = next(iter(self.client_orders.values()), None)
         executed_orders_str = '\n'.join(executed_orders_info)  # Convert executed orders info to string
-        message = f"cur qty: {self.client_orders[0].OrderQty if self.client_orders else 'N/A'}, " + \
-                f"askQueueSize: {sum(len(q) for q in self.ask_queue.values())}, " + \
+        ask_queue_size = sum(len(q) for q in self.ask_queue.values())  # Total size of all ask queues
+        message = f"cur qty: {first_order.LeavesQty if first_order else 'N/A'}, " + \
+                f"askQueueSize: {ask_queue_size}, " + \
                 f"clientOrderSize: {len(self.client_orders)}, " + \
                 f"Executed Orders:\n{executed_orders_str}"  # Add executed orders info to the message
 
-        if res: self.record_trade(instrument, client.TradingPair, client.SenderCompID, executed_orders_info)
-
-        print(f"cur qty: {self.client_orders[0].OrderQty if self.client_orders else 'N/A'}",  # Logging current qty
-            f"askQueueSize: {sum(len(q) for q in self.ask_queue.values())}",  # Total size of all ask queues
-            f"clientOrderSize: {len(self.client_orders)}")  # Logging client order size
+        logger.debug("cur qty: %s askQueueSize: %d clientOrderSize: %d",
+                     first_order.LeavesQty if first_order else 'N/A', ask_queue_size, len(self.client_orders))
 
         return res, message
 
-    
+    def match_instrument(self, instrument, filled_orders: List[ExtendedAck], executed_orders_info: list) -> int:
+        """
+        Uncross one instrument in price-time priority. Client orders trade with each other and with the
+        quoted top of book; every execution fills min(bid qty, ask qty), so one side of it is used up and
+        the loop ends after at most one execution per order or quote filled. Between two client orders
+        the one that was resting sets the price, against the quote the quote price is the action price.
+        Returns the number of executions.
+        """
+        buys, sells = self.match_queues[instrument]
+        top = self.top_of_book.get(instrument)
+        executions = 0
+        while True:
+            buy = buys.peek()
+            sell = sells.peek()
+            quote_bid = top.bid_price if top is not None and top.bid_qty else None
+            quote_ask = top.ask_price if top is not None and top.ask_qty else None
+            # At the same price client orders go first, the quote only leads when it is strictly better
+            bid_is_quote = quote_bid is not None and (buy is None or quote_bid > buy[2].Price)
+            ask_is_quote = quote_ask is not None and (sell is None or quote_ask < sell[2].Price)
+            best_bid = quote_bid if bid_is_quote else buy[2].Price if buy else None
+            best_ask = quote_ask if ask_is_quote else sell[2].Price if sell else None
+            if best_bid is None or best_ask is None or best_bid < best_ask or (bid_is_quote and ask_is_quote):
+                return executions  # not crossed, or only the market quote crosses itself
+
+            if bid_is_quote:
+                order = sell[2]
+                qty = min(order.LeavesQty, top.bid_qty)
+                self._consume_quote(instrument, top, True, qty)
+                self._execute(order, qty, quote_bid, filled_orders, executed_orders_info)
+            elif ask_is_quote:
+                order = buy[2]
+                qty = min(order.LeavesQty, top.ask_qty)
+                self._consume_quote(instrument, top, False, qty)
+                self._execute(order, qty, quote_ask, filled_orders, executed_orders_info)
+            else:
+                buy_order, sell_order = buy[2], sell[2]
+                price = sell_order.Price if sell[1] < buy[1] else buy_order.Price
+                qty = min(buy_order.LeavesQty, sell_order.LeavesQty)
+                self._execute(buy_order, qty, price, filled_orders, executed_orders_info)
+                self._execute(sell_order, qty, price, filled_orders, executed_orders_info)
+            executions += 1
+
+    def _consume_quote(self, instrument, top: TopOfBook, is_bid: bool, qty: float) -> None:
+        # Quoted liquidity is used up until the next quote replaces it
+        if is_bid:
+            top.bid_qty = round(top.bid_qty - qty, QTY_DECIMALS)
+            price = top.bid_price
+        else:
+            top.ask_qty = round(top.ask_qty - qty, QTY_DECIMALS)
+            price = top.ask_price
+        if self.quote_mode == "top":  # the quote is merged into snapshots and deltas
+            self._touch(instrument)
+            if self.track_deltas:
+                self._side(instrument, is_bid).mark(price)
+            return
+        # "book": the EXCHANGE order booked for the quote gives up the same qty, else the book shows it crossed
+        booked = self.quote_orders.get(instrument, (None, None))[0 if is_bid else 1]
+        if booked is not None:
+            side = self._side(instrument, is_bid)
+            side.reduce(booked, qty)
+            if booked.LeavesQty <= 0:
+                side.remove(booked)
+            self._touch(instrument)
+
+    def _execute(self, order: Order, qty: float, price: float, filled_orders, executed_orders_info) -> None:
+        self._side(order.TradingPair, order.Side == "1").reduce(order, qty)
+        self._touch(order.TradingPair)
+        logger.debug("Order filled %s of %s at action price: %s, user input price: %s, order: %s",
+                     qty, order.OrderQty, price, order.Price, order)
+        filled_orders.append(ExtendedAck(order.SenderCompID, "4", order.OrderID, qty, order.Price, price,
+                                         order.LeavesQty))
+        side_name = "Buy" if order.Side == "1" else "Sell"
+        executed_orders_info.append(
+            f"{side_name} Order Executed; Trigger Price: {order.Price}, Action Price: {price}, "
+            f"TradingPair: {order.TradingPair}, SenderCompID: {order.SenderCompID}, OrderID: {order.OrderID}, "
+            f"Filled: {qty}, LeavesQty: {order.LeavesQty}, OrderQty: {order.OrderQty}, OrdType: {order.OrdType}, "
+            f"Side: {order.Side}, POVTargetPercentage: {order.POVTargetPercentage}")
+        self.record_trade(order, qty, price)
+        if order.LeavesQty <= 0:
+            self.remove_client_order(order)
+
     def format_order_book(self, order_book):
         terminal_width, _ = shutil.get_terminal_size()
         half_width = terminal_width // 2
@@ -314,51 +613,80 @@ class BidAskQueue:
         return '\n'.join(formatted_order_book)
     
     def adding_quotes_into_queues(self, updt: str):
-        # Assuming you have a method to generate unique order IDs
-        parsed_str_list = updt.split(';')
-        # print(f'{bcolors.OKGREEN} parsed_str_list: {parsed_str_list} {bcolors.ENDC}')
+        quote = self.parse_quote(updt)
+        if quote is not None:
+            self.apply_quote(*quote)
 
-        data_dict = {item.split('=')[0].replace('Q ', ''): item.split('=')[1] for item in parsed_str_list if '=' in item}
+    @staticmethod
+    def parse_quote(updt: str):
+        # apply_quote() arguments of a text quote, None when it names no instrument
+        data_dict = decode_market_data(updt)
 
         instrument = data_dict.get('instrument', None)
         if instrument is None:
-            print(f'{bcolors.FAIL}No instrument found{bcolors.ENDC}')
-            return
+            logger.error("No instrument found in market data: %s", updt)
+            return None
 
         bid_price = data_dict.get('best_bid_price', None)
         bid_qty = data_dict.get('best_bid_qty', None)
         ask_price = data_dict.get('best_ask_price', None)
         ask_qty = data_dict.get('best_ask_qty', None)
-        event_time = int(data_dict.get('event_time', '0'))
+        return (
+            instrument,
+            int(data_dict['update_id']) if 'update_id' in data_dict else None,
+            float(bid_price) if bid_price is not None else None,
+            float(bid_qty) if bid_qty is not None else None,
+            float(ask_price) if ask_price is not None else None,
+            float(ask_qty) if ask_qty is not None else None,
+            int(data_dict.get('transaction_time', 0)),
+            int(data_dict.get('event_time', '0'))
+        )
 
-        bid_price = data_dict.get('best_bid_price', None)
-        ask_price = data_dict.get('best_ask_price', None)
+    def adding_binary_quote_into_queues(self, frame: bytes):
+        # Binary frames already carry numbers, no text round trip
+        self.apply_quote(*wire.unpack_quote(frame))
 
+    def apply_quote(self, instrument, update_id, bid_price, bid_qty, ask_price, ask_qty, transaction_time, event_time):
         # Calculate the current price based on bid and ask prices
         if bid_price is not None and ask_price is not None:
-            current_price = (float(bid_price) + float(ask_price)) / 2
+            current_price = (bid_price + ask_price) / 2
         elif bid_price is not None:
-            current_price = float(bid_price)
+            current_price = bid_price
         elif ask_price is not None:
-            current_price = float(ask_price)
+            current_price = ask_price
         else:
-            print(f'{bcolors.FAIL}No bid or ask price found for instrument {instrument}{bcolors.ENDC}')
+            logger.error("No bid or ask price found for instrument %s", instrument)
             return
 
         # Update the current price for the instrument in the dictionary
         self.current_prices[instrument] = current_price
-        print(f"{bcolors.OKGREEN}current_prices: {self.current_prices}{bcolors.ENDC}")
-        
+        if self.journal is not None:
+            self._moved_prices.add(instrument)
+        logger.debug("current_prices: %s", self.current_prices)
+
+        top = self.top_of_book.get(instrument)
+        if top is None:
+            top = self.top_of_book[instrument] = TopOfBook(instrument, self.quote_history)
+        if self.quote_mode == "top" and self.track_deltas:
+            self._mark_quote_levels(instrument)  # the levels the previous quote is leaving
+        top.update(bid_price, bid_qty, ask_price, ask_qty, update_id, transaction_time, event_time)
+        if self.quote_mode == "top":
+            self._touch(instrument)  # snapshots merge the quote in
+            if self.track_deltas:
+                self._mark_quote_levels(instrument)
+            return  # the quote lives only in the top-of-book record, nothing is appended
+
+        bid_order = ask_order = None
         if bid_price is not None and bid_qty is not None:
             self.order_counter += 1  # Increment order_counter for a new order ID
             bid_order = Order(
                 msg_type='D',
                 order_id=f"{instrument}_bid_{event_time}",
-                order_qty=float(bid_qty),
+                order_qty=bid_qty,
                 ord_type='2',
-                price=float(bid_price),
+                price=bid_price,
                 sender_comp_id='EXCHANGE',
-                sending_time=int(data_dict.get('transaction_time', 0)),
+                sending_time=transaction_time,
                 side='1',
                 pov_target_percentage=0.0,
                 trading_pair=instrument  # Use instrument as trading_pair
@@ -372,17 +700,18 @@ class BidAskQueue:
             ask_order = Order(
                 msg_type='D',
                 order_id=f"{instrument}_bid_{event_time}",  # Use order_counter as order ID
-                order_qty=float(ask_qty),
+                order_qty=ask_qty,
                 ord_type='2',
-                price=float(ask_price),
+                price=ask_price,
                 sender_comp_id='EXCHANGE',
-                sending_time=int(data_dict.get('transaction_time', 0)),
+                sending_time=transaction_time,
                 side='2',
                 pov_target_percentage=0.0,
                 trading_pair=instrument  # Use instrument as trading_pair
             )
             self.insert_ask(instrument, ask_order)
             # print(f"ASK PARSER: {ask_order.to_string()}")
+        self.quote_orders[instrument] = (bid_order, ask_order)
 
 
 
@@ -391,180 +720,791 @@ class BidAskQueue:
         quotes_data = quotes_str.split(',')
         return [Order(*data.split()) for data in quotes_data]  # Assume each data field in a quote is separated by a space
 
-    def cancel_order(self, cancel_request: Order, cancelled_orders: List[Ack]) -> bool:
-        res = False
-        for client in self.client_orders:
-            if cancel_request.OrderID == client.OrderID:
-                res = True
-                ack_cancel_msg = Ack(cancel_request.SenderCompID, "5", cancel_request.OrderID, -1, client.Price)
-                cancelled_orders.append(ack_cancel_msg)
-                self.client_orders.remove(client)
-                break
-        return res
-
-
-    def cancel_order(self, order_id):
-        self.client_orders = [order for order in self.client_orders if order.OrderID != order_id]
-        
-        for instrument, queue in self.bid_queue.items():
-            
-            for order in queue:
-                if order.OrderID == order_id:
-                    queue.remove(order)
-                    return True, f"Order {order_id} canceled"
-        for instrument, queue in self.ask_queue.items():
-            for order in queue:
-                if order.OrderID == order_id:
-                    queue.remove(order)
-                    return True, f"Order {order_id} canceled"
-        return False, f"Order {order_id} not found"
+    def cancel_order(self, order_id, sender_comp_id=None):
+        if sender_comp_id is not None:
+            order = self.user_orders.get(sender_comp_id, {}).get(order_id)
+            cancelled = [order] if order is not None else []
+        else:  # no owner given: cancel every client order carrying this OrderID
+            cancelled = list(self.order_index.get(order_id, {}).values())
+        if not cancelled:
+            return False, f"Order {order_id} not found"
+
+        if self.journal is not None:
+            self.journal.append(journal.encode_cancel(order_id, sender_comp_id))
+        for order in cancelled:
+            self.remove_client_order(order)
+        return True, f"Order {order_id} canceled"
+
+    def journal_prices(self):
+        # One price record per moved instrument per commit, not one per quote
+        for instrument in self._moved_prices:
+            self.journal.append(journal.encode_price(instrument, self.current_prices[instrument]))
+        self._moved_prices.clear()
+
+    def snapshot_records(self):
+        # Record bodies for journal.snapshot(): state first, then trades, then resting orders in time priority
+        yield journal.encode_meta({'current_prices': self.current_prices, 'trade_store': self.trade_store.meta()})
+        for trade in self.trade_store.trades:
+            yield journal.encode_fill(trade)
+        for order in self.client_orders.values():
+            yield journal.encode_order(order)
+
+    def apply_record(self, kind, values):
+        # Replays one snapshot or journal record. Nothing is matched here: fills are records of their own.
+        if kind == journal.KIND_ORDER:
+            order = Order(*values)
+            order.SenderCompID = sys.intern(order.SenderCompID)
+            order.TradingPair = sys.intern(order.TradingPair)
+            self.add_client_order(order)
+        elif kind == journal.KIND_CANCEL:
+            self.cancel_order(*values)
+        elif kind == journal.KIND_FILL:
+            trade = Trade(*values)
+            order = self.user_orders.get(trade.SenderCompID, {}).get(trade.OrderID)
+            if order is not None:  # None in a snapshot, whose orders come after the trades with their LeavesQty
+                self._side(order.TradingPair, order.Side == "1").reduce(order, trade.OrderQty)
+                if order.LeavesQty <= 0:
+                    self.remove_client_order(order)
+            self.trade_store.restore(trade)
+        elif kind == journal.KIND_PRICE:
+            instrument, price = values
+            self.current_prices[instrument] = price
+        elif kind == journal.KIND_META:
+            meta, = values
+            self.current_prices.update(meta['current_prices'])
+            self.trade_store.load_meta(meta['trade_store'])
     
     def try_fill_3mins_order(self, filled_orders: List[Ack]) -> bool:
         res = False
         ms_unix_time_now = int(time.time() * 1000)
-        for client in self.client_orders[:]:
+        for client in list(self.client_orders.values()):
             if ms_unix_time_now - client.SendingTime >= 180000:
                 res = True
                 ack_fill_msg = Ack(client.SenderCompID, "4", client.OrderID, client.OrderQty, client.Price)
                 filled_orders.append(ack_fill_msg)
-                self.client_orders.remove(client)
+                self.remove_client_order(client)
         return res
     
+FAIRNESS_POLICIES = ("round_robin", "orders_first", "market_first")
+MARKET_DATA_ENDPOINT = "tcp://127.0.0.1:5556"
+ACK_ENDPOINT = "tcp://127.0.0.1:5558"
+ACK_FEED_ENDPOINT = "tcp://127.0.0.1:5560"  # the same acks, bound here for any number of clients to subscribe
+SNAPSHOT_CACHE_SIZE = 256
+TRADE_QUERY_PARAMS = ("since", "until", "limit", "cursor")
+MAX_TRADES_PER_PAGE = 1000
+CONFLATE_MAX_DRAIN = 100_000  # quotes read per conflation pass, bounds the time orders wait behind it
+PROFILE_POLL_MS = 100  # poll timeout while a profile runs, so a time limit is honoured on an idle engine
+
+
 class TradeMatchingEngine:
-    def __init__(self):
-        self.bid_ask = BidAskQueue()
+    def __init__(self, quote_mode: str = "book", quote_history: int = 0, encoding: str = "text",
+                 fairness: str = "round_robin", burst: int = 64, batch_size: int = 0, flush_ms: float = 1.0,
+                 deltas: bool = False, max_trades_in_memory: int = 100_000, trade_spill_dir: str = None,
+                 journal_dir: str = None, fsync_ms: float = 5.0, journal_mmap: bool = False,
+                 snapshot_every: int = 100_000, instruments: List[str] = None, order_endpoint: str = None,
+                 delta_endpoint: str = None, market_data_endpoint: str = MARKET_DATA_ENDPOINT,
+                 ack_endpoint: str = ACK_ENDPOINT, metrics: bool = False, metrics_interval: float = 0.0,
+                 profile_dir: str = "profiles", ack_feed_endpoint: str = None, conflate: bool = False,
+                 market_data_hwm: int = None, ack_hwm: int = None):
+        if encoding not in wire.ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding}, expected one of {wire.ENCODINGS}")
+        if fairness not in FAIRNESS_POLICIES:
+            raise ValueError(f"Unknown fairness policy: {fairness}, expected one of {FAIRNESS_POLICIES}")
+        self.bid_ask = BidAskQueue(quote_mode, quote_history, track_deltas=deltas,
+                                   trade_store=TradeStore(max_trades_in_memory, trade_spill_dir))
+        self.deltas = deltas  # publish changed price levels on the book delta feed once per loop iteration
+        self.encoding = encoding  # encoding of outgoing acks; inbound text and binary frames are both accepted
+        # How ready sockets share a loop iteration: "round_robin" alternates one message from each,
+        # "orders_first"/"market_first" drain one socket before the other. burst caps the messages
+        # taken from a single socket before the poller is consulted again.
+        self.fairness = fairness
+        self.burst = batch_size or burst
+        # batch_size > 0 drains up to that many messages per socket per iteration and publishes all
+        # resulting acks as one multipart message. Buffered acks never wait longer than flush_ms.
+        self.batch_size = batch_size
+        self.flush_deadline = flush_ms / 1000
+        self._pending = []  # (topic, encoded ack frame) waiting for the next flush
+        self._reply_topic = PUBLIC_ACK_TOPIC  # topic of the client whose message is being handled
+        self._profile_topic = PUBLIC_ACK_TOPIC  # who started the running profile
+        self._pending_since = 0.0
+        self._match_pending = False
+        self.subscriber = None
+        self.order_subscriber = None
+        self.ack_publisher = None  # the ack bus, ack.py on 5558
+        self.ack_feed_publisher = None  # the same acks for clients, 5560; the bus socket too unless ack_hwm is set
+        self.feed_publisher = None  # book deltas and the metrics topic, port 5559
+        # Orders, cancels and fills are journaled to journal_dir and committed once per loop iteration,
+        # a snapshot is taken every snapshot_every records so recovery only replays a bounded tail
+        self.journal = journal.Journal(journal_dir, fsync_ms, journal_mmap) if journal_dir else None
+        self.snapshot_every = snapshot_every
+        # {(instrument, depth): (book version, serialized response)}, depth None is the full dump.
+        # One entry per key, a newer version replaces the older one. Least recently used goes first when full.
+        self._snapshot_cache = OrderedDict()
+        # Sharded mode (see sharded_exchange.py): market data is subscribed only for instruments, orders
+        # arrive from the router on a PULL socket bound at order_endpoint and deltas go to the router's
+        # proxy at delta_endpoint. None keeps the single process layout.
+        self.instruments = instruments
+        self.order_endpoint = order_endpoint
+        self.delta_endpoint = delta_endpoint
+        self.market_data_endpoint = market_data_endpoint  # connected to; inproc:// ones let benchmarks drive run()
+        self.ack_endpoint = ack_endpoint
+        self.ack_feed_endpoint = ack_feed_endpoint  # None binds ACK_FEED_ENDPOINT, shards connect to the router's proxy
+        # Backpressure. conflate drains every queued quote each iteration and only handles the latest one
+        # per instrument: under a burst the book moves to the freshest price instead of working through
+        # stale ones. market_data_hwm/ack_hwm are the sockets' RCVHWM/SNDHWM (zmq default 1000). With
+        # ack_hwm set, an ack feed send to a recipient that far behind fails instead of being dropped
+        # silently, and is counted. The bus stays lossy per subscriber: ack.py gets everything, with
+        # NODROP there it being behind would fail every client's sends.
+        self.conflate = conflate
+        self.market_data_hwm = market_data_hwm
+        self.ack_hwm = ack_hwm
+        # md_hwm_hits_est is an estimate: zmq doesn't report the publisher's drops, an iteration that read
+        # market_data_hwm quotes or more only suggests the queue was full. Without conflate an iteration
+        # reads at most burst quotes, so it only counts when burst >= market_data_hwm.
+        self.backpressure = {'md_received': 0, 'md_conflated': 0, 'md_queue_max': 0, 'md_hwm_hits_est': 0,
+                             'ack_hwm_drops': 0}
+        self._md_read = 0  # quotes read from the market data socket in this loop iteration
+        # Per-stage latency histograms and counters (see metrics.py), answered by "6;stats" and published
+        # on the feed's METRICS_TOPIC every metrics_interval seconds. None costs one attribute check per stage.
+        self.metrics = EngineMetrics() if metrics or metrics_interval else None
+        self.metrics_interval = metrics_interval
+        # cProfile of the loop while a "7;profile;start" runs, dumped to profile_dir. None between profiles.
+        self.profiler = None
+        self.profile_dir = profile_dir
+        self._next_metrics = 0.0
+
+    def _publish(self, payload: Union[str, bytes], topic: bytes = None):
+        # Every ack bus message is [topic, payload...], topic defaults to the sender of the message being
+        # handled. Subscribers only get their own SenderCompID's traffic, PUB filters before sending.
+        # Without batching the frames still wait for the end of the message's handler, one multipart
+        # per recipient instead of one per frame.
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if topic is None:
+            topic = self._reply_topic
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.append((topic, payload))
+
+    def _send_pending(self):
+        # One multipart message per recipient, [topic, ack, ack, ...] in the order they were produced
+        pending = self._pending
+        if len(pending) == 1:
+            self._send_frames(pending[0])
+        else:
+            by_topic = {}
+            for topic, payload in pending:
+                frames = by_topic.get(topic)
+                if frames is None:
+                    by_topic[topic] = [topic, payload]
+                else:
+                    frames.append(payload)
+            for frames in by_topic.values():
+                self._send_frames(frames)
+        self._pending = []
+
+    def _send_frames(self, frames):
+        self.ack_publisher.send_multipart(frames, flags=zmq.NOBLOCK)  # PUB drops for a full subscriber, never raises
+        if self.ack_feed_publisher is self.ack_publisher:
+            return
+        try:
+            self.ack_feed_publisher.send_multipart(frames, flags=zmq.NOBLOCK)
+        except zmq.Again:  # only with ack_hwm, a feed subscriber of this topic is ack_hwm messages behind
+            self.backpressure['ack_hwm_drops'] += 1
+
+    def recover(self):
+        if self.journal is None:
+            return
+        start = time.perf_counter()
+        replayed = 0
+        for kind, values in self.journal.replay():
+            self.bid_ask.apply_record(kind, values)
+            replayed += 1
+        self.journal.start()
+        self.bid_ask.journal = self.journal
+        logger.info("Recovered %d journal records in %.3fs: %d resting orders, %d trades", replayed,
+                    time.perf_counter() - start, len(self.bid_ask.client_orders), len(self.bid_ask.trade_store))
+        if replayed:
+            self._snapshot()  # the next start replays nothing older than this
+
+    def _snapshot(self):
+        # The engine only stalls for encoding the book and trades, the file is written and fsynced in the background
+        start = time.perf_counter()
+        path = self.journal.snapshot(self.bid_ask.snapshot_records())
+        logger.info("Snapshot %s started, engine paused %.3fs", path, time.perf_counter() - start)
+
+    def _flush(self):
+        # Orders accepted in this batch are matched once, then every ack goes out in one send
+        if self._match_pending:
+            self._match_pending = False
+            self._match()
+        if self.journal is not None:
+            # Group commit: one write for everything this iteration changed, before its batched acks go out
+            self._commit_journal()
+        if self._pending:
+            self._send_pending()
+        if self.metrics is not None:
+            self.metrics.sent()
+        if self.deltas:
+            self._publish_deltas()
+
+    def _commit_journal(self):
+        # An ack may only go out once what it confirms is written (and fsynced, with --fsync-ms 0)
+        self.bid_ask.journal_prices()
+        self.journal.commit()
+        if self.journal.records_since_snapshot >= self.snapshot_every and not self.journal.snapshot_running():
+            self._snapshot()
+
+    def _publish_deltas(self):
+        for instrument, delta in self.bid_ask.collect_deltas():
+            self.feed_publisher.send_string(f"{BOOK_DELTA_TOPIC}{instrument};{json.dumps(delta)}")
+
+    def stats(self) -> dict:
+        book = self.bid_ask
+        stats = {'instruments': self.instruments, 'resting_orders': len(book.client_orders),
+                 'bid_levels': sum(len(side.keys) for side in book.bid_queue.values()),
+                 'ask_levels': sum(len(side.keys) for side in book.ask_queue.values()),
+                 'trades': len(book.trade_store), 'pending_acks': len(self._pending),
+                 'backpressure': dict(self.backpressure)}
+        if self.metrics is not None:
+            stats.update(self.metrics.snapshot())
+        return stats
+
+    def _publish_metrics(self):
+        self.feed_publisher.send_string(f"{METRICS_TOPIC}{json.dumps(self.stats())}")
+
+    def _start_profile(self, update: str):
+        # 7;profile;start[;iterations=N][;seconds=T], whichever limit comes first stops it
+        if self.profiler is not None:
+            self._publish("profile;Profile already running")
+            return
+        limits = decode(update)
+        try:
+            iterations = int(limits['iterations']) if 'iterations' in limits else None
+            seconds = float(limits['seconds']) if 'seconds' in limits else None
+        except ValueError:
+            logger.error("Invalid profile request: %s", update)
+            self._publish(f"profile;Invalid profile request: {update}")
+            return
+        self.profiler = LoopProfiler(iterations, seconds)
+        self._profile_topic = self._reply_topic  # the summary goes back to whoever started it
+        logger.info("Profiling for %s iterations, %s seconds", iterations, self.profiler.seconds)
+        self._publish(f"profile;{json.dumps({'started': True, 'iterations': iterations, 'seconds': self.profiler.seconds})}")
+        self.profiler.start()
+
+    def _stop_profile(self):
+        profiler, self.profiler = self.profiler, None
+        if profiler is None:
+            self._publish("profile;No profile running")
+            return
+        summary = profiler.stop(self.profile_dir)
+        logger.info("Profile of %d iterations written to %s", summary['iterations'], summary['file'])
+        for entry in summary['top'][:10]:
+            logger.info("%10.6fs %8d calls  %s", entry['tottime_s'], entry['calls'], entry['function'])
+        self._publish(f"profile;{json.dumps(summary)}", self._profile_topic)
+
+    def _send_ack(self, ack: Ack):
+        if self.encoding == "binary":
+            self._publish(wire.pack_ack(ack.TargetCompID, ack.MsgType, ack.OrderID, ack.OrderQty, ack.Price,
+                                        getattr(ack, 'ActionPrice', None), getattr(ack, 'LeavesQty', None)),
+                          ack_topic(ack.TargetCompID))
+        else:
+            self._publish(ack.to_string(), ack_topic(ack.TargetCompID))
+
+    def _accept_order(self, order_from_client: Order):
+        # Books the order and registers it in the trigger index for its side
+        error = self.bid_ask.order_error(order_from_client)
+        if error is not None:  # nothing is journaled or booked
+            logger.error("Order rejected, %s: %s", error, order_from_client)
+            self._publish(f"order;Rejected: {error}: {order_from_client.to_string()}")
+            return
+        if not self.bid_ask.add_client_order(order_from_client):
+            logger.warning("Unknown order side: %s for order: %s", order_from_client.Side, order_from_client)
+        if self.metrics is not None:
+            self.metrics.lap('book')
+            self.metrics.counters['orders'] += 1
+            self.metrics.total = 'order_to_ack'
 
-    def run(self):
-        print("Starting Trade Matching Engine...")
-        context = zmq.Context()
-        subscriber = context.socket(zmq.SUB)
-        subscriber.connect("tcp://127.0.0.1:5556")
-        subscriber.setsockopt_string(zmq.SUBSCRIBE, "Q")
+        self._publish(f"{bcolors.OKCYAN}{order_from_client.to_string()} queued. {bcolors.ENDC}")
 
-        order_subscriber = context.socket(zmq.SUB)
-        order_subscriber.bind("tcp://127.0.0.1:5557")
-        order_subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+        ack_order_msg = Ack(order_from_client.SenderCompID, "3", order_from_client.OrderID, -1, order_from_client.Price)
+        self._send_ack(ack_order_msg)
 
-        ack_publisher = context.socket(zmq.PUB)
-        ack_publisher.connect("tcp://127.0.0.1:5558")
+        # The order may already be through the current price, match it now rather than on the next tick
+        if self.batch_size:
+            self._match_pending = True
+        else:
+            self._match()
+
+    def _cancel_order(self, order_id, sender_comp_id):
+        logger.debug("is cancel order: %s", order_id)
+        self._publish(f"{bcolors.OKCYAN}Cancel order: {order_id} {bcolors.ENDC}")
+
+        # cancel_order returns a tuple (success, message)
+        success, cancel_message = self.bid_ask.cancel_order(order_id, sender_comp_id)
+        if self.metrics is not None:
+            self.metrics.lap('book')
+            self.metrics.counters['cancels'] += 1
+            self.metrics.total = 'cancel_to_ack'
+        logger.debug("%s", cancel_message)
+        self._publish(f"cancel_order;{cancel_message}")
+
+    def _handle_binary_order_frame(self, frame: bytes):
+        kind = wire.frame_kind(frame)
+        try:
+            fields = wire.unpack_order(frame) if kind == wire.KIND_ORDER else \
+                wire.unpack_cancel(frame) if kind == wire.KIND_CANCEL else None
+        except ValueError as e:  # wire.FrameError or text fields that aren't UTF-8, one bad frame is dropped
+            logger.error("Dropped malformed binary order frame %r: %s", frame[:64], e)
+            return
+        if kind == wire.KIND_ORDER:
+            order = Order(*fields)
+            if self.metrics is not None:
+                self.metrics.lap('parse')
+            self._reply_topic = ack_topic(order.SenderCompID)
+            self._publish(frame)
+            self._accept_order(order)
+        elif kind == wire.KIND_CANCEL:
+            sender_comp_id, order_id = fields
+            if self.metrics is not None:
+                self.metrics.lap('parse')
+            self._reply_topic = ack_topic(sender_comp_id)
+            self._publish(frame)
+            self._cancel_order(order_id, sender_comp_id)
+        else:
+            self._reply_topic = PUBLIC_ACK_TOPIC
+            self._publish(frame)
+            logger.error("Unexpected binary frame kind %s on the order socket", kind)
+
+    def _on_market_data(self, update: bytes):
+        logger.debug(" ---------- Exchange Loop ---------- ")
+        # logger.debug("Received Market Msg: %s", update)
+        metrics = self.metrics
+        try:
+            if wire.is_binary(update):
+                quote = wire.unpack_quote(update)  # binary frames already carry numbers, no text round trip
+            else:
+                quote = self.bid_ask.parse_quote(update.decode())
+        except ValueError as e:  # wire.FrameError, not UTF-8, or a field that isn't a number
+            logger.error("Dropped malformed market data %r: %s", update[:64], e)
+            return
+        if metrics is not None:
+            metrics.lap('parse')
+        if quote is not None:
+            self.bid_ask.apply_quote(*quote)
+        if metrics is not None:
+            metrics.lap('book')
+            metrics.counters['market_data'] += 1
+        if logger.isEnabledFor(logging.DEBUG):  # the repr walks every resting order, skip it entirely when off
+            logger.debug("  self.bid_ask.client_orders %s", list(self.bid_ask.client_orders.values()))
+        filled = self._match()
+        if metrics is not None:
+            metrics.total = 'tick_to_trade' if filled else 'quote_to_book'
+
+    def _match(self) -> bool:
+        filled_orders = []
+        # self.bid_ask.try_fill_3mins_order(filled_orders)
+        metrics = self.metrics
+        if metrics is not None:
+            started = metrics.clock()
+        is_filled, message = self.bid_ask.fill_orders(filled_orders)
+        if metrics is not None:
+            metrics.histograms['match'].record(metrics.clock() - started)
+            metrics.counters['fills'] += len(filled_orders)
+        if is_filled:
+            for ack in filled_orders:
+                self._send_ack(ack)
+            self._publish(f"{bcolors.OKGREEN}Filled orders: {(filled_orders)} \n{message}{bcolors.ENDC}",
+                          PUBLIC_ACK_TOPIC)  # fills of several clients, for the ack.py monitor
+            
+            logger.debug("Order filled!")
+        else:
+            logger.debug("No order filled!")
+        return is_filled
+
+    def _on_order_message(self, frame: bytes):
+        if wire.is_binary(frame):
+            self._handle_binary_order_frame(frame)
+            return
+        try:
+            update = frame.decode()
+        except UnicodeDecodeError:
+            logger.error("Dropped order message that isn't UTF-8: %r", frame[:64])
+            return
+        # logger.debug("Received Client Msg: %s", update)
+        msg_type = update.split(';')[0]  # Assuming the first field is always the message type
+        sender_comp_id = reply_to(update, msg_type)
+        self._reply_topic = ack_topic(sender_comp_id) if sender_comp_id else PUBLIC_ACK_TOPIC
+        self._publish(update)
+        if self.metrics is not None and msg_type not in ("0", "1"):
+            self.metrics.counters['requests'] += 1
+        
+        if msg_type == "0":  # order
+            logger.debug("is order: %s", update)
+            try:
+                order = Order.from_string(update)
+            except (KeyError, ValueError) as e:  # a missing tag or a number that doesn't parse
+                logger.error("Invalid order %s: %s", e, update)
+                self._publish(f"order;Rejected: invalid order ({e!r}): {update}")
+                return
+            if self.metrics is not None:
+                self.metrics.lap('parse')
+            if self.encoding == "binary" and not wire.fits_ack(order.SenderCompID, order.OrderID):
+                # Its acks couldn't be packed, so it isn't booked at all
+                logger.error("Order rejected, IDs too long for binary acks: %s", update)
+                self._publish(f"order;Rejected: SenderCompID and OrderID must fit {wire.ID_WIDTH} bytes "
+                              f"with binary acks: {update}")
+                return
+            self._accept_order(order)
+            
+        elif msg_type == '1':  # Cancel order request
+            fields = decode(update)
+            order_id = fields.get('37')  # 37 is the tag for order ID
+            sender_comp_id = fields.get('49')  # Owner of the order, lets the cancel hit the user index directly
+
+            if order_id:
+                if self.metrics is not None:
+                    self.metrics.lap('parse')
+                self._cancel_order(order_id, sender_comp_id)
+            else:
+                logger.error("Invalid cancel order request: %s", update)
+                self._publish(f"cancel_order;Invalid cancel order request: {update}")
+
+        elif msg_type == '2':  # Order book request
+            # finish
+            logger.debug("is order book request")
+            trading_pair = update.split(';')[2]
+            depth = decode(update).get('depth')  # 2;order_book;PAIR;depth=N asks for aggregated levels
+            if depth is not None and not depth.isdigit():
+                logger.error("Invalid order book depth: %s", update)
+                self._publish(f"order_book_l2;Invalid depth: {depth}")
+                return
+            self._publish(self._order_book_message(trading_pair, None if depth is None else int(depth)))
+            
+        elif msg_type == '3':  # retrieve_executed_trades
+            logger.debug("is retrieve_executed_trades")
+            fields = decode(update)
+            trading_pair = fields.get('55')  # 55 is the tag for trading pair
+            user_id = fields.get('49')  # 49 is the tag for user id
+            
+            # Optional paging: since/until (ms ExecTime), limit, cursor (next_cursor of the previous page)
+            params = {name: fields[name] for name in TRADE_QUERY_PARAMS if name in fields}
+            if not all(value.isdigit() for value in params.values()):
+                logger.error("Invalid executed trades query: %s", update)
+                self._publish(f"retrieve_executed_trades;Invalid query: {update}")
+            elif trading_pair is not None and user_id is not None:
+                self._publish(f"{trading_pair} {user_id}")
+                params = {name: int(value) for name, value in params.items()}
+                params['limit'] = max(1, min(params.get('limit', 100), MAX_TRADES_PER_PAGE))
+                res = self.bid_ask.get_executed_trades(trading_pair, user_id, **params)
+                self._publish(f"retrieve_executed_trades;{json.dumps(res)}")
+                # executed_trades = self.bid_ask.get_executed_trades(trading_pair)
+            else:
+                logger.error("Missing trading pair or user id in update: %s", update)
+                # Optionally, send an error message back to the requester
 
-        time.sleep(0.2)  # Equivalent to usleep(200000)
+            
+        elif msg_type == '6':  # Engine stats: "6;stats", "6;stats;reset" also starts the histograms over
+            self._publish(f"stats;{json.dumps(self.stats())}")
+            if ";reset" in update and self.metrics is not None:
+                self.metrics.reset()
+
+        elif msg_type == '7':  # Profiler: "7;profile;start[;iterations=N][;seconds=T]", "7;profile;stop"
+            if update.startswith("7;profile;start"):
+                self._start_profile(update)
+            elif update.startswith("7;profile;stop"):
+                self._stop_profile()
+            else:
+                logger.error("Invalid profile request: %s", update)
+                self._publish(f"profile;Invalid profile request: {update}")
 
+        elif update.startswith("5;search_order"):  # Search order request
+            USER_ID = update.split(';')[2:3]
+            
+            order = self.bid_ask.search_user_order(USER_ID)
+            logger.debug("------------------------>search_order: %s", order)
+            if order:
+                search_order_message = f"search_order;{order}"
+                self._publish(search_order_message)
+            else:
+                self._publish(f"search_order;Order {USER_ID} {order}not found")
+
+    def _order_book_message(self, trading_pair, depth) -> bytes:
+        # Requests between two book changes are served from the cache: a dict lookup, no build or dumps
+        key = (trading_pair, depth)
+        version = self.bid_ask.book_version(trading_pair)
+        cache = self._snapshot_cache
+        cached = cache.get(key)
+        if cached is not None and cached[0] == version:
+            cache.move_to_end(key)
+            return cached[1]
+
+        if depth is not None:
+            message = f"order_book_l2;{json.dumps(self.bid_ask.get_order_book_l2(trading_pair, depth))}"
+        else:
+            order_book = self.bid_ask.get_order_book(trading_pair)
+            if logger.isEnabledFor(logging.DEBUG):  # tabulate render is only paid for when it is shown
+                logger.debug("%s", self.bid_ask.format_order_book(order_book))
+            message = f"order_book;{json.dumps(order_book)}"
+        encoded = message.encode()
+        cache[key] = (version, encoded)
+        cache.move_to_end(key)
+        if len(cache) > SNAPSHOT_CACHE_SIZE:
+            cache.popitem(last=False)  # arbitrary pairs and depths from clients can't grow it unbounded
+        return encoded
+
+    def _serve(self, socket, handler, limit: int) -> int:
+        # Handle up to limit messages already queued on socket, returns how many were handled
+        handled = 0
+        while handled < limit:
+            try:
+                frame = socket.recv(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            self._handle(handler, frame)
+            handled += 1
+        return handled
+
+    def _serve_market(self, socket, handler, limit: int) -> int:
+        handled = self._serve(socket, handler, limit)
+        self._md_read += handled
+        return handled
+
+    def _handle(self, handler, frame: bytes):
+        metrics = self.metrics
+        if metrics is None:
+            handler(frame)
+        else:
+            metrics.received()
+            handler(frame)
+            metrics.handled()
+        if not self.batch_size:  # this message's acks go out now, once the journal has them
+            if self._pending:
+                if self.journal is not None:
+                    self._commit_journal()
+                self._send_pending()
+            if metrics is not None:
+                metrics.sent()
+        elif self._pending and time.monotonic() - self._pending_since >= self.flush_deadline:
+            self._flush()
+
+    def _serve_conflated(self, socket, handler, limit: int) -> int:
+        # Drains every queued quote and handles the latest one per instrument, in the order each
+        # instrument was first seen. limit doesn't apply: at most one quote per instrument is handled.
+        latest = {}
+        received = 0
+        while received < CONFLATE_MAX_DRAIN:
+            try:
+                frame = socket.recv(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            received += 1
+            latest[conflation_key(frame)] = frame
+        if not received:
+            return 0
+        self._md_read += received
+        self.backpressure['md_conflated'] += received - len(latest)
+        for frame in latest.values():
+            self._handle(handler, frame)
+        return len(latest)
+
+    def _drain_subscriptions(self):
+        # Subscribe and unsubscribe messages of the XPUB ack feed, nothing needs them but unread they pile up
         while True:
-            print(f"{bcolors.OKCYAN} ---------- Exchange Loop ---------- {bcolors.ENDC}")
-            update = subscriber.recv_string()
-            # print(f"Received Market Msg: {update}")
-            self.bid_ask.adding_quotes_into_queues(update)
-            print(f"{bcolors.OKCYAN}  self.bid_ask.client_orders { self.bid_ask.client_orders} {bcolors.ENDC}")
-            while True:
-                try:
-                    # print("Attempting to receive message...")
-                    update = order_subscriber.recv_string(flags=zmq.NOBLOCK)
-                    # print(f"Received Client Msg: {update}")
-                    msg_type = update.split(';')[0]  # Assuming the first field is always the message type
-                    ack_publisher.send_string(update)
-                    
-                    if msg_type == "0":  # order
-                        print(f"{bcolors.OKCYAN}is order: {update} {bcolors.ENDC}")
-                        order_from_client = Order.from_string(update)
-                        self.bid_ask.client_orders.append(order_from_client)
-                        
-                        if order_from_client.Side == "1":  # Bid order
-                            self.bid_ask.insert_bid(order_from_client.TradingPair, order_from_client)
-                        elif order_from_client.Side == "2":  # Ask order
-                            self.bid_ask.insert_ask(order_from_client.TradingPair, order_from_client)
-                        else:
-                            print(f"{bcolors.WARNING}Unknown order side: {order_from_client.Side} for order: {update}{bcolors.ENDC}")
-                        
-                        
-                        ack_publisher.send_string(f"{bcolors.OKCYAN}{order_from_client.to_string()} queued. {bcolors.ENDC}")
-                        
-                        # TODO: send ack order msg
-                        ack_order_msg = Ack(order_from_client.SenderCompID, "3", order_from_client.OrderID, -1, order_from_client.Price)
-                        data = ack_order_msg.to_string()  # Assuming to_string method to serialize your message
-                        ack_publisher.send_string(data)
-                        
-                    elif msg_type == '1':  # Cancel order request
-                        segments = update.split(';')
-                        order_id = None
-                        for segment in segments:
-                            key, sep, value = segment.partition('=')
-                            if key == '37':  # Assuming 37 is the tag for order ID
-                                order_id = value
-                                break
-
-                        if order_id:
-                            print(f"{bcolors.OKCYAN}is cancel order: {order_id} {bcolors.ENDC}")
-                            ack_publisher.send_string(f"{bcolors.OKCYAN}Cancel order: {order_id} {bcolors.ENDC}")
-
-                            # Assuming cancel_order method returns a tuple (success, message)
-                            success, cancel_message = self.bid_ask.cancel_order(order_id)
-                            print(f"{bcolors.OKCYAN}{cancel_message}{bcolors.ENDC}")
-                            ack_publisher.send_string(f"cancel_order;{cancel_message}")
-                        else:
-                            print(f"{bcolors.FAIL}Invalid cancel order request: {update}{bcolors.ENDC}")
-                            ack_publisher.send_string(f"cancel_order;Invalid cancel order request: {update}")
-
-                    elif msg_type == '2':  # Order book request
-                        # finish
-                        print("is order book request")
-                        trading_pair = update.split(';')[2]
-                        order_book = self.bid_ask.get_order_book(trading_pair)
-                        
-                        formatted_order_book = self.bid_ask.format_order_book(order_book)  # Fixed line
-                        print(formatted_order_book)  # print the formatted order book to the terminal
-                        order_book_message = f"order_book;{json.dumps(order_book)}"
-                        ack_publisher.send_string(order_book_message)
-                        
-                    elif msg_type == '3':  # retrieve_executed_trades
-                        print("is retrieve_executed_trades")
-                        segments = update.split(';')
-                        trading_pair = None
-                        user_id = None
-                        for segment in segments:
-                            key, sep, value = segment.partition('=')
-                            if key == '55':  # Assuming 55 is the tag for trading pair
-                                trading_pair = value
-                            elif key == '49':  # Assuming 49 is the tag for user id
-                                user_id = value
-                        
-                        if trading_pair is not None and user_id is not None:
-                            ack_publisher.send_string(f"{trading_pair} {user_id}")
-                            res = self.bid_ask.get_executed_trades(trading_pair, user_id)
-                            ack_publisher.send_string(f"retrieve_executed_trades;{json.dumps(res)}")
-                            # executed_trades = self.bid_ask.get_executed_trades(trading_pair)
-                        else:
-                            print("Error: Missing trading pair or user id in update")
-                            # Optionally, send an error message back to the requester
-
-                        
-                    elif update.startswith("5;search_order"):  # Search order request
-                        USER_ID = update.split(';')[2:3]
-                        
-                        order = self.bid_ask.search_user_order(USER_ID)
-                        print(f"{bcolors.OKCYAN}------------------------>search_order: {order} {bcolors.ENDC}")
-                        if order:
-                            search_order_message = f"search_order;{order}"
-                            ack_publisher.send_string(search_order_message)
-                        else:
-                            ack_publisher.send_string(f"search_order;Order {USER_ID} {order}not found")
-                except zmq.Again:
+            try:
+                self.ack_feed_publisher.recv(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+    def poll_once(self, poller, timeout=None):
+        events = dict(poller.poll(timeout))
+        if events.pop(self.ack_feed_publisher, None):  # not a message to handle, nor a poll for the metrics
+            self._drain_subscriptions()
+        market = (self.subscriber, self._on_market_data, self._serve_conflated if self.conflate else self._serve_market)
+        orders = (self.order_subscriber, self._on_order_message, self._serve)
+
+        handled = 0
+        if self.fairness == "round_robin":
+            pending = [source for source in (orders, market) if source[0] in events]
+            for _ in range(self.burst):
+                pending = [(socket, handler, serve) for socket, handler, serve in pending if serve(socket, handler, 1)]
+                handled += len(pending)  # sockets still in the list just handled one message each
+                if not pending:
                     break
+        else:
+            first, second = (orders, market) if self.fairness == "orders_first" else (market, orders)
+            for socket, handler, serve in (first, second):
+                if socket in events:
+                    handled += serve(socket, handler, self.burst)
+        if self.metrics is not None and events:  # a --metrics-every timeout isn't a poll with 0 messages
+            self.metrics.counters['polls'] += 1
+            self.metrics.poll_batch.record(handled)
+        if self._md_read:
+            self._count_market_data()
+        self._flush()
+
+    def _count_market_data(self):
+        read, self._md_read = self._md_read, 0
+        backpressure = self.backpressure
+        backpressure['md_received'] += read
+        if read > backpressure['md_queue_max']:
+            backpressure['md_queue_max'] = read
+        if self.market_data_hwm and read >= self.market_data_hwm:
+            backpressure['md_hwm_hits_est'] += 1  # probably full, the streamer's PUB may have been dropping
+
+    def _open_sockets(self, context: zmq.Context):
+        self.subscriber = context.socket(zmq.SUB)
+        if self.market_data_hwm:
+            self.subscriber.setsockopt(zmq.RCVHWM, self.market_data_hwm)
+        self.subscriber.connect(self.market_data_endpoint)
+        if self.instruments:
+            # The streamer filters by topic, quotes for other instruments never reach this process
+            for instrument in self.instruments:
+                self.subscriber.setsockopt_string(zmq.SUBSCRIBE, quote_topic(instrument))
+                self.subscriber.setsockopt(zmq.SUBSCRIBE, wire.quote_topic(instrument))
+        else:
+            self.subscriber.setsockopt_string(zmq.SUBSCRIBE, "Q")
 
-            filled_orders = []
-            # self.bid_ask.try_fill_3mins_order(filled_orders)
-            is_filled, message = self.bid_ask.fill_orders(filled_orders)
-            if is_filled:
-                ack_publisher.send_string(f"{bcolors.OKGREEN}Filled orders: {(filled_orders)} \n{message}{bcolors.ENDC}")
-                
-                print("Order filled!")
+        if self.order_endpoint:
+            self.order_subscriber = context.socket(zmq.PULL)
+            self.order_subscriber.bind(self.order_endpoint)
+        else:
+            self.order_subscriber = context.socket(zmq.SUB)
+            self.order_subscriber.bind("tcp://127.0.0.1:5557")
+            self.order_subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+
+        self.ack_publisher = context.socket(zmq.PUB)
+        self.ack_feed_publisher = self.ack_publisher  # one send reaches both while neither may fail
+        if self.ack_hwm:
+            self.ack_publisher.setsockopt(zmq.SNDHWM, self.ack_hwm)
+            # An XPUB for NODROP: EAGAIN instead of a silent drop. Only clients' own topics match a message
+            # there, so a client that is behind only loses its own acks. The subscriptions it queues for
+            # reading are drained in poll_once.
+            self.ack_feed_publisher = context.socket(zmq.XPUB)
+            self.ack_feed_publisher.setsockopt(zmq.SNDHWM, self.ack_hwm)
+            self.ack_feed_publisher.setsockopt(zmq.XPUB_NODROP, 1)
+        self.ack_publisher.connect(self.ack_endpoint)  # ack.py binds 5558, so only one process can listen there
+        if self.ack_feed_endpoint:
+            self.ack_feed_publisher.connect(self.ack_feed_endpoint)
+        else:
+            self.ack_feed_publisher.bind(ACK_FEED_ENDPOINT)
+
+        if self.deltas or self.metrics_interval:
+            # Book delta feed, subscribe to "D " or to "D BTCUSDT;" for one instrument, "M " for metrics
+            self.feed_publisher = context.socket(zmq.PUB)
+            if self.delta_endpoint:
+                self.feed_publisher.connect(self.delta_endpoint)
             else:
-                print("No order filled!")
-            # TODO: send all messages
-            # ... your logic to send all messages
+                self.feed_publisher.bind("tcp://127.0.0.1:5559")
+
+    def run(self, context: zmq.Context = None):
+        # Returns once context is terminated, e.g. by a benchmark sharing it
+        logger.info("Starting Trade Matching Engine...")
+        context = context or zmq.Context()
+        try:
+            # Sockets are opened in here, a bind that fails (port in use) still closes the ones already
+            # open, or a caller's context.term() would wait on them forever
+            self._open_sockets(context)
+            time.sleep(0.2)  # Equivalent to usleep(200000)
+
+            # Both sockets are served as events arrive, an order no longer waits for the next market tick
+            poller = zmq.Poller()
+            poller.register(self.subscriber, zmq.POLLIN)
+            poller.register(self.order_subscriber, zmq.POLLIN)
+            if self.ack_feed_publisher is not self.ack_publisher:
+                poller.register(self.ack_feed_publisher, zmq.POLLIN)
+            self.recover()
+            timeout = self.metrics_interval * 1000 if self.metrics_interval else None
+            self._next_metrics = time.monotonic() + self.metrics_interval
+            profile_timeout = min(timeout or PROFILE_POLL_MS, PROFILE_POLL_MS)
+            while True:
+                self.poll_once(poller, timeout if self.profiler is None else profile_timeout)
+                if self.profiler is not None and self.profiler.tick():
+                    self._stop_profile()
+                    self._flush()
+                if self.metrics_interval and time.monotonic() >= self._next_metrics:
+                    self._next_metrics += self.metrics_interval
+                    self._publish_metrics()
+        except zmq.ContextTerminated:
+            logger.info("Context terminated, stopping")
+        finally:
+            if self.profiler is not None:
+                self.profiler.profile.disable()
+            if self.journal is not None:
+                self.journal.close()
+            for socket in (self.subscriber, self.order_subscriber, self.ack_publisher, self.ack_feed_publisher,
+                           self.feed_publisher):
+                if socket is not None:
+                    socket.close(linger=0)
+
+def add_engine_arguments(parser):
+    parser.add_argument("--quote-mode", choices=QUOTE_MODES, default="book",
+                        help="'book' appends every market quote to the book, 'top' keeps one top-of-book record per instrument")
+    parser.add_argument("--quote-history", type=int, default=0,
+                        help="with --quote-mode top, keep the last N quotes per instrument in a ring buffer")
+    parser.add_argument("--encoding", choices=wire.ENCODINGS, default="text",
+                        help="encoding of outgoing acks; text and binary orders and market data are always accepted")
+    parser.add_argument("--fairness", choices=FAIRNESS_POLICIES, default="round_robin",
+                        help="how the market data and order sockets share the loop when both are ready")
+    parser.add_argument("--burst", type=int, default=64,
+                        help="max messages taken from one socket before polling again")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="drain up to N messages per socket per iteration and publish their acks as one multipart message")
+    parser.add_argument("--flush-ms", type=float, default=1.0,
+                        help="with --batch, longest time an ack may wait in the batch before it is published")
+    parser.add_argument("--deltas", action="store_true",
+                        help="publish sequence-numbered price level deltas on tcp://127.0.0.1:5559")
+    parser.add_argument("--conflate", action="store_true",
+                        help="under a market data burst only handle the latest quote per instrument each iteration")
+    parser.add_argument("--md-hwm", type=int, default=None,
+                        help="market data socket RCVHWM, quotes beyond it are dropped by the publisher (zmq default 1000)")
+    parser.add_argument("--ack-hwm", type=int, default=None,
+                        help="ack sockets' SNDHWM; acks for a subscriber this far behind are dropped, on the client feed they are counted")
+    parser.add_argument("--max-trades-in-memory", type=int, default=100_000,
+                        help="executed trades kept in memory, older ones are spilled to --trade-spill-dir")
+    parser.add_argument("--trade-spill-dir", default=None,
+                        help="directory for spilled executed trades, a temporary directory by default")
+    parser.add_argument("--journal-dir", default=None,
+                        help="journal orders, cancels and fills here and recover from it on start")
+    parser.add_argument("--fsync-ms", type=float, default=5.0,
+                        help="group commit: fsync the journal at most every N ms, 0 fsyncs every loop iteration")
+    parser.add_argument("--journal-mmap", action="store_true", help="write the journal through a memory map")
+    parser.add_argument("--snapshot-every", type=int, default=100_000,
+                        help="journal records between snapshots, bounds what recovery has to replay; "
+                             "each one pauses the engine while the book and trades are encoded")
+    parser.add_argument("--metrics", action="store_true",
+                        help="per-stage latency histograms and counters, query them with \"6;stats\"")
+    parser.add_argument("--metrics-every", type=float, default=0.0, metavar="SECONDS",
+                        help="also publish the stats on tcp://127.0.0.1:5559, topic \"M \" (implies --metrics)")
+    parser.add_argument("--profile-dir", default="profiles",
+                        help="where \"7;profile;start\" ... \"7;profile;stop\" writes its cProfile dumps")
+    parser.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                        help="console log level, DEBUG shows the per-message trace")
+    parser.add_argument("--log-file", default=None, help="also write JSON-lines logs to this file")
+    parser.add_argument("--log-file-level", default=None, choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                        help="level for --log-file, defaults to --log-level")
+    parser.add_argument("--quiet", action="store_true", help="no console logging")
+
+
+def engine_from_args(args, **overrides) -> "TradeMatchingEngine":
+    kwargs = dict(quote_mode=args.quote_mode, quote_history=args.quote_history, encoding=args.encoding,
+                  fairness=args.fairness, burst=args.burst, batch_size=args.batch, flush_ms=args.flush_ms,
+                  deltas=args.deltas, max_trades_in_memory=args.max_trades_in_memory,
+                  trade_spill_dir=args.trade_spill_dir, journal_dir=args.journal_dir, fsync_ms=args.fsync_ms,
+                  journal_mmap=args.journal_mmap, snapshot_every=args.snapshot_every, metrics=args.metrics,
+                  metrics_interval=args.metrics_every, profile_dir=args.profile_dir, conflate=args.conflate,
+                  market_data_hwm=args.md_hwm, ack_hwm=args.ack_hwm)
+    kwargs.update(overrides)
+    return TradeMatchingEngine(**kwargs)
+
 
 if __name__ == "__main__":
-    exchange = TradeMatchingEngine()
+    parser = argparse.ArgumentParser(description="Trade matching engine")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    setup_logging(args.log_level, args.log_file, console=not args.quiet, file_level=args.log_file_level)
+    exchange = engine_from_args(args)
     exchange.run()
 
-# poetry run python exchange.py     
\ No newline at end of file
+# poetry run python exchange.py
@@ -0,0 +1,344 @@
+import glob
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, Optional, Tuple
+
+logger = logging.getLogger("journal")
+
+# Append-only journal of the engine's inbound orders, cancels and fills, plus compact snapshots.
+# Market data itself is not journaled, only the current price it leaves per instrument.
+#
+# Every record is framed as <u32 body length><u32 crc32(body)><body>. A body starts with a fixed
+# struct of the record's numbers (kind byte first), followed by its strings joined with NUL.
+# Readers stop at the first zero length, short frame or CRC mismatch, so a torn tail left by a crash
+# is ignored rather than fatal.
+#
+# Files live in one directory and rotate by generation g:
+#   journal-g.log   records appended after snapshot g
+#   snapshot-g.snap state when journal-g started: a META record, then the resting orders and trades
+# Recovery loads the newest snapshot and replays only the journals from its generation on.
+
+KIND_ORDER = 1
+KIND_CANCEL = 2
+KIND_FILL = 3
+KIND_META = 4
+KIND_PRICE = 5
+
+FRAME = struct.Struct('<II')
+# kind, OrderQty, Price, SendingTime, POVTargetPercentage, LeavesQty
+#   | MsgType, OrderID, OrdType, SenderCompID, Side, TradingPair
+ORDER_NUMS = struct.Struct('<Bddqdd')
+# kind | SenderCompID ('' when the cancel named no owner), OrderID
+CANCEL_NUMS = struct.Struct('<B')
+# kind, TradeID, ExecTime, OrderQty (executed), Price, ActionPrice, POVTargetPercentage
+#   | TradingPair, SenderCompID, OrderID, Side, OrdType
+FILL_NUMS = struct.Struct('<Bqqdddd')
+# kind | json
+META_NUMS = struct.Struct('<B')
+# kind, current price | instrument
+PRICE_NUMS = struct.Struct('<Bd')
+
+MMAP_CHUNK = 64 * 1024 * 1024  # mmap journals grow by this much at a time
+_NAME = re.compile(r'(journal|snapshot)-(\d+)\.(log|snap)$')
+
+
+def _f(value) -> float:
+    return math.nan if value is None else value
+
+
+def _nf(value: float) -> Optional[float]:
+    return None if value != value else value  # NaN marks a missing value
+
+
+def encode_order(order) -> bytes:
+    # LeavesQty lets a snapshot keep a partially filled order as it is
+    return ORDER_NUMS.pack(KIND_ORDER, _f(order.OrderQty), _f(order.Price), order.SendingTime,
+                           _f(order.POVTargetPercentage), order.LeavesQty) + \
+        '\0'.join((order.MsgType, order.OrderID, order.OrdType, order.SenderCompID, order.Side,
+                   order.TradingPair)).encode()
+
+
+def encode_cancel(order_id: str, sender_comp_id: Optional[str]) -> bytes:
+    return CANCEL_NUMS.pack(KIND_CANCEL) + f"{sender_comp_id or ''}\0{order_id}".encode()
+
+
+def encode_fill(trade) -> bytes:
+    return FILL_NUMS.pack(KIND_FILL, trade.TradeID, trade.ExecTime, _f(trade.OrderQty), _f(trade.Price),
+                          _f(trade.ActionPrice), _f(trade.POVTargetPercentage)) + \
+        '\0'.join((trade.TradingPair, trade.SenderCompID, trade.OrderID, trade.Side, trade.OrdType)).encode()
+
+
+def encode_price(instrument: str, price: float) -> bytes:
+    return PRICE_NUMS.pack(KIND_PRICE, price) + instrument.encode()
+
+
+def encode_meta(meta: dict) -> bytes:
+    return META_NUMS.pack(KIND_META) + json.dumps(meta).encode()
+
+
+def decode_record(body: bytes) -> Tuple[int, tuple]:
+    """
+    Returns (kind, values). ORDER values are in Order.__init__ order, FILL values in Trade.__init__ order,
+    CANCEL is (order_id, sender_comp_id or None), PRICE is (instrument, price), META is (dict,).
+    """
+    kind = body[0]
+    if kind == KIND_ORDER:
+        _, qty, price, sending_time, pov, leaves = ORDER_NUMS.unpack_from(body)
+        msg_type, order_id, ord_type, sender, side, pair = body[ORDER_NUMS.size:].decode().split('\0')
+        return kind, (msg_type, order_id, _nf(qty), ord_type, _nf(price), sender, sending_time, side, _nf(pov), pair,
+                      leaves)
+    if kind == KIND_CANCEL:
+        sender, order_id = body[CANCEL_NUMS.size:].decode().split('\0')
+        return kind, (order_id, sender or None)
+    if kind == KIND_FILL:
+        _, trade_id, exec_time, qty, price, action_price, pov = FILL_NUMS.unpack_from(body)
+        pair, sender, order_id, side, ord_type = body[FILL_NUMS.size:].decode().split('\0')
+        return kind, (trade_id, exec_time, pair, sender, order_id, side, _nf(qty), _nf(price), _nf(action_price),
+                      ord_type, _nf(pov))
+    if kind == KIND_PRICE:
+        _, price = PRICE_NUMS.unpack_from(body)
+        return kind, (body[PRICE_NUMS.size:].decode(), price)
+    if kind == KIND_META:
+        return kind, (json.loads(body[META_NUMS.size:]),)
+    raise ValueError(f"Unknown journal record kind: {kind}")
+
+
+def frame(body: bytes) -> bytes:
+    return FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def read_records(path: str) -> Iterator[Tuple[int, tuple]]:
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    end = len(data)
+    while offset + FRAME.size <= end:
+        length, crc = FRAME.unpack_from(data, offset)
+        if length == 0:
+            break  # zero fill after the last record of an mmap journal
+        body = data[offset + FRAME.size:offset + FRAME.size + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            logger.warning("Ignoring torn record at byte %d of %s", offset, path)
+            break
+        yield decode_record(body)
+        offset += FRAME.size + length
+
+
+class _FileWriter:
+    def __init__(self, path: str):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def write(self, data) -> None:
+        os.write(self.fd, data)
+
+    def sync(self) -> None:
+        os.fsync(self.fd)
+
+    def close(self) -> None:
+        os.fsync(self.fd)
+        os.close(self.fd)
+
+
+class _MmapWriter:
+    # Records are copied straight into a mapped, preallocated file; sync is an msync of the mapping
+    def __init__(self, path: str):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.offset = 0
+        self.size = 0
+        self.map = None
+        self.retired = []  # outgrown maps, closed by the next sync so a concurrent msync never sees them vanish
+        self._grow(MMAP_CHUNK)
+
+    def _grow(self, size: int) -> None:
+        if self.map is not None:
+            self.retired.append(self.map)
+        os.ftruncate(self.fd, size)
+        self.size = size
+        self.map = mmap.mmap(self.fd, size)
+
+    def write(self, data) -> None:
+        end = self.offset + len(data)
+        if end > self.size:
+            self._grow(max(end, self.size + MMAP_CHUNK))
+        self.map[self.offset:end] = data
+        self.offset = end
+
+    def sync(self) -> None:
+        while self.retired:  # pop and append are atomic, the engine thread may be growing the file meanwhile
+            old = self.retired.pop(0)
+            old.flush()
+            old.close()
+        self.map.flush()
+
+    def close(self) -> None:
+        self.sync()
+        self.map.close()
+        os.ftruncate(self.fd, self.offset)  # drop the unused preallocation
+        os.fsync(self.fd)
+        os.close(self.fd)
+
+
+class Journal:
+    """
+    Group-commit journal. append() only encodes into a buffer; commit(), called before acks go out
+    (once per batch, or per message without --batch), hands everything buffered to the OS in one write. With fsync_ms > 0 a background thread
+    fsyncs at most every fsync_ms, so the engine thread never waits on the disk; with 0 every commit
+    fsyncs before it returns. With use_mmap the records are copied into a memory-mapped file.
+    """
+
+    def __init__(self, directory: str, fsync_ms: float = 5.0, use_mmap: bool = False):
+        self.directory = directory
+        self.fsync_interval = fsync_ms / 1000
+        self.use_mmap = use_mmap
+        self.generation = 0
+        self.writer = None
+        self.buffer = bytearray()
+        self.records_since_snapshot = 0
+        self.writer_lock = threading.Lock()  # held by the syncer while it fsyncs, and while the writer is swapped
+        self.sync_wanted = threading.Event()
+        self.syncer = None
+        self.snapshotter = None  # thread writing the last snapshot
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind: str, generation: int) -> str:
+        ext = 'log' if kind == 'journal' else 'snap'
+        return os.path.join(self.directory, f'{kind}-{generation:06d}.{ext}')
+
+    def _generations(self, kind: str):
+        found = []
+        for path in glob.glob(os.path.join(self.directory, f'{kind}-*')):
+            match = _NAME.search(path)
+            if match:
+                found.append(int(match.group(2)))
+        return sorted(found)
+
+    def replay(self) -> Iterator[Tuple[int, tuple]]:
+        """
+        Records of the newest snapshot, then those of every journal written after it.
+        """
+        snapshots = self._generations('snapshot')
+        start = snapshots[-1] if snapshots else 0
+        if snapshots:
+            yield from read_records(self._path('snapshot', start))
+        for generation in self._generations('journal'):
+            if generation >= start:
+                yield from read_records(self._path('journal', generation))
+
+    def start(self) -> None:
+        # A fresh generation after recovery, earlier files are never appended to again
+        existing = self._generations('journal') + self._generations('snapshot')
+        self._open(max(existing, default=0) + 1)
+        if self.fsync_interval > 0:
+            self.syncer = threading.Thread(target=self._sync_loop, name="journal-fsync", daemon=True)
+            self.syncer.start()
+
+    def _sync_loop(self) -> None:
+        while True:
+            self.sync_wanted.wait()
+            self.sync_wanted.clear()
+            with self.writer_lock:
+                if self.closed:
+                    return
+                if self.writer is not None:  # None only once closed
+                    self.writer.sync()
+            time.sleep(self.fsync_interval)  # whatever is written meanwhile shares the next fsync
+
+    def _open(self, generation: int) -> None:
+        self.generation = generation
+        path = self._path('journal', generation)
+        self.writer = _MmapWriter(path) if self.use_mmap else _FileWriter(path)
+
+    def append(self, body: bytes) -> None:
+        buffer = self.buffer
+        buffer += FRAME.pack(len(body), zlib.crc32(body))
+        buffer += body
+        self.records_since_snapshot += 1
+
+    def commit(self) -> None:
+        if not self.buffer:
+            return
+        self.writer.write(self.buffer)
+        self.buffer.clear()
+        if self.syncer is None:
+            self.writer.sync()
+        else:
+            self.sync_wanted.set()
+
+    def snapshot(self, records: Iterator[bytes]) -> str:
+        """
+        Switch to journal g+1 and write the state given as record bodies as snapshot g+1 from a
+        background thread, which then deletes the files it supersedes. Returns the snapshot path.
+        Only the encoding of the records and the switch happen on the caller's thread.
+        """
+        self.join_snapshot()
+        self.commit()
+        data = b''.join(map(frame, records))  # the copy the background write works from
+        with self.writer_lock:
+            old_writer = self.writer
+            self._open(self.generation + 1)
+        self.records_since_snapshot = 0
+        # Until snapshot g+1 is in place, recovery uses the previous snapshot plus journals g and g+1
+        path = self._path('snapshot', self.generation)
+        self.snapshotter = threading.Thread(target=self._write_snapshot, args=(old_writer, self.generation, data),
+                                            name="journal-snapshot", daemon=True)
+        self.snapshotter.start()
+        return path
+
+    def snapshot_running(self) -> bool:
+        return self.snapshotter is not None and self.snapshotter.is_alive()
+
+    def join_snapshot(self) -> None:
+        if self.snapshotter is not None:
+            self.snapshotter.join()
+            self.snapshotter = None
+
+    def _write_snapshot(self, old_writer, generation: int, data: bytes) -> None:
+        start = time.perf_counter()
+        path = self._path('snapshot', generation)
+        tmp = f'{path}.tmp'
+        try:
+            old_writer.close()
+            with open(tmp, 'wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, path)  # atomic: a crash leaves either the old or the new snapshot, never half of one
+            self._sync_directory()
+            for old in self._generations('journal'):
+                if old < generation:
+                    os.remove(self._path('journal', old))
+            for old in self._generations('snapshot'):
+                if old < generation:
+                    os.remove(self._path('snapshot', old))
+        except OSError:
+            # The older snapshot and journals are still there, recovery just replays a longer tail
+            logger.exception("Snapshot %s failed", path)
+            return
+        logger.info("Snapshot %s written in %.3fs", path, time.perf_counter() - start)
+
+    def _sync_directory(self) -> None:
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self) -> None:
+        if self.writer is None:
+            return
+        self.join_snapshot()
+        self.commit()
+        with self.writer_lock:
+            self.writer.close()
+            self.writer = None
+            self.closed = True
+        self.sync_wanted.set()  # lets the syncer see the journal is closed and exit
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import random
+import time
+
+import wire
+from async_client import AsyncTradingClient
+from metrics import Histogram
+
+# Drives a running exchange with scripted order flow from any number of AsyncTradingClients and reports
+# what it sustained: orders/s, booking ack latency and fills. Each client sends its share of --rate in
+# small bursts, at most --max-in-flight orders waiting for their ack at a time.
+
+DEFAULT_PRICE = 30000.0  # reference price for instruments without a quote yet (the benchmark generators' start)
+MAX_RESTING = 50  # per client, older resting orders are canceled beyond this
+
+
+def passive(rng, mid, spread):
+    # Rests away from the touch, cancels keep the book bounded
+    side = rng.choice("12")
+    offset = round(rng.random() * spread, 2) + 0.01
+    return side, round(0.1 + rng.random(), 3), round(mid - offset if side == "1" else mid + offset, 2)
+
+
+def aggressive(rng, mid, spread):
+    # Crosses the quote by up to spread, fills against it or against resting orders
+    side = rng.choice("12")
+    offset = round(rng.random() * spread, 2) + 0.01
+    return side, round(0.1 + rng.random(), 3), round(mid + offset if side == "1" else mid - offset, 2)
+
+
+def mixed(rng, mid, spread):
+    return (aggressive if rng.random() < 0.3 else passive)(rng, mid, spread)
+
+
+STRATEGIES = {'passive': passive, 'aggressive': aggressive, 'mixed': mixed}
+
+
+class LoadStats:
+    def __init__(self):
+        self.sent = 0
+        self.accepted = 0
+        self.fills = 0
+        self.cancels = 0
+        self.throttled = 0  # send slots skipped because --max-in-flight orders were unacked
+        self.ack_latency = Histogram()  # ns from send to the booking ack
+
+    def on_accepted(self, future):
+        if future.cancelled():
+            return
+        self.accepted += 1
+        self.ack_latency.record(time.perf_counter_ns() - future.result().sent_ns)
+
+
+async def drive(client: AsyncTradingClient, strategy, pairs, rate: float, duration: float, max_in_flight: int,
+                spread: float, stats: LoadStats, seed: int):
+    rng = random.Random(seed)
+    resting = []
+    in_flight = set()
+    start = time.perf_counter()
+    sent = 0
+    while (elapsed := time.perf_counter() - start) < duration:
+        for _ in range(int(elapsed * rate) - sent):  # orders due by now
+            sent += 1
+            if len(in_flight) >= max_in_flight:
+                stats.throttled += 1
+                continue
+            pair = pairs[sent % len(pairs)]
+            bid, ask = client.quotes.get(pair, (DEFAULT_PRICE, DEFAULT_PRICE))
+            mid = (bid + ask) / 2 if bid == bid and ask == ask else DEFAULT_PRICE  # nan-safe
+            accepted = client.place_order(pair, *strategy(rng, mid, spread))
+            accepted.add_done_callback(stats.on_accepted)
+            accepted.add_done_callback(in_flight.discard)
+            in_flight.add(accepted)
+            stats.sent += 1
+            resting.append(accepted)
+            if len(resting) > MAX_RESTING:
+                oldest = resting.pop(0)
+                if oldest.done() and not oldest.cancelled() and oldest.result().order_id in client.orders:
+                    client.cancel(oldest.result().order_id)
+                    stats.cancels += 1
+        await asyncio.sleep(0.001)
+
+
+async def run(args):
+    pairs = [pair.strip().upper() for pair in args.pairs.split(',')]
+    stats = LoadStats()
+    clients = [AsyncTradingClient(encoding=args.encoding, quotes=True) for _ in range(args.clients)]
+    for client in clients:
+        client.on_fill = lambda order, qty, price: setattr(stats, 'fills', stats.fills + 1)
+        await client.start()
+    print(f"{args.clients} clients, {args.strategy}, {args.rate:,.0f} orders/s for {args.duration}s on {','.join(pairs)}")
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(client, STRATEGIES[args.strategy], pairs, args.rate / args.clients, args.duration,
+                                 args.max_in_flight, args.spread, stats, args.seed + idx)
+                           for idx, client in enumerate(clients)))
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(args.drain)  # acks of the last orders
+    for client in clients:
+        await client.close()
+
+    latency = stats.ack_latency.summary()
+    print(f"sent {stats.sent:,} ({stats.sent / elapsed:,.0f}/s), accepted {stats.accepted:,}, "
+          f"unacked {stats.sent - stats.accepted:,}, throttled {stats.throttled:,}, cancels {stats.cancels:,}, "
+          f"fills {stats.fills:,}")
+    print(f"order -> booking ack  p50 {latency['p50_us']:.0f}us  p99 {latency['p99_us']:.0f}us  "
+          f"max {latency['max_us']:.0f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scripted order flow against a running exchange")
+    parser.add_argument("--rate", type=float, default=1000, help="orders/s over all clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--clients", type=int, default=1, help="clients, each with its own SenderCompID")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="mixed",
+                        help="passive orders rest, aggressive ones cross the quote, mixed is 30%% aggressive")
+    parser.add_argument("--pairs", default="BTCUSDT,ETHUSDT", help="instruments, comma separated")
+    parser.add_argument("--spread", type=float, default=5.0, help="how far from the mid orders are priced")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="per client, orders sent and not yet acked")
+    parser.add_argument("--encoding", choices=wire.ENCODINGS, default="text")
+    parser.add_argument("--drain", type=float, default=1.0, help="seconds to wait for the last acks")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
+
+# poetry run python load_generator.py --rate 5000 --duration 10 --clients 4
@@ -1,60 +1,180 @@
 import zmq
+import argparse
 import csv
+import heapq
+import os
 import time
-import sys
-import threading
+from operator import itemgetter
+from tag_codec import MARKET_DATA_TOPIC, encode_quote
+import wire
 
-def process_csv(file_path, publisher, instrument):
+REPLAY_MODES = ("fixed", "realtime", "fast")
+
+
+class ReplayClock:
+    """
+    Paces publishing. "fixed" waits interval seconds between messages (the original 1 msg/s),
+    "realtime" follows the gaps between event_time stamps divided by speed, "fast" never waits.
+    """
+
+    def __init__(self, mode="fixed", speed=1.0, interval=1.0):
+        self.mode = mode
+        self.speed = speed
+        self.interval = interval
+        self.first_event_time = None
+        self.start = None
+
+    def wait(self, event_time_ms):
+        if self.mode == "fast":
+            return
+        now = time.monotonic()
+        if self.start is None:
+            self.first_event_time = event_time_ms
+            self.start = now
+            return
+        if self.mode == "fixed":
+            time.sleep(self.interval)
+            return
+        # Schedule against the first message rather than the previous one, so sleep overshoot doesn't accumulate
+        due = self.start + (event_time_ms - self.first_event_time) / 1000 / self.speed
+        if due > now:
+            time.sleep(due - now)
+
+
+class RateReporter:
+    def __init__(self, label, every=5.0):
+        self.label = label
+        self.every = every
+        self.count = 0
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.last_count = 0
+
+    def tick(self):
+        self.count += 1
+        now = time.monotonic()
+        if now - self.last_report >= self.every:
+            rate = (self.count - self.last_count) / (now - self.last_report)
+            print(f'{self.label}: {rate:,.0f} msg/s ({self.count:,} sent)')
+            self.last_report = now
+            self.last_count = self.count
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        print(f'{self.label}: {self.count:,} messages in {elapsed:.2f}s, {rate:,.0f} msg/s achieved')
+
+
+def instrument_from_path(file_path):
+    # Binance files are named like BTCUSDT-bookTicker-2024-01-01.csv
+    return os.path.basename(file_path).split('-')[0].split('.')[0].upper()
+
+
+def read_book_ticker(file_path, instrument):
+    """
+    Lazily yield (event_time, instrument, row) from a bookTicker CSV, one row at a time.
+    """
     print(f'Opening file: {file_path}')
-    content = []
     with open(file_path, newline='') as file:
         csv_reader = csv.reader(file)
-        header = next(csv_reader)  # Skip header row
         for row in csv_reader:
-            content.append(row)
-
-    row_idx = 0
-    while row_idx < len(content):
-        row = content[row_idx]
-        data = (
-            f"instrument={instrument};"
-            f"update_id={row[0]};"
-            f"best_bid_price={row[1]};"
-            f"best_bid_qty={row[2]};"
-            f"best_ask_price={row[3]};"
-            f"best_ask_qty={row[4]};"
-            f"transaction_time={row[5]};"
-            f"event_time={row[6]};"
-        )
-        print(f'sent: {data}')
-        data = f"Q {data}"
-        publisher.send_string(data)
-        row_idx += 1
-        time.sleep(1)
+            if not row or not row[0].isdigit():
+                continue  # header row (some Binance dumps ship without one) or blank line
+            yield int(row[6]), instrument, row
+
+
+def read_book_ticker_cached(file_path, instrument):
+    """
+    Same rows as read_book_ticker, served from the memory-mapped columnar cache (built on first use).
+    """
+    from book_ticker_cache import load_book_ticker, iter_rows  # numpy is only needed with --cache
+    print(f'Opening cache for: {file_path}')
+    for row in iter_rows(load_book_ticker(file_path)):
+        yield row[6], instrument, row
+
+
+def merge_by_event_time(streams):
+    # k-way merge: holds one pending row per file, whatever the number or size of the files.
+    # Rows with equal event_time keep the order the files were given in.
+    return heapq.merge(*streams, key=itemgetter(0))
+
+
+def publish_quotes(quotes, publisher, encoding="text", clock=None, echo=True, report_every=5.0, label="all"):
+    clock = clock or ReplayClock()
+    reporter = RateReporter(label, report_every)
+    for event_time, instrument, row in quotes:
+        clock.wait(event_time)
+        if encoding == "binary":
+            frame = wire.pack_quote(instrument, int(row[0]), float(row[1]), float(row[2]), float(row[3]),
+                                    float(row[4]), int(row[5]), event_time)
+            if echo:
+                print(f'sent: {row}')
+            publisher.send(frame)
+        else:
+            data = encode_quote(instrument, row)
+            if echo:
+                print(f'sent: {data}')
+            data = f"{MARKET_DATA_TOPIC}{data}"
+            publisher.send_string(data)
+        reporter.tick()
+    reporter.summary()
+
+
+def process_csv(file_path, publisher, instrument, encoding="text", clock=None, echo=True, report_every=5.0):
+    publish_quotes(read_book_ticker(file_path, instrument), publisher, encoding, clock, echo, report_every, instrument)
+
+
+def parse_source(source):
+    # "path" or "INSTRUMENT=path"
+    instrument, sep, file_path = source.partition('=')
+    if not sep:
+        return instrument_from_path(source), source
+    return instrument.upper(), file_path
+
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python marketDataStreamer.py <path_to_csv1> <path_to_csv2>")
-        return
+    parser = argparse.ArgumentParser(description="Stream Binance bookTicker CSVs as market data")
+    parser.add_argument("csv_files", nargs='+',
+                        help="bookTicker CSVs, as path (instrument taken from the file name) or INSTRUMENT=path")
+    parser.add_argument("--encoding", choices=wire.ENCODINGS, default="text",
+                        help="'text' tag=value messages or fixed-layout 'binary' frames")
+    parser.add_argument("--mode", choices=REPLAY_MODES, default="fixed",
+                        help="'fixed' sends one message per --interval, 'realtime' follows event_time "
+                             "scaled by --speed, 'fast' sends as fast as possible")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between messages in fixed mode")
+    parser.add_argument("--speed", type=float, default=1.0, help="realtime multiplier, e.g. 10 replays at 10x")
+    parser.add_argument("--backpressure", action="store_true",
+                        help="block when a subscriber falls --hwm messages behind instead of dropping")
+    parser.add_argument("--hwm", type=int, default=1000, help="send high-water mark, in messages")
+    parser.add_argument("--report-every", type=float, default=5.0, help="seconds between msg/s reports")
+    parser.add_argument("--cache", action="store_true",
+                        help="read through the memory-mapped columnar cache (needs numpy), built on first use")
+    parser.add_argument("--echo", action=argparse.BooleanOptionalAction, default=None,
+                        help="print every message sent, on by default only in fixed mode")
+    args = parser.parse_args()
+    echo = args.mode == "fixed" if args.echo is None else args.echo
 
     # Prepare the PUB streaming socket
     context = zmq.Context()
-    publisher = context.socket(zmq.PUB)
+    if args.backpressure:
+        # XPUB with NODROP makes send block at the high-water mark instead of silently dropping
+        publisher = context.socket(zmq.XPUB)
+        publisher.setsockopt(zmq.XPUB_NODROP, 1)
+    else:
+        publisher = context.socket(zmq.PUB)
+    publisher.setsockopt(zmq.SNDHWM, args.hwm)
     publisher.bind("tcp://127.0.0.1:5556")
     time.sleep(0.2)  # Equivalent to usleep(200000)
 
-    # Start threads to process each CSV file
-    thread1 = threading.Thread(target=process_csv, args=(sys.argv[1], publisher, "BTCUSDT"))
-    thread2 = threading.Thread(target=process_csv, args=(sys.argv[2], publisher, "ETHUSDT"))
-    thread1.start()
-    thread2.start()
-
-    # Wait for both threads to complete
-    thread1.join()
-    thread2.join()
+    # One loop publishes every instrument in event_time order
+    reader = read_book_ticker_cached if args.cache else read_book_ticker
+    streams = [reader(file_path, instrument) for instrument, file_path in map(parse_source, args.csv_files)]
+    publish_quotes(merge_by_event_time(streams), publisher, args.encoding,
+                   ReplayClock(args.mode, args.speed, args.interval), echo, args.report_every)
 
 if __name__ == "__main__":
     main()
 
 
-# poetry run python market_data_streamer.py data/BTCUSDT-bookTicker.csv data/ETHUSDT-bookTicker.csv
\ No newline at end of file
+# poetry run python market_data_streamer.py data/BTCUSDT-bookTicker.csv data/ETHUSDT-bookTicker.csv
+# poetry run python market_data_streamer.py data/BTCUSDT-bookTicker.csv data/ETHUSDT-bookTicker.csv --mode realtime --speed 10
@@ -0,0 +1,117 @@
+import time
+from typing import Dict
+
+# Engine latency histograms and counters, see TradeMatchingEngine(metrics=True).
+#
+# Every message is stamped with time.monotonic_ns() when it is received and again after each stage:
+#   parse   received -> decoded into an Order / quote fields
+#   book    decoded -> resting book or top of book updated
+#   match   one fill_orders() call
+#   ack     book updated -> its acks handed to zmq (includes matching and, with --batch, the wait for the flush)
+# plus end to end: order_to_ack, cancel_to_ack, tick_to_trade (a quote that filled client orders, until
+# the fill acks are out) and quote_to_book (a quote that filled nothing).
+
+STAGES = ('parse', 'book', 'match', 'ack')
+TOTALS = ('order_to_ack', 'cancel_to_ack', 'tick_to_trade', 'quote_to_book')
+COUNTERS = ('market_data', 'orders', 'cancels', 'requests', 'fills', 'polls')
+
+SUB_BUCKETS = 4  # per power of two: a bucket is at most 25% wider than its lower bound
+BUCKETS = 64 * SUB_BUCKETS
+
+
+def bucket_upper(index: int) -> int:
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((SUB_BUCKETS + index % SUB_BUCKETS + 1) << shift) - 1
+
+
+class Histogram:
+    """
+    Fixed log-linear buckets of nanosecond values: recording is a few integer ops and a list increment,
+    memory is constant, percentiles are exact to the bucket (within 25%).
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        if value < SUB_BUCKETS:
+            index = max(value, 0)
+        else:  # the top three bits pick the power of two and the sub-bucket
+            shift = value.bit_length() - 3
+            index = (shift + 1) * SUB_BUCKETS + ((value >> shift) & (SUB_BUCKETS - 1))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> int:
+        # Upper bound of the bucket holding the q-th value, never above the largest value seen
+        if not self.count:
+            return 0
+        rank = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_upper(index), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {'count': self.count,
+                'mean_us': round(self.total / self.count / 1000, 3) if self.count else 0.0,
+                'p50_us': self.percentile(0.50) / 1000, 'p99_us': self.percentile(0.99) / 1000,
+                'p999_us': self.percentile(0.999) / 1000, 'max_us': self.max / 1000}
+
+
+class EngineMetrics:
+    def __init__(self):
+        self.clock = time.monotonic_ns
+        self.histograms = {name: Histogram() for name in STAGES + TOTALS}
+        self.poll_batch = Histogram()  # messages handled per poll, how far the sockets' queues had built up
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started = self.clock()
+        self.t_recv = 0
+        self.t_last = 0
+        self.total = None  # end to end histogram of the message being handled, None records none
+        self.unsent = []  # [(t_recv, t_last, total)] of handled messages whose acks are still batched
+
+    def reset(self) -> None:
+        self.__init__()
+
+    def received(self) -> None:
+        self.t_recv = self.t_last = self.clock()
+        self.total = None
+
+    def lap(self, stage: str) -> None:
+        now = self.clock()
+        self.histograms[stage].record(now - self.t_last)
+        self.t_last = now
+
+    def handled(self) -> None:
+        self.unsent.append((self.t_recv, self.t_last, self.total))
+
+    def sent(self) -> None:
+        # Acks of every handled message are on the wire now
+        if not self.unsent:
+            return
+        now = self.clock()
+        ack = self.histograms['ack']
+        for t_recv, t_last, total in self.unsent:
+            ack.record(now - t_last)
+            if total is not None:
+                self.histograms[total].record(now - t_recv)
+        self.unsent.clear()
+
+    def snapshot(self) -> dict:
+        return {'uptime_s': round((self.clock() - self.started) / 1e9, 3),
+                'counters': dict(self.counters),
+                'latency': {name: histogram.summary() for name, histogram in self.histograms.items()},
+                'poll_batch': {'count': self.poll_batch.count, 'p50': self.poll_batch.percentile(0.5),
+                               'p99': self.poll_batch.percentile(0.99), 'max': self.poll_batch.max}}
@@ -0,0 +1,248 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from heapq import heapify, heappop, heappush
+from itertools import count
+from typing import Iterator, Optional
+
+QTY_DECIMALS = 8  # quantities are kept at wire's fixed point resolution, float dust must not leave an order open
+
+
+class PriceLevel:
+    __slots__ = ('price', 'orders', 'total_qty')
+
+    def __init__(self, price: float):
+        self.price = price
+        self.orders = OrderedDict()  # {Order: None}, insertion order == time priority
+        self.total_qty = 0.0
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def __iter__(self):
+        return iter(self.orders)
+
+
+class BookSide:
+    """
+    One side of an instrument's book: sorted price levels, each holding a FIFO queue of orders.
+    """
+
+    def __init__(self, is_bid: bool, track_changes: bool = False):
+        self.is_bid = is_bid
+        # Level prices as ascending keys, price for bids and -price for asks, so the best level is always
+        # keys[-1]: matching drops it with a pop from the end. Opening or dropping any other level memmoves
+        # the keys behind it, O(levels), which is cheap as long as books are a few thousand levels deep.
+        self.sign = 1.0 if is_bid else -1.0
+        self.keys = []
+        self.levels = {}  # {price: PriceLevel}
+        self.order_count = 0
+        self.dirty = set() if track_changes else None  # prices changed since the last take_dirty()
+
+    def __len__(self) -> int:
+        return self.order_count
+
+    def __iter__(self):
+        # Orders in price-time priority, best level first
+        for level in self.iter_levels():
+            yield from level.orders
+
+    def add(self, order) -> None:
+        level = self.levels.get(order.Price)
+        if level is None:
+            level = PriceLevel(order.Price)
+            self.levels[order.Price] = level
+            insort(self.keys, self.sign * order.Price)  # only paid when a new level opens
+        level.orders[order] = None
+        level.total_qty = round(level.total_qty + order.LeavesQty, QTY_DECIMALS)
+        self.order_count += 1
+        if self.dirty is not None:
+            self.dirty.add(order.Price)
+
+    def remove(self, order) -> bool:
+        level = self.levels.get(order.Price)
+        if level is None or order not in level.orders:
+            return False
+        del level.orders[order]
+        level.total_qty = round(level.total_qty - order.LeavesQty, QTY_DECIMALS)
+        self.order_count -= 1
+        if self.dirty is not None:
+            self.dirty.add(level.price)
+        if not level.orders:
+            self._drop_level(level.price)
+        return True
+
+    def reduce(self, order, qty: float) -> None:
+        # A partial or full fill: the order keeps its place in the level's queue, removal is up to the caller.
+        # Rounded so 0.3 - 0.1 - 0.1 - 0.1 is 0 and not 2.8e-17
+        order.LeavesQty = round(order.LeavesQty - qty, QTY_DECIMALS)
+        level = self.levels.get(order.Price)
+        if level is not None and order in level.orders:
+            level.total_qty = round(level.total_qty - qty, QTY_DECIMALS)
+            if self.dirty is not None:
+                self.dirty.add(level.price)
+
+    def _drop_level(self, price: float) -> None:
+        del self.levels[price]
+        key = self.sign * price
+        keys = self.keys
+        if keys[-1] == key:
+            keys.pop()
+        else:
+            del keys[bisect_left(keys, key)]
+
+    def best_price(self) -> Optional[float]:
+        if not self.keys:
+            return None
+        return self.sign * self.keys[-1]
+
+    def best_level(self) -> Optional[PriceLevel]:
+        price = self.best_price()
+        return None if price is None else self.levels[price]
+
+    def pop_best(self):
+        level = self.best_level()
+        if level is None:
+            return None
+        order, _ = level.orders.popitem(last=False)
+        level.total_qty = round(level.total_qty - order.LeavesQty, QTY_DECIMALS)
+        self.order_count -= 1
+        if self.dirty is not None:
+            self.dirty.add(level.price)
+        if not level.orders:
+            self._drop_level(level.price)
+        return order
+
+    def iter_levels(self) -> Iterator[PriceLevel]:
+        levels = self.levels
+        sign = self.sign
+        for key in reversed(self.keys):
+            yield levels[sign * key]
+
+    def depth(self, n: int) -> list:
+        # Aggregated [price, total qty, order count] for the best n levels
+        rows = []
+        for level in self.iter_levels():
+            if len(rows) >= n:
+                break
+            rows.append([level.price, level.total_qty, len(level.orders)])
+        return rows
+
+    def level_row(self, price: float) -> list:
+        # An emptied level reads as qty 0, count 0, which is how a delta says "remove"
+        level = self.levels.get(price)
+        return [price, level.total_qty, len(level.orders)] if level else [price, 0.0, 0]
+
+    def mark(self, price: float) -> None:
+        # For level changes that don't come from add/remove, e.g. the top-of-book quote moving
+        if self.dirty is not None:
+            self.dirty.add(price)
+
+    def take_dirty(self) -> list:
+        if not self.dirty:
+            return []
+        prices = sorted(self.dirty, reverse=self.is_bid)
+        self.dirty.clear()
+        return prices
+
+    def clear(self) -> None:
+        if self.dirty is not None:
+            self.dirty.update(self.levels)
+        self.keys.clear()
+        self.levels.clear()
+        self.order_count = 0
+
+
+class MatchQueue:
+    """
+    Resting client orders for one instrument and side in price-time priority.
+
+    The best order, highest bid or lowest ask and earliest at that price, is always at the top of
+    the heap, so matching an incoming event costs O(log n) per execution. A partially filled order
+    stays at the top with its priority; filled and cancelled orders are discarded lazily when they surface.
+    """
+
+    def __init__(self, is_buy: bool, seq=None):
+        self.is_buy = is_buy
+        self.heap = []  # [(key, seq, order)], key is -Price for buys so the heap top is the highest bid
+        self.live = set()
+        self.seq = seq if seq is not None else count()  # arrival order; shared by both sides of a book
+
+    def __len__(self) -> int:
+        return len(self.live)
+
+    def push(self, order) -> None:
+        key = -order.Price if self.is_buy else order.Price
+        heappush(self.heap, (key, next(self.seq), order))
+        self.live.add(order)
+
+    def discard(self, order) -> None:
+        self.live.discard(order)
+        # Rebuild once dead entries dominate so cancel storms don't grow the heap unbounded
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.live):
+            self.heap = [entry for entry in self.heap if entry[2] in self.live]
+            heapify(self.heap)
+
+    def peek(self) -> Optional[tuple]:
+        # (key, seq, order) of the best live order, or None
+        heap = self.heap
+        while heap:
+            if heap[0][2] in self.live:
+                return heap[0]
+            heappop(heap)
+        return None
+
+
+class TopOfBook:
+    """
+    Latest market quote for one instrument, updated in place on every bookTicker message.
+
+    With history > 0 the previous quotes are kept in a bounded ring buffer of tuples.
+    """
+    __slots__ = ('instrument', 'bid_price', 'bid_qty', 'ask_price', 'ask_qty',
+                 'update_id', 'transaction_time', 'event_time', 'history')
+
+    def __init__(self, instrument: str, history: int = 0):
+        self.instrument = instrument
+        self.bid_price = None
+        self.bid_qty = None
+        self.ask_price = None
+        self.ask_qty = None
+        self.update_id = None
+        self.transaction_time = 0
+        self.event_time = 0
+        self.history = deque(maxlen=history) if history > 0 else None
+
+    def update(self, bid_price, bid_qty, ask_price, ask_qty, update_id, transaction_time, event_time) -> None:
+        if self.history is not None and self.update_id is not None:
+            self.history.append(self.as_tuple())
+        self.bid_price = bid_price
+        self.bid_qty = bid_qty
+        self.ask_price = ask_price
+        self.ask_qty = ask_qty
+        self.update_id = update_id
+        self.transaction_time = transaction_time
+        self.event_time = event_time
+
+    def as_tuple(self) -> tuple:
+        return (self.update_id, self.bid_price, self.bid_qty, self.ask_price, self.ask_qty,
+                self.transaction_time, self.event_time)
+
+    def quote_dict(self, is_bid: bool) -> Optional[dict]:
+        # Same shape as Order.to_dict() so book consumers can't tell the quote from a resting order
+        price, qty = (self.bid_price, self.bid_qty) if is_bid else (self.ask_price, self.ask_qty)
+        if price is None or not qty:  # qty 0 once client orders consumed it
+            return None
+        side_name = 'bid' if is_bid else 'ask'
+        return {
+            'MsgType': 'D',
+            'OrderID': f"{self.instrument}_{side_name}_{self.event_time}",
+            'OrderQty': qty,
+            'OrdType': '2',
+            'Price': price,
+            'SenderCompID': 'EXCHANGE',
+            'SendingTime': self.transaction_time,
+            'Side': '1' if is_bid else '2',
+            'POVTargetPercentage': 0.0,
+            'TradingPair': self.instrument,
+            'LeavesQty': qty
+        }
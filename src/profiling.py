@@ -0,0 +1,57 @@
+import cProfile
+import os
+import pstats
+import time
+from typing import Optional
+
+# On-demand cProfile of the engine loop, started and stopped by "7;profile;..." control messages.
+# Nothing is installed while no profile runs: the loop only checks TradeMatchingEngine.profiler is None.
+
+DEFAULT_SECONDS = 10.0  # a start without a limit still stops on its own
+TOP_FUNCTIONS = 25
+
+
+class LoopProfiler:
+    def __init__(self, iterations: Optional[int] = None, seconds: Optional[float] = None):
+        if iterations is None and seconds is None:
+            seconds = DEFAULT_SECONDS
+        self.iterations_left = iterations
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.iterations = 0
+        self.started = time.time()
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def tick(self) -> bool:
+        # Called once per loop iteration, True once the iteration or time limit is reached
+        self.iterations += 1
+        if self.iterations_left is not None:
+            self.iterations_left -= 1
+            if self.iterations_left <= 0:
+                return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def stop(self, directory: str, top: int = TOP_FUNCTIONS) -> dict:
+        """
+        Disables the profiler, dumps it to directory (readable with pstats or snakeviz) and returns
+        the top functions by own time. 'file' says why when the dump couldn't be written.
+        """
+        self.profile.disable()
+        path = os.path.join(directory, f"engine-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))}"
+                                       f"-{os.getpid()}.prof")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self.profile.dump_stats(path)
+        except OSError as e:  # the summary is still worth having, and the engine must keep running
+            path = f"not written: {e}"
+
+        stats = pstats.Stats(self.profile).stats
+        ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+        return {'file': path, 'iterations': self.iterations, 'seconds': round(time.time() - self.started, 3),
+                'total_s': round(sum(entry[2] for entry in stats.values()), 6),
+                'top': [{'function': pstats.func_std_string(func), 'calls': calls, 'tottime_s': round(tottime, 6),
+                         'cumtime_s': round(cumtime, 6), 'per_call_us': round(tottime / calls * 1e6, 3) if calls else 0.0}
+                        for func, (_, calls, tottime, cumtime, _) in ranked]}
@@ -0,0 +1,252 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import zmq
+
+import wire
+from engine_logging import setup_logging
+from exchange import ACK_FEED_ENDPOINT, add_engine_arguments, engine_from_args
+from tag_codec import PUBLIC_ACK_TOPIC, ack_topic, decode
+
+logger = logging.getLogger("router")
+
+# Sharded exchange: one TradeMatchingEngine process per group of instruments.
+#
+#   clients --PUB--> :5557 router --PUSH--> shard i (PULL :SHARD_BASE_PORT+i), picked by TradingPair
+#   streamer :5556 --> every shard, subscribed only to its own instruments' quote topics
+#   shard acks --PUB--> :5558, the ack bus, exactly as a single engine publishes them
+#   shard acks --PUB--> :5568 router proxy --> :5560, the client ack feed
+#   shard deltas/metrics --PUB--> :5569 router proxy --> :5559, the book delta and metrics feed
+#
+# Cancels don't carry a TradingPair, so the router remembers which shard each (SenderCompID, OrderID)
+# went to. Search requests and cancels it can't place are sent to every shard.
+
+SHARD_BASE_PORT = 5570
+DELTA_PROXY_ENDPOINT = "tcp://127.0.0.1:5569"
+ACK_PROXY_ENDPOINT = "tcp://127.0.0.1:5568"
+MAX_TRACKED_ORDERS = 1_000_000
+
+
+class OrderRouter:
+    def __init__(self, shards: List[List[str]], base_port: int = SHARD_BASE_PORT,
+                 max_tracked: int = MAX_TRACKED_ORDERS):
+        self.shard_of = {}  # {TradingPair: shard index}
+        for idx, group in enumerate(shards):
+            for pair in group:
+                if pair in self.shard_of:
+                    raise ValueError(f"{pair} is assigned to more than one shard")
+                self.shard_of[pair] = idx
+        self.shard_count = len(shards)
+        self.endpoints = [f"tcp://127.0.0.1:{base_port + idx}" for idx in range(len(shards))]
+        self.order_shards = OrderedDict()  # {(SenderCompID, OrderID): shard index}, oldest first, bounded
+        self.max_tracked = max_tracked
+        self.routed = [0] * len(shards)
+        self.broadcasts = 0
+
+    def _track(self, sender_comp_id, order_id, shard) -> Optional[int]:
+        # Returns the shard the same order key was on before, if it was another one
+        key = (sender_comp_id, order_id)
+        previous = self.order_shards.pop(key, None)
+        self.order_shards[key] = shard
+        if len(self.order_shards) > self.max_tracked:
+            self.order_shards.popitem(last=False)  # its cancel will be broadcast
+        return previous if previous != shard else None
+
+    def _order(self, frame, pair, sender_comp_id, order_id):
+        shard = self.shard_of.get(pair)
+        if shard is None:
+            return [], f"Unknown trading pair: {pair}"
+        targets = []
+        previous = self._track(sender_comp_id, order_id, shard)
+        if previous is not None:
+            # A single engine replaces an order resent with the same OrderID; across shards the old one
+            # has to be cancelled explicitly
+            targets.append((previous, f"1;49={sender_comp_id};37={order_id}".encode()))
+        targets.append((shard, frame))
+        return targets, None
+
+    def _cancel(self, frame, sender_comp_id, order_id):
+        shard = self.order_shards.pop((sender_comp_id, order_id), None) if sender_comp_id else None
+        if shard is None:
+            return self._broadcast(frame)
+        return [(shard, frame)], None
+
+    def _pair(self, frame, pair):
+        shard = self.shard_of.get(pair)
+        if shard is None:
+            return [], f"Unknown trading pair: {pair}"
+        return [(shard, frame)], None
+
+    def _broadcast(self, frame):
+        self.broadcasts += 1
+        return [(shard, frame) for shard in range(self.shard_count)], None
+
+    def route(self, frame: bytes) -> Tuple[List[Tuple[int, bytes]], Optional[str]]:
+        """
+        Returns ([(shard index, frame to send)], error). error is set when the message can't be routed.
+        """
+        try:
+            return self._route(frame)
+        except ValueError as e:  # wire.FrameError or text that isn't UTF-8, the router must keep running
+            return [], f"Malformed message: {e}"
+
+    def _route(self, frame: bytes) -> Tuple[List[Tuple[int, bytes]], Optional[str]]:
+        if wire.is_binary(frame):
+            kind = wire.frame_kind(frame)
+            if kind == wire.KIND_ORDER:
+                fields = wire.unpack_order(frame)
+                return self._order(frame, fields[9], fields[5], fields[1])
+            if kind == wire.KIND_CANCEL:
+                sender_comp_id, order_id = wire.unpack_cancel(frame)
+                return self._cancel(frame, sender_comp_id, order_id)
+            return [], f"Unexpected binary frame kind {kind}"
+
+        update = frame.decode()
+        msg_type = update.split(';', 1)[0]
+        if msg_type == "0":
+            fields = decode(update)
+            return self._order(frame, fields.get('55'), fields.get('49'), fields.get('37'))
+        if msg_type == "1":
+            fields = decode(update)
+            return self._cancel(frame, fields.get('49'), fields.get('37'))
+        if msg_type == "2":  # 2;order_book;PAIR[;depth=N]
+            segments = update.split(';')
+            return self._pair(frame, segments[2] if len(segments) > 2 else None)
+        if msg_type == "3":
+            return self._pair(frame, decode(update).get('55'))
+        if msg_type == "5":  # search_order: a user's orders may rest on every shard
+            return self._broadcast(frame)
+        if msg_type in ("6", "7"):  # stats and profiling: one answer per shard
+            return self._broadcast(frame)
+        return [(0, frame)], None  # anything else gets the single engine's echo, once
+
+    @staticmethod
+    def sender(frame: bytes) -> Optional[str]:
+        # SenderCompID of a routed message, for its route_error; only looked up on errors
+        try:
+            if wire.is_binary(frame):
+                kind = wire.frame_kind(frame)
+                if kind == wire.KIND_ORDER:
+                    return wire.unpack_order(frame)[5]
+                return wire.unpack_cancel(frame)[0] if kind == wire.KIND_CANCEL else None
+            return decode(frame.decode()).get('49')
+        except ValueError:  # a malformed message's error goes to the public topic
+            return None
+
+    def run(self, context: zmq.Context):
+        orders = context.socket(zmq.SUB)
+        orders.bind("tcp://127.0.0.1:5557")
+        orders.setsockopt_string(zmq.SUBSCRIBE, "")
+        shards = []
+        for endpoint in self.endpoints:
+            shard = context.socket(zmq.PUSH)  # PUSH queues while a shard starts instead of dropping
+            shard.connect(endpoint)
+            shards.append(shard)
+        errors = context.socket(zmq.PUB)
+        errors.connect("tcp://127.0.0.1:5558")
+        errors.connect(ACK_PROXY_ENDPOINT)
+
+        logger.info("Routing orders on :5557 to %d shards", len(shards))
+        try:
+            while True:
+                frame = orders.recv()
+                targets, error = self.route(frame)
+                if error:
+                    logger.warning("%s: %r", error, frame[:200])
+                    sender = self.sender(frame)
+                    errors.send_multipart((ack_topic(sender) if sender else PUBLIC_ACK_TOPIC,
+                                           f"route_error;{error}".encode()))
+                for shard, payload in targets:
+                    shards[shard].send(payload)
+                    self.routed[shard] += 1
+        finally:
+            logger.info("Routed per shard: %s, broadcasts: %d", self.routed, self.broadcasts)
+
+
+def run_proxy(context: zmq.Context, frontend_endpoint: str, backend_endpoint: str):
+    # Shards connect to the XSUB side; dashboards and clients keep subscribing to the single engine's port
+    frontend = context.socket(zmq.XSUB)
+    frontend.bind(frontend_endpoint)
+    backend = context.socket(zmq.XPUB)
+    backend.bind(backend_endpoint)
+    try:
+        zmq.proxy(frontend, backend)
+    except zmq.ContextTerminated:
+        pass
+
+
+def run_shard(args, index: int, instruments: List[str], order_endpoint: str):
+    # Entry point of each shard process
+    setup_logging(args.log_level, f"{args.log_file}.shard-{index}" if args.log_file else None,
+                  console=not args.quiet, file_level=args.log_file_level, fmt=f"[shard {index}] %(message)s")
+    overrides = dict(instruments=instruments, order_endpoint=order_endpoint, delta_endpoint=DELTA_PROXY_ENDPOINT,
+                     ack_feed_endpoint=ACK_PROXY_ENDPOINT)
+    if args.journal_dir:
+        overrides['journal_dir'] = os.path.join(args.journal_dir, f"shard-{index}")
+    if args.trade_spill_dir:
+        overrides['trade_spill_dir'] = os.path.join(args.trade_spill_dir, f"shard-{index}")
+    overrides['profile_dir'] = os.path.join(args.profile_dir, f"shard-{index}")
+    engine_from_args(args, **overrides).run()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def parse_shards(specs: List[str]) -> List[List[str]]:
+    return [[pair.strip().upper() for pair in spec.split(',') if pair.strip()] for spec in specs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trade matching engine, one process per group of instruments")
+    parser.add_argument("--shard", action="append", required=True, metavar="PAIR[,PAIR...]",
+                        help="instruments matched by one shard process, repeat once per shard")
+    parser.add_argument("--shard-base-port", type=int, default=SHARD_BASE_PORT,
+                        help="shard i receives routed orders on tcp://127.0.0.1:<base+i>")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    setup_logging(args.log_level, args.log_file, console=not args.quiet, file_level=args.log_file_level,
+                  fmt="[router] %(message)s")
+    shards = parse_shards(args.shard)
+    router = OrderRouter(shards, args.shard_base_port)
+
+    context = zmq.Context()
+    threading.Thread(target=run_proxy, args=(context, ACK_PROXY_ENDPOINT, ACK_FEED_ENDPOINT),
+                     name="ack-proxy", daemon=True).start()
+    if args.deltas or args.metrics_every:
+        threading.Thread(target=run_proxy, args=(context, DELTA_PROXY_ENDPOINT, "tcp://127.0.0.1:5559"),
+                         name="delta-proxy", daemon=True).start()
+
+    # spawn: each shard is a fresh interpreter with its own GIL, nothing inherited from the router
+    spawn = multiprocessing.get_context("spawn")
+    processes = [spawn.Process(target=run_shard, args=(args, idx, group, router.endpoints[idx]),
+                               name=f"shard-{idx}", daemon=True)
+                 for idx, group in enumerate(shards)]
+    for process, group in zip(processes, shards):
+        process.start()
+        logger.info("Started %s for %s (pid %d)", process.name, ",".join(group), process.pid)
+    # A plain kill would leave the shards running, daemon processes are only reaped on a normal exit
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        router.run(context)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
+
+# poetry run python sharded_exchange.py --shard BTCUSDT --shard ETHUSDT
+# poetry run python sharded_exchange.py --shard BTCUSDT,ETHUSDT --shard SOLUSDT,BNBUSDT --quote-mode top --deltas
@@ -0,0 +1,103 @@
+import re
+from functools import lru_cache
+from typing import Dict
+
+# Codec for the `tag=value;` messages shared by the streamer, exchange, client and ack viewer.
+
+MARKET_DATA_TOPIC = "Q "
+BOOK_DELTA_TOPIC = "D "  # followed by "{instrument};{json delta}"
+METRICS_TOPIC = "M "  # followed by the engine stats json
+PUBLIC_ACK_TOPIC = b"*;"  # ack bus messages no single SenderCompID owns
+
+# Field order of each message type, as written by the to_string methods
+ORDER_TAGS = ('35', '49', '37', '38', '40', '44', '52', '54', '6404', '55', '151')
+ACK_TAGS = ('35', '56', '37', '38', '44')
+EXTENDED_ACK_TAGS = ACK_TAGS + ('1000', '151')
+QUOTE_KEYS = ('instrument', 'update_id', 'best_bid_price', 'best_bid_qty', 'best_ask_price', 'best_ask_qty',
+              'transaction_time', 'event_time')
+
+_TWO_EQUALS = re.compile('=[^;]*=')  # a segment that is not just tag=value
+
+TAG_NAMES = {
+    '35': 'Message Type',
+    '49': 'Sender Comp ID',
+    '56': 'Target Comp ID',
+    '37': 'Order ID',
+    '38': 'Order Quantity',
+    '40': 'Order Type',
+    '44': 'Price',
+    '52': 'Sending Time',
+    '54': 'Side',
+    '6404': 'POV Target Percentage',
+    '55': 'Trading Pair',
+    '1000': 'Action Price',
+    '151': 'Leaves Quantity'
+}
+
+
+def decode(msg: str) -> Dict[str, str]:
+    """
+    Decode the tag=value segments of a message. Leading bare segments such as the msg_type
+    ("0;35=D;...") and a trailing ';' are skipped. A value holding '=' keeps it, like any
+    other malformed message it goes through the per-segment path.
+    """
+    if msg.endswith(';'):
+        msg = msg[:-1]
+    first = msg.find('=')
+    if first < 0:
+        return {}
+    bare = msg.count(';', 0, first)
+    # With as many '=' as segments after the bare ones, a bare or empty segment after the first tag
+    # means another segment holds two '=', which the search finds
+    if msg.count(';') + 1 - bare != msg.count('=') or _TWO_EQUALS.search(msg, first) is not None:
+        return _decode_segments(msg, keep_bare=False)
+    # Every remaining segment is exactly tag=value: one split tokenizes the whole message
+    # and zip pairs tags with values without building per-segment lists.
+    start = msg.rfind(';', 0, first) + 1
+    tokens = iter(msg[start:].replace('=', ';').split(';'))
+    return dict(zip(tokens, tokens))
+
+
+def decode_segments(msg: str) -> Dict[str, str]:
+    """
+    Decode every segment of a message, bare segments map to ''. For display, not the hot path.
+    """
+    return _decode_segments(msg, keep_bare=True)
+
+
+def _decode_segments(msg: str, keep_bare: bool) -> Dict[str, str]:
+    fields = {}
+    for segment in msg.split(';'):
+        key, sep, value = segment.partition('=')
+        if sep or (keep_bare and key):
+            fields[key] = value
+    return fields
+
+
+def decode_market_data(msg: str) -> Dict[str, str]:
+    if msg.startswith(MARKET_DATA_TOPIC):
+        msg = msg[len(MARKET_DATA_TOPIC):]
+    return decode(msg)
+
+
+@lru_cache(maxsize=4096)
+def ack_topic(sender_comp_id: str) -> bytes:
+    # First frame of every ack bus message, clients subscribe to their own. The ';' keeps USER1 from
+    # also matching USER10, SenderCompIDs never contain one.
+    return f"{sender_comp_id};".encode()
+
+
+def quote_topic(instrument: str) -> str:
+    # Prefix of every text quote for one instrument, as written by encode_quote
+    return f"{MARKET_DATA_TOPIC}instrument={instrument};"
+
+
+def encode(fields: Dict[str, object]) -> str:
+    return ';'.join([f"{key}={value}" for key, value in fields.items()])
+
+
+def encode_quote(instrument: str, row) -> str:
+    # row is a bookTicker CSV row in QUOTE_KEYS order after the instrument.
+    # A literal f-string beats any prebuilt template here, so the field names are spelled out.
+    return (f"instrument={instrument};update_id={row[0]};best_bid_price={row[1]};best_bid_qty={row[2]};"
+            f"best_ask_price={row[3]};best_ask_qty={row[4]};transaction_time={row[5]};event_time={row[6]};")
@@ -0,0 +1,222 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+from typing import Dict, List, Optional, Tuple
+
+_time = attrgetter('ExecTime')
+_id = attrgetter('TradeID')
+
+
+class Trade:
+    __slots__ = ('TradeID', 'ExecTime', 'TradingPair', 'SenderCompID', 'OrderID', 'Side', 'OrderQty',
+                 'Price', 'ActionPrice', 'OrdType', 'POVTargetPercentage')
+
+    def __init__(self, trade_id: int, exec_time: int, trading_pair: str, sender_comp_id: str, order_id: str,
+                 side: str, order_qty: float, price: float, action_price: float, ord_type: str,
+                 pov_target_percentage: float):
+        self.TradeID = trade_id
+        self.ExecTime = exec_time  # ms since epoch, never decreases across the store
+        self.TradingPair = trading_pair
+        self.SenderCompID = sender_comp_id
+        self.OrderID = order_id
+        self.Side = side
+        self.OrderQty = order_qty
+        self.Price = price  # trigger price the order was placed with
+        self.ActionPrice = action_price  # market price it executed at
+        self.OrdType = ord_type
+        self.POVTargetPercentage = pov_target_percentage
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(*(data[name] for name in cls.__slots__))
+
+
+_fields = attrgetter(*Trade.__slots__)  # a trade's values in Trade.__init__ order
+
+
+class SpillSegment:
+    # Trades evicted from memory together: one line per (instrument, user), a JSON array of its trades' fields
+    __slots__ = ('path', 'first_id', 'last_id', 'first_time', 'last_time', 'keys', 'trades')
+
+    def __init__(self, path: str, trades: List[Trade]):
+        self.path = path
+        self.first_id = trades[0].TradeID
+        self.last_id = trades[-1].TradeID
+        self.first_time = trades[0].ExecTime
+        self.last_time = trades[-1].ExecTime
+        # {key: (offset, length)} of the key's lines in the file, lets queries skip the file or read only their part
+        self.keys = dict.fromkeys({(trade.TradingPair, trade.SenderCompID) for trade in trades})
+        self.trades = trades  # until write() is done, queries are answered from here
+
+    def write(self) -> None:
+        groups = {}
+        for trade in self.trades:
+            groups.setdefault((trade.TradingPair, trade.SenderCompID), []).append(trade)
+        keys = {}
+        chunks = []
+        offset = 0
+        for key, trades in groups.items():
+            data = (json.dumps(list(map(_fields, trades))) + '\n').encode()
+            chunks.append(data)
+            keys[key] = (offset, len(data))
+            offset += len(data)
+        # One write: each blocking call gives up the GIL, and getting it back from a busy engine thread takes a while
+        with open(self.path, 'wb') as file:
+            file.write(b''.join(chunks))
+        self.keys = keys
+        self.trades = None
+
+    def to_meta(self) -> dict:
+        return {'path': self.path, 'first_id': self.first_id, 'last_id': self.last_id, 'first_time': self.first_time,
+                'last_time': self.last_time, 'keys': sorted([*key, *span] for key, span in self.keys.items())}
+
+    @classmethod
+    def from_meta(cls, meta: dict):
+        # Rebuilt from a snapshot without reading the file
+        segment = cls.__new__(cls)
+        for name in ('path', 'first_id', 'last_id', 'first_time', 'last_time'):
+            setattr(segment, name, meta[name])
+        segment.keys = {(pair, sender): (offset, length) for pair, sender, offset, length in meta['keys']}
+        segment.trades = None
+        return segment
+
+    def read(self, key: Tuple[str, str]) -> List[Trade]:
+        # The trades of one key, oldest first
+        trades = self.trades
+        if trades is not None:
+            return [trade for trade in trades if (trade.TradingPair, trade.SenderCompID) == key]
+        offset, length = self.keys[key]
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            data = file.read(length)
+        return [Trade(*fields) for fields in json.loads(data)]
+
+
+class TradeStore:
+    """
+    Executed trades, indexed by (instrument, user) and by time.
+
+    Trades are appended in TradeID and ExecTime order, so every index is a sorted list searched
+    with bisect. At most max_in_memory trades stay resident, the oldest are spilled to JSON-lines
+    segment files under spill_dir (a temporary directory unless given) and read back only by
+    queries reaching that far back. record() only trims the indexes when it spills, the file is
+    written by a background thread and queried from memory until it is done.
+    """
+
+    def __init__(self, max_in_memory: int = 100_000, spill_dir: Optional[str] = None):
+        self.max_in_memory = max_in_memory
+        self.spill_dir = spill_dir
+        self.trades = []  # in memory, oldest first
+        self.by_user = {}  # {(TradingPair, SenderCompID): [Trade]}, oldest first
+        self.segments = []  # [SpillSegment], oldest first
+        self.spiller = None  # thread writing the newest segment
+        self.next_id = 1
+        self.last_time = 0
+
+    def __len__(self) -> int:
+        return self.next_id - 1
+
+    def record(self, trading_pair, sender_comp_id, order_id, side, order_qty, price, action_price, ord_type,
+               pov_target_percentage, exec_time: Optional[int] = None) -> Trade:
+        exec_time = int(time.time() * 1000) if exec_time is None else exec_time
+        trade = Trade(self.next_id, max(self.last_time, exec_time), trading_pair, sender_comp_id, order_id, side,
+                      order_qty, price, action_price, ord_type, pov_target_percentage)
+        self.restore(trade)
+        return trade
+
+    def restore(self, trade: Trade) -> None:
+        # Appends a trade that already has its TradeID and ExecTime, e.g. one replayed from the journal
+        self.next_id = trade.TradeID + 1
+        self.last_time = max(self.last_time, trade.ExecTime)  # a clock step back must not break the time order
+        self.trades.append(trade)
+        self.by_user.setdefault((trade.TradingPair, trade.SenderCompID), []).append(trade)
+        if len(self.trades) > self.max_in_memory:
+            self._spill()
+
+    def meta(self) -> dict:
+        # Everything but the in-memory trades themselves, for snapshots, which must not name a segment not yet written
+        self.join_spill()
+        return {'next_id': self.next_id, 'last_time': self.last_time, 'spill_dir': self.spill_dir,
+                'segments': [segment.to_meta() for segment in self.segments]}
+
+    def load_meta(self, meta: dict) -> None:
+        self.next_id = meta['next_id']
+        self.last_time = meta['last_time']
+        self.spill_dir = self.spill_dir or meta['spill_dir']
+        self.segments = [SpillSegment.from_meta(segment) for segment in meta['segments']
+                         if os.path.exists(segment['path'])]
+
+    def _spill(self) -> None:
+        # Evict the older half in one go so the per-key index trimming is amortized
+        count = max(1, len(self.trades) // 2)
+        evicted = self.trades[:count]
+        del self.trades[:count]
+        last_id = evicted[-1].TradeID
+        for key in {(trade.TradingPair, trade.SenderCompID) for trade in evicted}:
+            trades = self.by_user[key]
+            del trades[:bisect_right(trades, last_id, key=_id)]
+            if not trades:
+                del self.by_user[key]
+
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='trades-')
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f'trades-{evicted[0].TradeID:012d}-{last_id:012d}.jsonl')
+        segment = SpillSegment(path, evicted)
+        self.segments.append(segment)
+        self.join_spill()  # only waits if trades arrive faster than half the store is written
+        self.spiller = threading.Thread(target=segment.write, name="trade-spill", daemon=True)
+        self.spiller.start()
+
+    def join_spill(self) -> None:
+        if self.spiller is not None:
+            self.spiller.join()
+            self.spiller = None
+
+    def query(self, trading_pair: str, sender_comp_id: str, since: Optional[int] = None, until: Optional[int] = None,
+              limit: int = 100, cursor: Optional[int] = None) -> Tuple[List[Trade], Optional[int]]:
+        """
+        Trades of one user on one instrument with since <= ExecTime <= until, oldest first, at most limit.
+        cursor is the next_cursor of the previous page. Returns (trades, next_cursor), next_cursor is None
+        on the last page.
+        """
+        if limit < 1:
+            return [], cursor
+        key = (trading_pair, sender_comp_id)
+        after_id = cursor or 0
+        result = []
+        for segment in self.segments:
+            if len(result) > limit:
+                break
+            if (segment.last_id <= after_id or key not in segment.keys
+                    or (since is not None and segment.last_time < since)
+                    or (until is not None and segment.first_time > until)):
+                continue
+            result.extend(self._select(segment.read(key), since, until, after_id, limit + 1 - len(result)))
+        if len(result) <= limit:
+            trades = self.by_user.get(key, [])
+            result.extend(self._select(trades, since, until, after_id, limit + 1 - len(result)))
+
+        if len(result) > limit:  # one extra trade was fetched to tell whether another page exists
+            del result[limit:]
+            return result, result[-1].TradeID
+        return result, None
+
+    @staticmethod
+    def _select(trades, since, until, after_id, count) -> List[Trade]:
+        start = bisect_right(trades, after_id, key=_id)
+        if since is not None:
+            start = max(start, bisect_left(trades, since, key=_time))
+        stop = len(trades) if until is None else bisect_right(trades, until, key=_time)
+        return trades[start:min(stop, start + count)]
+
+    def query_dict(self, trading_pair, sender_comp_id, **params) -> Dict[str, object]:
+        trades, next_cursor = self.query(trading_pair, sender_comp_id, **params)
+        return {'trades': [trade.to_dict() for trade in trades], 'next_cursor': next_cursor}
@@ -0,0 +1,161 @@
+import struct
+from typing import Optional, Tuple
+
+from tag_codec import MARKET_DATA_TOPIC, encode_quote
+
+# Fixed-layout binary frames for orders, cancels, acks and market data.
+# Every binary frame carries MAGIC, a byte that can never start (or follow the "Q" topic of)
+# a UTF-8 tag=value message, so receivers accept both encodings on the same socket.
+
+ENCODINGS = ("text", "binary")
+
+MAGIC = 0xB7
+
+KIND_ORDER = 1
+KIND_CANCEL = 2
+KIND_ACK = 3
+KIND_QUOTE = 4
+
+PRICE_SCALE = 100_000_000  # prices and quantities travel as int64 fixed point, 8 decimals
+NONE_VALUE = -(2 ** 63)  # int64 sentinel for a missing price/qty/action price
+ID_WIDTH = 16  # bytes of the SenderCompID/TargetCompID and OrderID fields
+
+# <magic, kind, 35, 49, 37, 55, 40, 54, 38, 44, 52, 6404>
+ORDER_STRUCT = struct.Struct('<BBc16s16s12sccqqqq')
+# <magic, kind, 49, 37>
+CANCEL_STRUCT = struct.Struct('<BB16s16s')
+# <magic, kind, 35, 56, 37, 38, 44, 1000, 151>
+ACK_STRUCT = struct.Struct('<BBc16s16sqqqq')
+# <"Q", magic, kind, instrument, update_id, bid price, bid qty, ask price, ask qty, transaction_time, event_time>
+QUOTE_STRUCT = struct.Struct('<cBB12sqqqqqqq')
+
+_TOPIC = MARKET_DATA_TOPIC[0].encode()
+_MAGIC = bytes([MAGIC])
+
+
+class FrameError(ValueError):
+    # A frame that is too short or too long for its kind; receivers log and drop it
+    pass
+
+
+def is_binary(frame: bytes) -> bool:
+    # Slices, not indexes: an empty frame is just not binary
+    return frame[:1] == _MAGIC or (frame[:1] == _TOPIC and frame[1:2] == _MAGIC)
+
+
+def frame_kind(frame: bytes) -> Optional[int]:
+    kind = frame[1:2] if frame[:1] == _MAGIC else frame[2:3]
+    return kind[0] if kind else None
+
+
+def _unpack(frame: bytes, layout: struct.Struct, name: str) -> tuple:
+    if len(frame) != layout.size:
+        raise FrameError(f"{name} frame of {len(frame)} bytes, expected {layout.size}")
+    return layout.unpack(frame)
+
+
+def _fixed(value: Optional[float]) -> int:
+    return NONE_VALUE if value is None else round(value * PRICE_SCALE)
+
+
+def _float(value: int) -> Optional[float]:
+    return None if value == NONE_VALUE else value / PRICE_SCALE
+
+
+def _field(value: str, width: int) -> bytes:
+    raw = value.encode()
+    if len(raw) > width:
+        raise ValueError(f"{value!r} does not fit the {width}-byte binary field")
+    return raw
+
+
+def fits_ack(target_comp_id: str, order_id: str) -> bool:
+    # False when pack_ack would raise, an order has to be turned away before it is booked
+    return len(target_comp_id.encode()) <= ID_WIDTH and len(order_id.encode()) <= ID_WIDTH
+
+
+def _text(raw: bytes) -> str:
+    return raw.rstrip(b'\0').decode()
+
+
+def pack_order(msg_type: str, order_id: str, order_qty: float, ord_type: str, price: float,
+               sender_comp_id: str, sending_time: int, side: str, pov_target_percentage: float,
+               trading_pair: str) -> bytes:
+    # Same argument order as Order.__init__
+    return ORDER_STRUCT.pack(MAGIC, KIND_ORDER, msg_type.encode(), _field(sender_comp_id, 16), _field(order_id, 16),
+                             _field(trading_pair, 12), ord_type.encode(), side.encode(), _fixed(order_qty),
+                             _fixed(price), sending_time, _fixed(pov_target_percentage))
+
+
+def unpack_order(frame: bytes) -> tuple:
+    # Returns the Order.__init__ arguments
+    (_, _, msg_type, sender, order_id, pair, ord_type, side,
+     qty, price, sending_time, pov) = _unpack(frame, ORDER_STRUCT, "order")
+    return (msg_type.decode(), _text(order_id), _float(qty), ord_type.decode(), _float(price),
+            _text(sender), sending_time, side.decode(), _float(pov), _text(pair))
+
+
+def pack_cancel(sender_comp_id: str, order_id: str) -> bytes:
+    return CANCEL_STRUCT.pack(MAGIC, KIND_CANCEL, _field(sender_comp_id, 16), _field(order_id, 16))
+
+
+def unpack_cancel(frame: bytes) -> Tuple[str, str]:
+    _, _, sender, order_id = _unpack(frame, CANCEL_STRUCT, "cancel")
+    return _text(sender), _text(order_id)
+
+
+def pack_ack(target_comp_id: str, msg_type: str, order_id: str, order_qty: float, price: float,
+             action_price: Optional[float] = None, leaves_qty: Optional[float] = None) -> bytes:
+    # Same argument order as Ack/ExtendedAck.__init__
+    return ACK_STRUCT.pack(MAGIC, KIND_ACK, msg_type.encode(), _field(target_comp_id, 16), _field(order_id, 16),
+                           _fixed(order_qty), _fixed(price), _fixed(action_price), _fixed(leaves_qty))
+
+
+def unpack_ack(frame: bytes) -> tuple:
+    _, _, msg_type, target, order_id, qty, price, action_price, leaves_qty = _unpack(frame, ACK_STRUCT, "ack")
+    return (_text(target), msg_type.decode(), _text(order_id), _float(qty), _float(price), _float(action_price),
+            _float(leaves_qty))
+
+
+def pack_quote(instrument: str, update_id: int, bid_price: Optional[float], bid_qty: Optional[float],
+               ask_price: Optional[float], ask_qty: Optional[float], transaction_time: int, event_time: int) -> bytes:
+    return QUOTE_STRUCT.pack(_TOPIC, MAGIC, KIND_QUOTE, _field(instrument, 12), update_id, _fixed(bid_price),
+                             _fixed(bid_qty), _fixed(ask_price), _fixed(ask_qty), transaction_time, event_time)
+
+
+def quote_topic(instrument: str) -> bytes:
+    # Prefix of every binary quote for one instrument; the padded field makes it an exact match
+    return QUOTE_STRUCT.pack(_TOPIC, MAGIC, KIND_QUOTE, _field(instrument, 12), 0, 0, 0, 0, 0, 0, 0)[:15]
+
+
+def unpack_quote(frame: bytes) -> tuple:
+    # (instrument, update_id, bid_price, bid_qty, ask_price, ask_qty, transaction_time, event_time)
+    (_, _, _, instrument, update_id, bid_price, bid_qty, ask_price, ask_qty,
+     transaction_time, event_time) = _unpack(frame, QUOTE_STRUCT, "quote")
+    return (_text(instrument), update_id, _float(bid_price), _float(bid_qty), _float(ask_price), _float(ask_qty),
+            transaction_time, event_time)
+
+
+def to_text(frame: bytes) -> str:
+    """
+    Render a binary frame as the equivalent tag=value message, for display and logging.
+    """
+    kind = frame_kind(frame)
+    if kind == KIND_ORDER:
+        (msg_type, order_id, qty, ord_type, price, sender, sending_time, side, pov, pair) = unpack_order(frame)
+        return f"0;35={msg_type};49={sender};37={order_id};38={qty};40={ord_type};44={price};52={sending_time};" \
+               f"54={side};6404={pov};55={pair}"
+    if kind == KIND_CANCEL:
+        sender, order_id = unpack_cancel(frame)
+        return f"1;49={sender};37={order_id}"
+    if kind == KIND_ACK:
+        target, msg_type, order_id, qty, price, action_price, leaves_qty = unpack_ack(frame)
+        text = f"35={msg_type};56={target};37={order_id};38={qty};44={price}"
+        if action_price is not None:
+            text = f"{text};1000={action_price}"
+        return text if leaves_qty is None else f"{text};151={leaves_qty}"
+    if kind == KIND_QUOTE:
+        instrument, *row = unpack_quote(frame)
+        row = ['' if value is None else value for value in row]
+        return f"{MARKET_DATA_TOPIC}{encode_quote(instrument, row)}"
+    raise ValueError(f"Unknown binary frame kind: {kind}")
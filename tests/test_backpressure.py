@@ -0,0 +1,94 @@
+import logging
+import time
+
+import zmq
+
+import wire
+from exchange import TradeMatchingEngine, conflation_key
+from tag_codec import encode_quote
+
+logging.disable(logging.WARNING)
+
+
+def text_quote(instrument, update_id, bid):
+    return ("Q " + encode_quote(instrument, [update_id, bid, 1.0, bid + 1, 1.0, 1, 1])).encode()
+
+
+def binary_quote(instrument, update_id, bid):
+    return wire.pack_quote(instrument, update_id, bid, 1.0, bid + 1, 1.0, 1, 1)
+
+
+def test_conflation_key_is_per_instrument():
+    assert conflation_key(text_quote("BTCUSDT", 1, 100.0)) == conflation_key(text_quote("BTCUSDT", 2, 101.0))
+    assert conflation_key(text_quote("BTCUSDT", 1, 100.0)) != conflation_key(text_quote("BTCUSD", 1, 100.0))
+    assert conflation_key(binary_quote("BTCUSDT", 1, 100.0)) == conflation_key(binary_quote("BTCUSDT", 2, 101.0))
+    assert conflation_key(binary_quote("BTCUSDT", 1, 100.0)) != conflation_key(binary_quote("ETHUSDT", 1, 100.0))
+
+
+def test_conflation_keeps_latest_quote_per_instrument():
+    engine = TradeMatchingEngine(quote_mode="top", conflate=True)
+    context = zmq.Context()
+    pull = context.socket(zmq.PULL)
+    pull.bind("inproc://market")
+    push = context.socket(zmq.PUSH)
+    push.connect("inproc://market")
+    try:
+        frames = [text_quote("BTCUSDT", 1, 100.0), text_quote("ETHUSDT", 1, 10.0), binary_quote("SOLUSDT", 1, 1.0),
+                  text_quote("BTCUSDT", 2, 101.0), binary_quote("SOLUSDT", 2, 2.0), text_quote("BTCUSDT", 3, 102.0)]
+        for frame in frames:
+            push.send(frame)
+        deadline = time.monotonic() + 5
+        while not pull.poll(0) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        handled = []
+
+        def handler(frame):
+            handled.append(frame)
+            engine._on_market_data(frame)
+        assert engine._serve_conflated(pull, handler, 1) == 3
+        assert engine._serve_conflated(pull, handler, 1) == 0  # the whole queue was drained in one pass
+    finally:
+        push.close(linger=0)
+        pull.close(linger=0)
+        context.term()
+
+    # Latest quote of each instrument, in the order the instruments were first seen
+    assert handled == [frames[5], frames[1], frames[4]]
+    assert {instrument: top.update_id for instrument, top in engine.bid_ask.top_of_book.items()} == \
+        {"BTCUSDT": 3, "ETHUSDT": 1, "SOLUSDT": 2}
+    assert engine.bid_ask.top_of_book["BTCUSDT"].bid_price == 102.0
+    assert engine.backpressure["md_conflated"] == 3
+    engine._count_market_data()
+    assert engine.backpressure["md_received"] == 6
+
+
+def test_ack_feed_subscriptions_are_drained():
+    # With ack_hwm the client feed is an XPUB, which queues every new subscription for reading
+    engine = TradeMatchingEngine(quote_mode="top", ack_hwm=10)
+    context = zmq.Context()
+    engine.ack_publisher = context.socket(zmq.PUB)
+    engine.ack_feed_publisher = context.socket(zmq.XPUB)
+    engine.ack_feed_publisher.setsockopt(zmq.XPUB_NODROP, 1)
+    engine.ack_feed_publisher.bind("inproc://acks")
+    subscribers = []
+    try:
+        for user in ("USER1", "USER2"):
+            subscriber = context.socket(zmq.SUB)
+            subscriber.connect("inproc://acks")
+            subscriber.setsockopt(zmq.SUBSCRIBE, f"{user};".encode())
+            subscribers.append(subscriber)
+        time.sleep(0.1)  # both subscriptions reach the XPUB
+        assert engine.ack_feed_publisher.poll(0)
+        poller = zmq.Poller()
+        poller.register(engine.ack_feed_publisher, zmq.POLLIN)
+        engine.poll_once(poller, 1000)
+        assert not engine.ack_feed_publisher.poll(0)
+
+        engine._send_frames([b"USER2;", b"35=3;56=USER2"])
+        assert subscribers[1].recv_multipart() == [b"USER2;", b"35=3;56=USER2"]
+        assert not subscribers[0].poll(100)
+    finally:
+        for socket in subscribers + [engine.ack_publisher, engine.ack_feed_publisher]:
+            socket.close(linger=0)
+        context.term()
@@ -0,0 +1,108 @@
+import json
+import logging
+
+import exchange
+from exchange import BidAskQueue, Order, TradeMatchingEngine
+
+logging.disable(logging.WARNING)
+
+
+def order(order_id, side, qty, price, sender="u1", pair="BTCUSDT"):
+    return Order('D', order_id, qty, '2', price, sender, 1, side, 0.0, pair)
+
+
+def apply_delta(l2, delta):
+    # What a feed client does: replace each level's row, qty 0 removes it
+    assert delta["seq"] == l2["seq"] + 1
+    for name, is_bid in (("bids", True), ("asks", False)):
+        levels = {row[0]: row for row in l2[name]}
+        for row in delta[name]:
+            if row[1]:
+                levels[row[0]] = row
+            else:
+                levels.pop(row[0], None)
+        l2[name] = sorted(levels.values(), key=lambda row: row[0], reverse=is_bid)
+    l2["seq"] = delta["seq"]
+
+
+def test_l2_is_depth_limited_and_aggregated():
+    book = BidAskQueue("top")
+    for idx, (side, qty, price) in enumerate([("1", 1.0, 99.0), ("1", 2.0, 99.0), ("1", 1.0, 98.0), ("1", 1.0, 97.0),
+                                              ("2", 1.5, 103.0), ("2", 1.0, 104.0)]):
+        book.add_client_order(order(f"o{idx}", side, qty, price))
+
+    l2 = book.get_order_book_l2("BTCUSDT", 2)
+    assert l2["bids"] == [[99.0, 3.0, 2], [98.0, 1.0, 1]]
+    assert l2["asks"] == [[103.0, 1.5, 1], [104.0, 1.0, 1]]
+    assert book.get_order_book_l2("BTCUSDT", 1)["asks"] == [[103.0, 1.5, 1]]
+
+    # In "top" mode the quote is merged into its level, or inserted as one, and the depth still holds
+    book.apply_quote("BTCUSDT", 1, 98.0, 0.5, 102.0, 2.0, 1, 1)
+    l2 = book.get_order_book_l2("BTCUSDT", 2)
+    assert l2["bids"] == [[99.0, 3.0, 2], [98.0, 1.5, 2]]
+    assert l2["asks"] == [[102.0, 2.0, 1], [103.0, 1.5, 1]]
+    assert book.get_order_book_l2("ETHUSDT", 5) == {"instrument": "ETHUSDT", "seq": 0, "bids": [], "asks": []}
+
+
+def test_deltas_are_contiguous_and_rebuild_the_book():
+    book = BidAskQueue("top", track_deltas=True)
+    l2 = book.get_order_book_l2("BTCUSDT", 100)
+    steps = [
+        lambda: book.add_client_order(order("b1", "1", 1.0, 99.0)),
+        lambda: book.add_client_order(order("b2", "1", 2.0, 99.0)),
+        lambda: book.add_client_order(order("s1", "2", 1.0, 101.0)),
+        lambda: book.cancel_order("b1", "u1"),
+        lambda: book.apply_quote("BTCUSDT", 1, 98.0, 1.0, 101.0, 3.0, 1, 1),
+        lambda: book.cancel_order("s1", "u1"),
+        lambda: book.add_client_order(order("b3", "1", 1.0, 100.0)),
+    ]
+    seqs = []
+    for step in steps:
+        step()
+        for instrument, delta in book.collect_deltas():
+            assert instrument == "BTCUSDT"
+            apply_delta(l2, delta)
+            seqs.append(delta["seq"])
+        assert l2 == book.get_order_book_l2("BTCUSDT", 100)
+
+    assert seqs == list(range(1, len(steps) + 1))
+    assert book.collect_deltas() == []  # nothing changed, no delta and no seq used up
+    assert book.get_order_book_l2("BTCUSDT", 100)["seq"] == len(steps)
+
+
+def test_deltas_per_instrument_have_their_own_seq():
+    book = BidAskQueue("top", track_deltas=True)
+    book.add_client_order(order("b1", "1", 1.0, 99.0))
+    book.add_client_order(order("e1", "1", 1.0, 9.0, pair="ETHUSDT"))
+    assert sorted((instrument, delta["seq"]) for instrument, delta in book.collect_deltas()) == \
+        [("BTCUSDT", 1), ("ETHUSDT", 1)]
+    book.cancel_order("e1", "u1")
+    assert [(instrument, delta["seq"], delta["bids"]) for instrument, delta in book.collect_deltas()] == \
+        [("ETHUSDT", 2, [[9.0, 0.0, 0]])]
+
+
+def test_book_message_cache_follows_book_version():
+    engine = TradeMatchingEngine(quote_mode="top")
+    engine.bid_ask.add_client_order(order("b1", "1", 1.0, 99.0))
+    first = engine._order_book_message("BTCUSDT", 5)
+    assert engine._order_book_message("BTCUSDT", 5) is first  # unchanged book, served from the cache
+
+    engine.bid_ask.add_client_order(order("b2", "1", 2.0, 98.0))
+    second = engine._order_book_message("BTCUSDT", 5)
+    assert second != first
+    assert json.loads(second.decode().split(";", 1)[1])["bids"] == [[99.0, 1.0, 1], [98.0, 2.0, 1]]
+    full = engine._order_book_message("BTCUSDT", None)
+    assert full.startswith(b"order_book;")
+    engine.bid_ask.apply_quote("BTCUSDT", 1, 97.0, 1.0, 101.0, 1.0, 1, 1)  # a quote moves the version too
+    assert engine._order_book_message("BTCUSDT", 5) != second
+    assert engine._order_book_message("BTCUSDT", None) != full
+
+
+def test_book_message_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(exchange, "SNAPSHOT_CACHE_SIZE", 3)
+    engine = TradeMatchingEngine(quote_mode="top")
+    hot = engine._order_book_message("BTCUSDT", 1)
+    for depth in range(2, 10):
+        engine._order_book_message("BTCUSDT", depth)
+        assert engine._order_book_message("BTCUSDT", 1) is hot  # kept while it is being asked for
+    assert list(engine._snapshot_cache) == [("BTCUSDT", 8), ("BTCUSDT", 9), ("BTCUSDT", 1)]
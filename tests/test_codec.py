@@ -0,0 +1,46 @@
+import itertools
+import random
+
+import pytest
+
+from tag_codec import _decode_segments, decode, decode_market_data, decode_segments, encode_quote
+
+
+@pytest.mark.parametrize("msg, fields", [
+    ("35=D;37=1", {"35": "D", "37": "1"}),
+    ("0;35=D;37=1", {"35": "D", "37": "1"}),  # bare leading msg_type
+    ("0;x;35=D;37=1", {"35": "D", "37": "1"}),
+    ("35=D;37=1;", {"35": "D", "37": "1"}),  # trailing ';'
+    ("35=D;x;37=a=b", {"35": "D", "37": "a=b"}),  # used to come out as {'35': 'D', 'x': '37', 'a': 'b'}
+    ("35=D;37=a=b", {"35": "D", "37": "a=b"}),
+    ("35=D;;37=1", {"35": "D", "37": "1"}),
+    ("35=D;37=", {"35": "D", "37": ""}),
+    ("nothing", {}),
+    ("", {}),
+])
+def test_decode(msg, fields):
+    assert decode(msg) == fields
+
+
+def test_decode_matches_segment_decoder():
+    # Every short message over the characters that matter, and random longer ones
+    for length in range(7):
+        for chars in itertools.product("a=;", repeat=length):
+            msg = "".join(chars)
+            assert decode(msg) == _decode_segments(msg, keep_bare=False), msg
+    rng = random.Random(7)
+    for _ in range(20000):
+        msg = "".join(rng.choice("ab1=;") for _ in range(rng.randrange(30)))
+        assert decode(msg) == _decode_segments(msg, keep_bare=False), msg
+
+
+def test_decode_segments_keeps_bare_segments():
+    assert decode_segments("0;35=D;37=1") == {"0": "", "35": "D", "37": "1"}
+
+
+def test_quote_round_trip():
+    row = ["4011717434", "30123.45", "1.204", "30123.46", "0.311", "1700000000123", "1700000000125"]
+    fields = decode_market_data("Q " + encode_quote("BTCUSDT", row))
+    assert fields == {"instrument": "BTCUSDT", "update_id": row[0], "best_bid_price": row[1], "best_bid_qty": row[2],
+                      "best_ask_price": row[3], "best_ask_qty": row[4], "transaction_time": row[5],
+                      "event_time": row[6]}
@@ -0,0 +1,98 @@
+import logging
+import os
+
+from exchange import BidAskQueue, Order
+from journal import Journal
+
+logging.disable(logging.WARNING)
+
+
+def order(order_id, side, qty, price, sender="u1", pair="BTCUSDT"):
+    return Order('D', order_id, qty, '2', price, sender, 1, side, 0.0, pair)
+
+
+def journaled_book(directory):
+    journal = Journal(directory, fsync_ms=0)
+    journal.start()
+    book = BidAskQueue("top")
+    book.journal = journal
+    return book, journal
+
+
+def recover(directory):
+    book = BidAskQueue("top")
+    for kind, values in Journal(directory).replay():
+        book.apply_record(kind, values)
+    return book
+
+
+def resting(book):
+    return {key: (order.LeavesQty, order.Price) for key, order in book.client_orders.items()}
+
+
+def test_replay_stops_at_torn_tail(tmp_path):
+    book, journal = journaled_book(tmp_path)
+    book.add_client_order(order("b1", "1", 1.0, 99.0))
+    book.add_client_order(order("b2", "1", 2.0, 98.0))
+    journal.commit()
+    journal.close()
+    # A crash in the middle of writing the next record: a full frame header, half its body
+    path, = [os.path.join(tmp_path, name) for name in os.listdir(tmp_path) if name.endswith('.log')]
+    with open(path, 'ab') as file:
+        file.write(b'\x40\x00\x00\x00\x12\x34\x56\x78partial')
+
+    assert resting(recover(tmp_path)) == {("u1", "b1"): (1.0, 99.0), ("u1", "b2"): (2.0, 98.0)}
+
+
+def test_snapshot_plus_tail_replay(tmp_path):
+    book, journal = journaled_book(tmp_path)
+    book.add_client_order(order("b1", "1", 1.0, 99.0))
+    book.add_client_order(order("s1", "2", 1.0, 105.0, "u2"))
+    journal.commit()
+    journal.snapshot(book.snapshot_records())
+    # What happens after the snapshot only lives in the new journal
+    book.add_client_order(order("b2", "1", 3.0, 97.0))
+    book.cancel_order("b1", "u1")
+    journal.commit()
+    journal.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["journal-000002.log", "snapshot-000002.snap"]
+    assert resting(recover(tmp_path)) == resting(book) == {("u2", "s1"): (1.0, 105.0), ("u1", "b2"): (3.0, 97.0)}
+
+
+def test_replay_before_snapshot_is_written(tmp_path, monkeypatch):
+    # A crash while the background write is still running: journal 2 is in use, snapshot 2 not there yet
+    monkeypatch.setattr(Journal, "_write_snapshot", lambda self, old_writer, generation, data: old_writer.close())
+    book, journal = journaled_book(tmp_path)
+    book.add_client_order(order("b1", "1", 1.0, 99.0))
+    journal.commit()
+    journal.snapshot(book.snapshot_records())
+    book.add_client_order(order("b2", "1", 2.0, 98.0))
+    journal.commit()
+    journal.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["journal-000001.log", "journal-000002.log"]
+    assert resting(recover(tmp_path)) == {("u1", "b1"): (1.0, 99.0), ("u1", "b2"): (2.0, 98.0)}
+
+
+def test_partial_fill_leaves_qty_survives_recovery(tmp_path):
+    book, journal = journaled_book(tmp_path)
+    book.add_client_order(order("s1", "2", 1.0, 100.0, "seller"))
+    book.add_client_order(order("b1", "1", 0.4, 100.0, "buyer"))
+    book.fill_orders([])
+    journal.commit()
+    assert resting(book) == {("seller", "s1"): (0.6, 100.0)}
+
+    # From the journal alone: the order is booked with its full qty, then the fill reduces it
+    from_journal = recover(tmp_path)
+    assert resting(from_journal) == resting(book)
+    assert from_journal.get_order_book_l2("BTCUSDT", 5)["asks"] == [[100.0, 0.6, 1]]
+    assert len(from_journal.trade_store) == len(book.trade_store) == 2
+
+    # From a snapshot: the order is stored with its LeavesQty, the fills before it must not reduce it again
+    journal.snapshot(book.snapshot_records())
+    journal.close()
+    from_snapshot = recover(tmp_path)
+    assert resting(from_snapshot) == resting(book)
+    assert from_snapshot.get_order_book_l2("BTCUSDT", 5)["asks"] == [[100.0, 0.6, 1]]
+    assert len(from_snapshot.trade_store) == 2
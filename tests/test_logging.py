@@ -0,0 +1,27 @@
+import json
+import logging
+
+from engine_logging import setup_logging
+
+
+def test_log_file_is_json_lines_with_tracebacks_in_msg(tmp_path):
+    path = tmp_path / "engine.log"
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    listener = setup_logging("ERROR", log_file=str(path), console=False)
+    try:
+        logger = logging.getLogger("exchange")
+        logger.error("Order %s rejected", "o1")
+        try:
+            raise ValueError("bad frame")
+        except ValueError:
+            logger.exception("Dropped frame")
+    finally:
+        listener.stop()
+        root.handlers[:], root.level = handlers, level
+
+    entries = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(entry["level"], entry["logger"]) for entry in entries] == [("ERROR", "exchange")] * 2
+    assert entries[0]["msg"] == "Order o1 rejected"
+    assert entries[1]["msg"].startswith("Dropped frame\nTraceback")
+    assert "ValueError: bad frame" in entries[1]["msg"]
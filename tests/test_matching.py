@@ -0,0 +1,89 @@
+import logging
+
+from exchange import BidAskQueue, Order, TradeMatchingEngine
+
+logging.disable(logging.WARNING)
+
+
+def order(order_id, side, qty, price, sender="u1", pair="BTCUSDT"):
+    return Order('D', order_id, qty, '2', price, sender, 1, side, 0.0, pair)
+
+
+def test_partial_fills_leave_no_dust():
+    # 0.3 - 0.1 - 0.1 - 0.1 is 2.8e-17 in floats, the last sell used to stay resting with that
+    book = BidAskQueue("top")
+    for idx in range(3):
+        book.add_client_order(order(f"s{idx}", "2", 0.1, 100.0, "seller"))
+    book.add_client_order(order("b1", "1", 0.3, 100.0, "buyer"))
+    fills = []
+    book.fill_orders(fills)
+
+    assert [(fill.OrderID, fill.OrderQty) for fill in fills if fill.TargetCompID == "seller"] == \
+        [("s0", 0.1), ("s1", 0.1), ("s2", 0.1)]
+    assert [fill.LeavesQty for fill in fills if fill.TargetCompID == "buyer"] == [0.2, 0.1, 0.0]
+    assert not book.client_orders
+    l2 = book.get_order_book_l2("BTCUSDT", 5)
+    assert l2["bids"] == [] and l2["asks"] == []
+
+
+def test_consumed_quote_leaves_booked_quote_order():
+    # In "book" mode the quote is also a booked EXCHANGE order, lifting the quote must take it out too
+    book = BidAskQueue("book")
+    book.apply_quote("BTCUSDT", 1, 100.0, 1.0, 101.0, 1.0, 1, 1)
+    book.add_client_order(order("b1", "1", 2.0, 102.0, "buyer"))
+    fills = []
+    book.fill_orders(fills)
+
+    assert [(fill.OrderQty, fill.ActionPrice, fill.LeavesQty) for fill in fills] == [(1.0, 101.0, 1.0)]
+    l2 = book.get_order_book_l2("BTCUSDT", 5)
+    assert l2["bids"] == [[102.0, 1.0, 1], [100.0, 1.0, 1]]
+    assert l2["asks"] == []
+
+
+def test_orders_with_invalid_qty_or_price_are_not_booked():
+    # A nan qty used to keep match_instrument looping forever, a negative one added to the quote qty
+    book = BidAskQueue("top")
+    book.apply_quote("BTCUSDT", 1, 100.0, 1.0, 101.0, 1.0, 1, 1)
+    for idx, (qty, price) in enumerate([(float("nan"), 101.0), (float("inf"), 101.0), (-1.0, 101.0), (0.0, 101.0),
+                                        (1.0, float("nan")), (1.0, float("inf"))]):
+        bad = order(f"b{idx}", "1", qty, price)
+        assert book.order_error(bad) is not None
+        assert not book.add_client_order(bad)
+    fills = []
+    book.fill_orders(fills)
+
+    assert not fills and not book.client_orders
+    assert book.top_of_book["BTCUSDT"].ask_qty == 1.0
+
+
+def test_engine_rejects_nan_qty_order():
+    engine = TradeMatchingEngine(quote_mode="top")
+    engine.bid_ask.apply_quote("BTCUSDT", 1, 100.0, 1.0, 101.0, 1.0, 1, 1)
+    engine._on_order_message(b"0;35=D;49=u1;37=o1;38=nan;40=2;44=101;52=1;54=1;6404=0.0;55=BTCUSDT")
+
+    replies = [payload for _, payload in engine._pending]
+    assert any(payload.startswith(b"order;Rejected: OrderQty") for payload in replies)
+    assert not any(payload.startswith(b"35=3;") for payload in replies)  # no booking ack
+    assert not engine.bid_ask.client_orders
+
+
+def test_book_side_levels_stay_in_price_order():
+    from order_book import BookSide
+    for is_bid in (True, False):
+        side = BookSide(is_bid)
+        orders = [order(f"o{idx}", "1" if is_bid else "2", 1.0, price)
+                  for idx, price in enumerate([101.0, 99.5, 100.0, 102.0, 100.0, 98.0])]
+        for resting in orders:
+            side.add(resting)
+        best_first = sorted({resting.Price for resting in orders}, reverse=is_bid)
+        assert [row[0] for row in side.depth(10)] == best_first
+        assert side.best_price() == best_first[0]
+
+        side.remove(orders[2])  # one of two orders at 100.0, the level stays
+        side.remove(orders[1])  # a level behind the best one
+        best_first.remove(99.5)
+        assert [row[:2] for row in side.depth(10)] == [[price, 1.0] for price in best_first]
+        while side.pop_best() is not None:
+            best_first.pop(0)
+            assert side.best_price() == (best_first[0] if best_first else None)
+        assert not side.keys and not side.levels
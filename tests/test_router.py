@@ -0,0 +1,72 @@
+import pytest
+
+import wire
+from sharded_exchange import OrderRouter
+
+
+def order(pair, sender="u1", order_id="o1"):
+    return f"0;35=D;49={sender};37={order_id};38=1;40=2;44=100;52=1;54=1;6404=0.0;55={pair}".encode()
+
+
+@pytest.fixture
+def router():
+    return OrderRouter([["BTCUSDT", "ETHUSDT"], ["SOLUSDT"]])
+
+
+def test_orders_go_to_the_shard_of_their_pair(router):
+    assert router.route(order("BTCUSDT")) == ([(0, order("BTCUSDT"))], None)
+    assert router.route(order("SOLUSDT", order_id="o2")) == ([(1, order("SOLUSDT", order_id="o2"))], None)
+    binary = wire.pack_order("D", "o3", 1.0, "2", 100.0, "u1", 1, "1", 0.0, "ETHUSDT")
+    assert router.route(binary) == ([(0, binary)], None)
+    assert router.route(b"2;order_book;SOLUSDT;depth=5") == ([(1, b"2;order_book;SOLUSDT;depth=5")], None)
+    assert router.route(b"3;49=u1;55=ETHUSDT") == ([(0, b"3;49=u1;55=ETHUSDT")], None)
+
+
+def test_unknown_pair_is_an_error(router):
+    targets, error = router.route(order("DOGEUSDT"))
+    assert targets == [] and error == "Unknown trading pair: DOGEUSDT"
+
+
+def test_pairs_can_only_have_one_shard():
+    with pytest.raises(ValueError):
+        OrderRouter([["BTCUSDT"], ["BTCUSDT"]])
+
+
+def test_cancel_follows_its_order(router):
+    router.route(order("SOLUSDT", order_id="o9"))
+    cancel = b"1;49=u1;37=o9"
+    assert router.route(cancel) == ([(1, cancel)], None)
+    # Forgotten once canceled, a second cancel can only be broadcast
+    assert router.route(cancel) == ([(0, cancel), (1, cancel)], None)
+    binary = wire.pack_cancel("u1", "o1")
+    router.route(order("ETHUSDT"))
+    assert router.route(binary) == ([(0, binary)], None)
+
+
+def test_resent_order_id_on_another_shard_cancels_the_old_one(router):
+    router.route(order("BTCUSDT", order_id="o5"))
+    targets, error = router.route(order("SOLUSDT", order_id="o5"))
+    assert error is None
+    assert targets == [(0, b"1;49=u1;37=o5"), (1, order("SOLUSDT", order_id="o5"))]
+
+
+def test_untracked_orders_are_broadcast_when_the_index_is_full():
+    router = OrderRouter([["BTCUSDT"], ["SOLUSDT"]], max_tracked=1)
+    router.route(order("SOLUSDT", order_id="a"))
+    router.route(order("SOLUSDT", order_id="b"))  # pushes "a" out
+    assert router.route(b"1;49=u1;37=a") == ([(0, b"1;49=u1;37=a"), (1, b"1;49=u1;37=a")], None)
+    assert router.route(b"1;49=u1;37=b") == ([(1, b"1;49=u1;37=b")], None)
+
+
+def test_broadcasts(router):
+    for frame in (b"5;search_order;u1", b"6;stats", b"7;profile;start"):
+        assert router.route(frame) == ([(0, frame), (1, frame)], None)
+    assert router.broadcasts == 3
+    assert router.route(b"9;whatever") == ([(0, b"9;whatever")], None)
+
+
+@pytest.mark.parametrize("frame", [b"\xb7", b"\xb7\x01abc", b"\xb7\x02" + b"\xff" * 32, b"0;49=\xff\xfe"])
+def test_malformed_messages_are_route_errors(router, frame):
+    targets, error = router.route(frame)
+    assert targets == [] and error
+    assert router.sender(frame) is None
@@ -0,0 +1,65 @@
+from trade_store import SpillSegment, TradeStore
+
+
+def filled_store(tmp_path, count=10, max_in_memory=4):
+    # u1 and u2 alternate on BTCUSDT, trade n executes at 1000 * n
+    store = TradeStore(max_in_memory, str(tmp_path))
+    for n in range(1, count + 1):
+        store.record("BTCUSDT", f"u{2 - n % 2}", f"o{n}", "1", 1.0, 100.0, 100.0, "2", 0.0, exec_time=1000 * n)
+    store.join_spill()
+    return store
+
+
+def ids(trades):
+    return [trade.TradeID for trade in trades]
+
+
+def test_cursor_pages_across_segments_and_memory(tmp_path):
+    store = filled_store(tmp_path)
+    assert store.segments and store.trades  # some trades spilled, some still resident
+
+    pages = []
+    cursor = None
+    while True:
+        trades, cursor = store.query("BTCUSDT", "u1", limit=2, cursor=cursor)
+        pages.append(ids(trades))
+        if cursor is None:
+            break
+    assert pages == [[1, 3], [5, 7], [9]]
+    assert ids(store.query("BTCUSDT", "u2", limit=100)[0]) == [2, 4, 6, 8, 10]
+
+
+def test_since_until_filter(tmp_path):
+    store = filled_store(tmp_path)
+    assert ids(store.query("BTCUSDT", "u1", since=3000, until=7000)[0]) == [3, 5, 7]
+    assert ids(store.query("BTCUSDT", "u2", since=3500)[0]) == [4, 6, 8, 10]
+    assert ids(store.query("BTCUSDT", "u2", until=3999)[0]) == [2]
+    assert store.query("BTCUSDT", "u1", since=11000)[0] == []
+    trades, cursor = store.query("BTCUSDT", "u1", since=2000, until=9000, limit=1, cursor=3)
+    assert (ids(trades), cursor) == ([5], 5)
+
+
+def test_unknown_key_and_empty_limit(tmp_path):
+    store = filled_store(tmp_path)
+    assert store.query("ETHUSDT", "u1") == ([], None)
+    assert store.query("BTCUSDT", "u1", limit=0, cursor=3) == ([], 3)
+
+
+def test_segment_is_queried_before_and_after_it_is_written(tmp_path):
+    store = filled_store(tmp_path, count=4, max_in_memory=100)
+    segment = SpillSegment(str(tmp_path / "segment.jsonl"), store.trades)
+    assert ids(segment.read(("BTCUSDT", "u2"))) == [2, 4]  # from memory
+    segment.write()
+    assert segment.trades is None
+    assert ids(segment.read(("BTCUSDT", "u2"))) == [2, 4]  # only u2's part of the file
+    assert ids(segment.read(("BTCUSDT", "u1"))) == [1, 3]
+
+
+def test_meta_round_trip_keeps_spilled_trades(tmp_path):
+    store = filled_store(tmp_path)
+    restored = TradeStore(4)
+    restored.load_meta(store.meta())
+    for trade in store.trades:
+        restored.restore(trade)
+    assert len(restored) == 10
+    assert ids(restored.query("BTCUSDT", "u1", since=2000)[0]) == [3, 5, 7, 9]
@@ -0,0 +1,77 @@
+import logging
+
+import pytest
+
+import wire
+from exchange import TradeMatchingEngine
+
+logging.disable(logging.WARNING)
+
+
+def test_order_round_trip():
+    args = ("D", "o1", 0.5, "2", 30000.12345678, "USER1", 1700000000000, "1", 0.0, "BTCUSDT")
+    frame = wire.pack_order(*args)
+    assert wire.is_binary(frame) and wire.frame_kind(frame) == wire.KIND_ORDER
+    assert wire.unpack_order(frame) == args
+    assert wire.to_text(frame) == "0;35=D;49=USER1;37=o1;38=0.5;40=2;44=30000.12345678;52=1700000000000;54=1;" \
+                                  "6404=0.0;55=BTCUSDT"
+
+
+def test_cancel_round_trip():
+    frame = wire.pack_cancel("USER1", "o1")
+    assert wire.frame_kind(frame) == wire.KIND_CANCEL
+    assert wire.unpack_cancel(frame) == ("USER1", "o1")
+
+
+def test_ack_round_trip_keeps_missing_values():
+    fill = wire.pack_ack("USER1", "4", "o1", 0.1, 100.0, 99.5, 0.0)
+    assert wire.unpack_ack(fill) == ("USER1", "4", "o1", 0.1, 100.0, 99.5, 0.0)
+    booked = wire.pack_ack("USER1", "3", "o1", -1, 100.0)
+    assert wire.unpack_ack(booked) == ("USER1", "3", "o1", -1.0, 100.0, None, None)
+
+
+def test_quote_round_trip_and_topic():
+    frame = wire.pack_quote("ETHUSDT", 7, 2000.5, 1.25, None, None, 11, 12)
+    assert wire.is_binary(frame) and wire.frame_kind(frame) == wire.KIND_QUOTE
+    assert wire.unpack_quote(frame) == ("ETHUSDT", 7, 2000.5, 1.25, None, None, 11, 12)
+    assert frame.startswith(wire.quote_topic("ETHUSDT"))
+    assert not frame.startswith(wire.quote_topic("ETH"))
+
+
+def test_text_and_empty_frames_are_not_binary():
+    for frame in (b"", b"Q", b"Q instrument=BTCUSDT;", b"0;35=D"):
+        assert not wire.is_binary(frame)
+    assert wire.frame_kind(b"") is None
+    assert wire.frame_kind(bytes([wire.MAGIC])) is None
+
+
+@pytest.mark.parametrize("unpack, frame", [
+    (wire.unpack_order, b"\xb7\x01abc"),
+    (wire.unpack_order, wire.pack_order("D", "o1", 1.0, "2", 1.0, "U", 1, "1", 0.0, "P") + b"x"),
+    (wire.unpack_cancel, wire.pack_cancel("U", "o1")[:-1]),
+    (wire.unpack_ack, b"\xb7\x03"),
+    (wire.unpack_quote, b"Q\xb7\x04"),
+])
+def test_malformed_frames_raise_frame_error(unpack, frame):
+    with pytest.raises(wire.FrameError):
+        unpack(frame)
+
+
+def test_ids_that_do_not_fit():
+    assert wire.fits_ack("U" * wire.ID_WIDTH, "1" * wire.ID_WIDTH)
+    assert not wire.fits_ack("USER1", "123e4567-e89b-12d3-a456-426614174000")
+    with pytest.raises(ValueError):
+        wire.pack_ack("USER1", "3", "123e4567-e89b-12d3-a456-426614174000", 1.0, 1.0)
+
+
+def test_engine_drops_malformed_frames():
+    engine = TradeMatchingEngine(quote_mode="top")
+    for frame in (b"", b"\xb7", b"\xb7\x01abc", b"\xb7\x02" + b"\xff" * 32, b"\xff\xfe", b"0;35=D;49=u1;37=o1",
+                  b"0;35=D;49=u1;37=o1;38=x;40=2;44=1;52=1;54=1;6404=0;55=BTCUSDT"):
+        engine._on_order_message(frame)
+    for frame in (b"Q\xb7\x04", b"Q\xb7", b"Q instrument=BTCUSDT;best_bid_price=x;", b"Q \xff"):
+        engine._on_market_data(frame)
+    assert not engine.bid_ask.client_orders and not engine.bid_ask.top_of_book
+
+    engine._on_order_message(wire.pack_order("D", "o2", 1.0, "2", 100.0, "u1", 1, "1", 0.0, "BTCUSDT"))
+    assert list(engine.bid_ask.client_orders) == [("u1", "o2")]  # still serving